@@ -131,6 +131,7 @@ setup(
         trac.notification.prefs = trac.notification.prefs
         trac.prefs = trac.prefs.web_ui
         trac.search = trac.search.web_ui
+        trac.search.index = trac.search.index
         trac.ticket.admin = trac.ticket.admin
         trac.ticket.batch = trac.ticket.batch
         trac.ticket.query = trac.ticket.query
@@ -146,7 +147,9 @@ setup(
         trac.web.main = trac.web.main
         trac.web.session = trac.web.session
         trac.wiki.admin = trac.wiki.admin
+        trac.wiki.cache = trac.wiki.cache
         trac.wiki.interwiki = trac.wiki.interwiki
+        trac.wiki.links = trac.wiki.links
         trac.wiki.macros = trac.wiki.macros
         trac.wiki.web_ui = trac.wiki.web_ui
         trac.wiki.web_api = trac.wiki.web_api
@@ -21,11 +21,13 @@ import unittest
 import trac.admin.api
 import trac.attachment
 import trac.perm
+import trac.search.index
 import trac.ticket.admin
 import trac.versioncontrol.admin
 import trac.versioncontrol.api
 import trac.versioncontrol.web_ui
 import trac.wiki.admin
+import trac.wiki.links
 
 from trac.admin.api import IAdminCommandProvider, get_console_locale
 from trac.admin.console import TracAdmin, TracAdminHelpMacro
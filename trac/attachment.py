@@ -32,7 +32,8 @@ from trac.core import *
 from trac.mimeview import *
 from trac.perm import IPermissionPolicy
 from trac.resource import *
-from trac.search import search_to_sql, shorten_result
+from trac.search import SearchSystem, search_to_sql, shorten_result
+from trac.timeline.api import TimelineEventCache
 from trac.util import content_disposition, create_zipinfo, file_or_std, \
                       get_reporter_id, normalize_filename
 from trac.util.datefmt import datetime_now, format_datetime, \
@@ -129,8 +130,8 @@ class ILegacyAttachmentPolicyDelegate(Interface):
 
 class AttachmentModule(Component):
 
-    implements(IRequestHandler, INavigationContributor, IWikiSyntaxProvider,
-               IResourceManager)
+    implements(IAttachmentChangeListener, IRequestHandler,
+               INavigationContributor, IWikiSyntaxProvider, IResourceManager)
 
     realm = 'attachment'
     is_valid_default_handler = False
@@ -162,6 +163,18 @@ class AttachmentModule(Component):
         recommended to leave this option disabled.
         """)
 
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        pass
+
+    def attachment_deleted(self, attachment):
+        TimelineEventCache(self.env).reset()
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        TimelineEventCache(self.env).reset()
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -291,6 +304,7 @@ class AttachmentModule(Component):
 
         The tuples are in the form (change, realm, id, filename, time,
         description, author). `change` can currently only be `created`.
+        The changes are sorted by time, newest first.
 
         FIXME: no iterator
         """
@@ -298,6 +312,7 @@ class AttachmentModule(Component):
                 self.env.db_query("""
                 SELECT type, id, filename, time, description, author
                 FROM attachment WHERE time > %s AND time < %s AND type = %s
+                ORDER BY time DESC
                 """, (to_utimestamp(start), to_utimestamp(stop), realm)):
             time = from_utimestamp(ts or 0)
             yield 'created', realm, id_, filename, time, description, author
@@ -306,13 +321,47 @@ class AttachmentModule(Component):
         """Return an event generator suitable for ITimelineEventProvider.
 
         Events are changes to attachments on resources of the given
-        `resource_realm.realm`.
+        `resource_realm.realm`, newest first.
+        """
+        return self.filter_timeline_events(req,
+            self.get_cacheable_timeline_events(resource_realm, start, stop))
+
+    def get_cacheable_timeline_events(self, resource_realm, start, stop):
+        """Return an event generator suitable for the
+        `get_cacheable_timeline_events` method of ITimelineEventProvider.
+
+        Events are changes to attachments on resources of the given
+        `resource_realm.realm`, newest first, regardless of permissions.
+
+        :since: 1.3.4
         """
         for change, realm, id_, filename, time, descr, author in \
                 self.get_history(start, stop, resource_realm.realm):
             attachment = resource_realm(id=id_).child(self.realm, filename)
-            if 'ATTACHMENT_VIEW' in req.perm(attachment):
-                yield 'attachment', time, author, (attachment, descr), self
+            yield 'attachment', time, author, (attachment, descr), self
+
+    def filter_timeline_events(self, req, events):
+        """Return the events returned by `get_cacheable_timeline_events`
+        on attachments that can be viewed by the user.
+
+        :since: 1.3.4
+        """
+        for event in events:
+            if 'ATTACHMENT_VIEW' in req.perm(event[3][0]):
+                yield event
+
+    def get_timeline_last_modified(self, resource_realm):
+        """Return a `(last_modified, count)` tuple for the attachments on
+        resources of the given `resource_realm.realm`, `last_modified`
+        being the `datetime` of the latest attachment or `None`, and
+        `count` the number of attachments.
+
+        :since: 1.3.4
+        """
+        for ts, count in self.env.db_query("""
+                SELECT MAX(time), COUNT(*) FROM attachment WHERE type=%s
+                """, (resource_realm.realm,)):
+            return (from_utimestamp(ts) if ts else None), count
 
     def render_timeline_event(self, context, field, event):
         attachment, descr = event[3]
@@ -336,18 +385,40 @@ class AttachmentModule(Component):
         the given terms.
         """
         with self.env.db_query as db:
-            sql_query, args = search_to_sql(
-                    db, ['filename', 'description', 'author'], terms)
-            for id, time, filename, desc, author in db("""
-                    SELECT id, time, filename, description, author
-                    FROM attachment WHERE type = %s AND """ + sql_query,
-                    (resource_realm.realm,) + args):
+            index_sql = SearchSystem(self.env).get_index_sql(
+                db, self.realm, terms, parent_realm=resource_realm.realm)
+            if index_sql:
+                sql, args = index_sql
+                rows = db("""
+                        SELECT parent_target, time, target, text, author, score
+                        FROM (%s) s""" % sql, args)
+            else:
+                sql_query, args = search_to_sql(
+                        db, ['filename', 'description', 'author'], terms)
+                rows = db("""
+                        SELECT id, time, filename, description, author, NULL
+                        FROM attachment WHERE type = %s AND """ + sql_query,
+                        (resource_realm.realm,) + args)
+            for id, time, filename, desc, author, score in rows:
                 attachment = resource_realm(id=id).child(self.realm, filename)
-                if 'ATTACHMENT_VIEW' in req.perm(attachment):
-                    yield (get_resource_url(self.env, attachment, req.href),
-                           get_resource_shortname(self.env, attachment),
-                           from_utimestamp(time), author,
-                           shorten_result(desc, terms))
+                result = self.get_search_result(req, attachment,
+                                                from_utimestamp(time), author,
+                                                desc, terms, score)
+                if result:
+                    yield result
+
+    def get_search_result(self, req, attachment, time, author, text, terms,
+                          score=None):
+        """Return the search result for the `attachment` resource, or
+        `None` if the attachment can't be viewed.
+
+        :since: 1.3.4
+        """
+        if 'ATTACHMENT_VIEW' in req.perm(attachment):
+            result = (get_resource_url(self.env, attachment, req.href),
+                      get_resource_shortname(self.env, attachment),
+                      time, author, shorten_result(text, terms))
+            return result if score is None else result + (score,)
 
     # IResourceManager methods
 
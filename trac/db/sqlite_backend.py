@@ -400,9 +400,15 @@ class SQLiteConnection(ConnectionBase, ConnectionWrapper):
 
     def get_table_names(self):
         rows = self.execute("""
-            SELECT name FROM sqlite_master WHERE type='table'
+            SELECT name, sql FROM sqlite_master WHERE type='table'
             """)
-        return [row[0] for row in rows]
+        # Virtual tables (e.g. full-text indexes) and their shadow tables
+        # are maintained by SQLite
+        virtual = [name for name, sql in rows
+                   if sql and sql.upper().startswith('CREATE VIRTUAL TABLE')]
+        return [name for name, sql in rows
+                if not any(name == v or name.startswith(v + '_')
+                           for v in virtual)]
 
     def has_table(self, table):
         return bool(self._get_table_info(table))
@@ -17,7 +17,7 @@
 from trac.db.schema import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 45
+db_version = 52
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -82,6 +82,23 @@ schema = [
         Column('comment'),
         Column('readonly', type='int'),
         Index(['time'])],
+    Table('wiki_head', key='name')[
+        Column('name'),
+        Column('version', type='int'),
+        Column('time', type='int64'),
+        Column('author'),
+        Index(['time'])],
+    Table('wiki_delta', key=('name', 'version'))[
+        Column('name'),
+        Column('version', type='int'),
+        Column('data')],
+    Table('wiki_link', key=('source_realm', 'source_id', 'target_realm',
+                            'target_id'))[
+        Column('source_realm'),
+        Column('source_id'),
+        Column('target_realm'),
+        Column('target_id'),
+        Index(['target_realm', 'target_id'])],
 
     # Version control cache
     Table('repository', key=('id', 'name'))[
@@ -191,6 +208,48 @@ schema = [
         Column('target'),
         Index(['sid', 'authenticated', 'class']),
         Index(['class', 'realm', 'target'])],
+    Table('notify_digest', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int64'),
+        Column('sid'),
+        Column('authenticated', type='int'),
+        Column('address'),
+        Column('realm'),
+        Column('category'),
+        Column('target'),
+        Column('author'),
+        Column('body'),
+        Index(['address'])],
+
+    # Search index
+    Table('search_index', key='id')[
+        Column('id', auto_increment=True),
+        Column('realm'),
+        Column('target'),
+        Column('parent_realm'),
+        Column('parent_target'),
+        Column('time', type='int64'),
+        Column('author'),
+        Column('title'),
+        Column('text'),
+        Index(['realm', 'target', 'parent_realm', 'parent_target'])],
+    Table('attachment_text', key=('type', 'id', 'filename'))[
+        Column('type'),
+        Column('id'),
+        Column('filename'),
+        Column('extracted', type='int'),
+        Column('text'),
+        Index(['extracted'])],
+    Table('wiki_render_cache', key='hash')[
+        Column('hash'),
+        Column('name'),
+        Column('version', type='int'),
+        Column('time', type='int64'),
+        Column('size', type='int'),
+        Column('html'),
+        Column('macros'),
+        Index(['name']),
+        Index(['time'])],
 ]
 
 
@@ -115,6 +115,19 @@ class IEmailAddressResolver(Interface):
         :return: an email address or `None`
         """
 
+    def get_addresses_for_sessions(sessions):
+        """Map several sessions to e-mail addresses at once.
+
+        This method is optional. When implemented, it is called instead
+        of `get_address_for_session` so that all the recipients of an
+        event can be resolved in bulk.
+
+        :param sessions: a list of `(sid, authenticated)` tuples
+        :return: a dictionary mapping `(sid, authenticated)` tuples to
+                 email addresses, for the sessions that could be resolved
+        :since: 1.3.4
+        """
+
 
 class IEmailDecorator(Interface):
     def decorate_message(event, message, charset):
@@ -401,13 +414,18 @@ class NotificationSystem(Component):
 
         :return: a list of (sid, authenticated, address, transport, format)
         """
+        if event.category == 'batchmodify':
+            # Load the tickets once rather than once per subscriber. The
+            # subscribers are still asked once per ticket, as each one
+            # looks up the subscriptions of the sessions of that ticket.
+            events = list(event.get_ticket_change_events(self.env))
+        else:
+            events = [event]
         subscriptions = []
         for subscriber in self.subscribers:
-            if event.category == 'batchmodify':
-                for ticket_event in event.get_ticket_change_events(self.env):
-                    subscriptions.extend(x for x in subscriber.matches(ticket_event) if x)
-            else:
-                subscriptions.extend(x for x in subscriber.matches(event) if x)
+            for event_ in events:
+                subscriptions.extend(x for x in subscriber.matches(event_)
+                                       if x)
 
         # For each (transport, sid, authenticated) combination check the
         # subscription with the highest priority:
@@ -20,6 +20,7 @@ import hashlib
 import os
 import re
 import smtplib
+import weakref
 from email.charset import BASE64, QP, SHORTEST, Charset
 from email.header import Header
 from email.mime.multipart import MIMEMultipart
@@ -27,8 +28,9 @@ from email.mime.text import MIMEText
 from email.utils import formatdate, parseaddr, getaddresses
 from subprocess import Popen, PIPE
 
-from trac.config import (BoolOption, ConfigurationError, IntOption, Option,
-                         OrderedExtensionsOption)
+from trac.admin.api import IAdminCommandProvider
+from trac.config import (BoolOption, ChoiceOption, ConfigurationError,
+                         IntOption, Option, OrderedExtensionsOption)
 from trac.core import Component, ExtensionPoint, TracError, implements
 from trac.notification.api import (
     get_target_id, IEmailAddressResolver, IEmailDecorator, IEmailSender,
@@ -36,11 +38,13 @@ from trac.notification.api import (
     NotificationSystem)
 from trac.util import lazy
 from trac.util.compat import close_fds
-from trac.util.datefmt import time_now, to_utimestamp
+from trac.util.datefmt import (datetime_now, from_utimestamp, get_timezone,
+                                time_now, to_utimestamp, utc)
 from trac.util.html import tag
-from trac.util.text import CRLF, exception_to_unicode, fix_eol, to_unicode
-from trac.util.translation import _, tag_
-from trac.web.session import get_session_attribute
+from trac.util.text import (CRLF, exception_to_unicode, fix_eol, printout,
+                            to_unicode)
+from trac.util.translation import _, deactivate, reactivate, tag_
+from trac.web.session import get_session_attribute, get_session_attributes
 
 
 __all__ = ['AlwaysEmailSubscriber', 'EMAIL_LOOKALIKE_PATTERN',
@@ -266,7 +270,7 @@ class RecipientMatcher(object):
 class EmailDistributor(Component):
     """Distributes notification events as emails."""
 
-    implements(INotificationDistributor)
+    implements(IAdminCommandProvider, INotificationDistributor)
 
     formatters = ExtensionPoint(INotificationFormatter)
     decorators = ExtensionPoint(IEmailDecorator)
@@ -283,9 +287,38 @@ class EmailDistributor(Component):
     default_format = Option('notification', 'default_format.email',
         'text/plain', doc="Default format to distribute email notifications.")
 
+    default_delivery = ChoiceOption('notification', 'default_delivery.email',
+        ['immediate', 'digest'],
+        doc="""Default delivery mode of email notifications. With
+        `immediate`, an email is sent for each event. With `digest`, the
+        events are queued and aggregated in a single plain text email per
+        recipient, sent by the `notification digest` command of
+        `trac-admin`, typically run periodically from a cron job. Users
+        can override this setting in their preferences.
+        (''since 1.3.4'')""")
+
     def __init__(self):
         self._charset = create_charset(self.config.get('notification',
                                                        'mime_encoding'))
+        # Formatted bodies per event, keyed by (transport, style). Events
+        # are released once the caller drops them.
+        self._outputs = weakref.WeakKeyDictionary()
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('notification digest', '',
+               """Send the pending notification digests
+
+               The events queued for users preferring digest delivery are
+               sent as a single email per recipient. This command is meant
+               to be run periodically, e.g. from a cron job.
+               """,
+               None, self._do_digest)
+
+    def _do_digest(self):
+        sent = self.send_digests()
+        printout(_("%(count)s notification digest(s) sent.", count=sent))
 
     # INotificationDistributor methods
 
@@ -316,7 +349,14 @@ class EmailDistributor(Component):
         matcher = RecipientMatcher(self.env)
         notify_sys = NotificationSystem(self.env)
         always_cc = set(notify_sys.smtp_always_cc_list)
+        resolved = self._resolve_addresses(
+            set((sid, auth) for sid, auth, addr, fmt in recipients
+                            if sid and not addr and fmt in formats))
+        digests = self._get_digest_sessions(
+            set((sid, auth) for sid, auth, addr, fmt in recipients
+                            if sid and fmt in formats))
         addresses = {}
+        queued = {}
         for sid, auth, addr, fmt in recipients:
             if fmt not in formats:
                 self.log.debug("%s format %s not available for %s %s",
@@ -325,14 +365,7 @@ class EmailDistributor(Component):
                 continue
 
             if sid and not addr:
-                for resolver in self.resolvers:
-                    addr = resolver.get_address_for_session(sid, auth) or None
-                    if addr:
-                        self.log.debug(
-                            "%s found the address '%s' for '%s [%s]' via %s",
-                            self.__class__.__name__, addr, sid, auth,
-                            resolver.__class__.__name__)
-                        break
+                addr = resolved.get((sid, auth))
             if sid and auth and not addr:
                 addr = sid
             if notify_sys.smtp_default_domain and \
@@ -342,6 +375,11 @@ class EmailDistributor(Component):
             if not addr:
                 self.log.debug("%s was unable to find an address for "
                                "'%s [%s]'", self.__class__.__name__, sid, auth)
+            elif (sid, auth) in digests and \
+                    (matcher.is_email(addr) or
+                     notify_sys.use_short_addr and
+                     matcher.nodomaddr_re.match(addr)):
+                queued[addr] = (sid, auth, fmt)
             elif matcher.is_email(addr) or \
                     notify_sys.use_short_addr and \
                     matcher.nodomaddr_re.match(addr):
@@ -361,26 +399,31 @@ class EmailDistributor(Component):
         for fmt, formatter in formats.iteritems():
             if fmt not in addresses and fmt != 'text/plain':
                 continue
-            try:
-                outputs[fmt] = formatter.format(transport, fmt, event)
-            except Exception as e:
-                self.log.warning('%s caught exception while '
-                                 'formatting %s to %s for %s: %s%s',
-                                 self.__class__.__name__, event.realm, fmt,
-                                 transport, formatter.__class__,
-                                 exception_to_unicode(e, traceback=True))
+            output = self._format(transport, fmt, formatter, event)
+            if output is not None:
+                outputs[fmt] = output
+            else:
                 failed.append(fmt)
 
+        if queued:
+            if 'text/plain' in outputs:
+                self._queue_digest(event, queued, outputs['text/plain'])
+            else:
+                # Digests are plain text, deliver immediately instead
+                for addr, (sid, auth, fmt) in queued.iteritems():
+                    addresses.setdefault(fmt, set()).add(addr)
+
         # Fallback to text/plain when formatter is broken
         if failed and 'text/plain' in outputs:
             for fmt in failed:
                 addresses.setdefault('text/plain', set()) \
                          .update(addresses.pop(fmt, ()))
 
+        parts = {}
         for fmt, addrs in addresses.iteritems():
             self.log.debug("%s is sending event as '%s' to: %s",
                            self.__class__.__name__, fmt, ', '.join(addrs))
-            message = self._create_message(fmt, outputs)
+            message = self._create_message(fmt, outputs, parts)
             if message:
                 addrs = set(addrs)
                 cc_addrs = sorted(addrs & always_cc)
@@ -391,22 +434,194 @@ class EmailDistributor(Component):
                                  self.__class__.__name__, event.realm, fmt,
                                  ', '.join(addrs))
 
-    def _create_message(self, format, outputs):
+    def send_digests(self):
+        """Send the queued events as one email per recipient.
+
+        :return: the number of emails sent
+        """
+        pending = {}
+        # Claim the queued events before sending them, so that they are
+        # sent only once by concurrent runs: an event is ours only if
+        # its row is deleted by this run.
+        with self.env.db_transaction as db:
+            cursor = db.cursor()
+            for row in db("""
+                    SELECT id, time, sid, authenticated, address, realm,
+                           category, target, author, body
+                    FROM notify_digest ORDER BY time, id
+                    """):
+                cursor.execute("DELETE FROM notify_digest WHERE id=%s",
+                               (row[0],))
+                if cursor.rowcount != 1:
+                    continue
+                entry = dict(zip(self._digest_columns, row))
+                pending.setdefault(entry['address'], []).append(entry)
+
+        sent = 0
+        for address, entries in sorted(pending.iteritems()):
+            for entry in entries:
+                entry['time'] = from_utimestamp(entry['time'])
+            body = self._format_digest(entries)
+            if body is None:
+                continue
+            message = self._create_message('text/plain',
+                                           {'text/plain': body})
+            try:
+                self._do_send_digest(message, address, entries)
+            except Exception:
+                # Queue the events of the digests not sent again
+                self._requeue_digests([entries] +
+                                      [entries_ for address_, entries_
+                                       in pending.iteritems()
+                                       if address_ > address])
+                raise
+            sent += 1
+        return sent
+
+    _digest_columns = ('id', 'time', 'sid', 'authenticated', 'address',
+                       'realm', 'category', 'target', 'author', 'body')
+
+    def _requeue_digests(self, digests):
+        rows = []
+        for entries in digests:
+            for entry in entries:
+                entry = dict(entry)
+                if not isinstance(entry['time'], (int, long)):
+                    entry['time'] = to_utimestamp(entry['time'])
+                rows.append(tuple(entry[column]
+                                  for column in self._digest_columns))
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO notify_digest (id, time, sid, authenticated,
+                                           address, realm, category, target,
+                                           author, body)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows)
+
+    def _get_digest_sessions(self, sessions):
+        """Return the `(sid, authenticated)` tuples of the sessions
+        preferring digest delivery.
+        """
+        if not sessions:
+            return set()
+        deliveries = get_session_attributes(self.env, sessions,
+                                            'notification.delivery.email')
+        default = self.default_delivery
+        return set(key for key in sessions
+                       if (deliveries.get(key) or default) == 'digest')
+
+    def _queue_digest(self, event, recipients, body):
+        if isinstance(event.target, (list, tuple)):
+            targetid = ','.join(map(get_target_id, event.target))
+        else:
+            targetid = get_target_id(event.target)
+        time = to_utimestamp(event.time or datetime_now(utc))
+        if isinstance(body, str):
+            body = body.decode('utf-8')
+        self.log.debug("%s is queueing event '%s' for digest to: %s",
+                       self.__class__.__name__, event.realm,
+                       ', '.join(sorted(recipients)))
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO notify_digest (time, sid, authenticated, address,
+                                           realm, category, target, author,
+                                           body)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, [(time, sid, auth, addr, event.realm, event.category,
+                       targetid, event.author, body)
+                      for addr, (sid, auth, fmt)
+                      in sorted(recipients.iteritems())])
+
+    def _format_digest(self, entries):
+        from trac.web.chrome import Chrome
+        chrome = Chrome(self.env)
+        tz = get_timezone(self.config.get('trac', 'default_timezone'))
+        data = chrome.populate_data(None, {'CRLF': CRLF, 'entries': entries,
+                                           'tz': tz})
+        template = chrome.load_template('notify_digest_email.txt', text=True)
+        t = deactivate()  # don't translate the e-mail stream
+        try:
+            body = chrome.render_template_string(template, data, text=True)
+            return body.encode('utf-8')
+        except Exception as e:
+            self.log.warning("Failed to format notification digest: %s",
+                             exception_to_unicode(e, traceback=True))
+        finally:
+            reactivate(t)
+
+    def _resolve_addresses(self, sessions):
+        """Return a dictionary mapping `(sid, authenticated)` tuples to
+        email addresses, asking each resolver in turn for the sessions
+        that are still unresolved.
+        """
+        addresses = {}
+        for resolver in self.resolvers:
+            pending = [key for key in sessions if key not in addresses]
+            if not pending:
+                break
+            if hasattr(resolver, 'get_addresses_for_sessions'):
+                found = resolver.get_addresses_for_sessions(pending)
+            else:
+                found = dict((key, resolver.get_address_for_session(*key))
+                             for key in pending)
+            for (sid, auth), addr in found.iteritems():
+                if addr and (sid, auth) not in addresses:
+                    self.log.debug(
+                        "%s found the address '%s' for '%s [%s]' via %s",
+                        self.__class__.__name__, addr, sid, auth,
+                        resolver.__class__.__name__)
+                    addresses[(sid, auth)] = addr
+        return addresses
+
+    def _format(self, transport, style, formatter, event):
+        """Return the body of `event` formatted in `style`.
+
+        The body is rendered at most once per event and style, however
+        many recipient groups and messages it is delivered to. `None` is
+        returned when the formatter fails.
+        """
+        try:
+            cache = self._outputs.setdefault(event, {})
+        except TypeError:  # event cannot be weakly referenced
+            cache = {}
+        key = (transport, style)
+        if key in cache:
+            return cache[key]
+        try:
+            output = formatter.format(transport, style, event)
+        except Exception as e:
+            self.log.warning('%s caught exception while '
+                             'formatting %s to %s for %s: %s%s',
+                             self.__class__.__name__, event.realm, style,
+                             transport, formatter.__class__,
+                             exception_to_unicode(e, traceback=True))
+            output = None
+        cache[key] = output
+        return output
+
+    def _create_message(self, format, outputs, parts=None):
         if format not in outputs:
             return None
+        if parts is None:
+            parts = {}
+        def get_part(format):
+            if format not in parts:
+                subtype = format.split('/')[1]
+                parts[format] = create_mime_text(outputs[format], subtype,
+                                                 self._charset)
+            return parts[format]
         message = create_mime_multipart('related')
-        maintype, subtype = format.split('/')
-        preferred = create_mime_text(outputs[format], subtype, self._charset)
+        preferred = get_part(format)
         if format != 'text/plain' and 'text/plain' in outputs:
             alternative = create_mime_multipart('alternative')
-            alternative.attach(create_mime_text(outputs['text/plain'],
-                                                'plain', self._charset))
+            alternative.attach(get_part('text/plain'))
             alternative.attach(preferred)
             preferred = alternative
         message.attach(preferred)
         return message
 
-    def _do_send(self, transport, event, message, cc_addrs, bcc_addrs):
+    def _get_headers(self):
+        """Return the headers common to all the notification emails."""
         notify_sys = NotificationSystem(self.env)
         smtp_from = notify_sys.smtp_from
         smtp_from_name = notify_sys.smtp_from_name or self.env.project_name
@@ -425,9 +640,44 @@ class EmailDistributor(Component):
         headers['X-Trac-Version'] = self.env.trac_version
         headers['X-Trac-Project'] = self.env.project_name
         headers['X-URL'] = self.env.project_url
-        headers['X-Trac-Realm'] = event.realm
         headers['Precedence'] = 'bulk'
         headers['Auto-Submitted'] = 'auto-generated'
+        headers['Date'] = formatdate()
+        headers['From'] = (smtp_from_name, smtp_from) \
+                          if smtp_from_name else smtp_from
+        headers['Reply-To'] = smtp_replyto
+        return smtp_from, headers
+
+    def _send_message(self, message):
+        from_name, from_addr = parseaddr(str(message['From']))
+        to_addrs = set()
+        for name in ('To', 'Cc', 'Bcc'):
+            values = map(str, message.get_all(name, ()))
+            to_addrs.update(addr for name, addr in getaddresses(values)
+                                 if addr)
+        del message['Bcc']
+        NotificationSystem(self.env).send_email(from_addr, list(to_addrs),
+                                                message.as_string())
+
+    def _do_send_digest(self, message, address, entries):
+        smtp_from, headers = self._get_headers()
+        prefix = self.config.get('notification', 'smtp_subject_prefix')
+        if prefix == '__default__':
+            prefix = '[%s]' % self.env.project_name
+        subject = 'Notification digest: %d events' % len(entries)
+        headers['Subject'] = '%s %s' % (prefix, subject) if prefix \
+                             else subject
+        headers['Message-ID'] = create_message_id(
+            self.env, address, smtp_from, entries[-1]['time'],
+            more='digest.%d' % entries[-1]['id'])
+        headers['To'] = address
+        for k, v in headers.iteritems():
+            set_header(message, k, v, self._charset)
+        self._send_message(message)
+
+    def _do_send(self, transport, event, message, cc_addrs, bcc_addrs):
+        smtp_from, headers = self._get_headers()
+        headers['X-Trac-Realm'] = event.realm
         if isinstance(event.target, (list, tuple)):
             targetid = ','.join(map(get_target_id, event.target))
         else:
@@ -442,29 +692,17 @@ class EmailDistributor(Component):
                                                       more=event.realm)
             headers['In-Reply-To'] = rootid
             headers['References'] = rootid
-        headers['Date'] = formatdate()
-        headers['From'] = (smtp_from_name, smtp_from) \
-                          if smtp_from_name else smtp_from
         headers['To'] = 'undisclosed-recipients: ;'
         if cc_addrs:
             headers['Cc'] = ', '.join(cc_addrs)
         if bcc_addrs:
             headers['Bcc'] = ', '.join(bcc_addrs)
-        headers['Reply-To'] = smtp_replyto
 
         for k, v in headers.iteritems():
             set_header(message, k, v, self._charset)
         for decorator in self.decorators:
             decorator.decorate_message(event, message, self._charset)
-
-        from_name, from_addr = parseaddr(str(message['From']))
-        to_addrs = set()
-        for name in ('To', 'Cc', 'Bcc'):
-            values = map(str, message.get_all(name, ()))
-            to_addrs.update(addr for name, addr in getaddresses(values)
-                                 if addr)
-        del message['Bcc']
-        notify_sys.send_email(from_addr, list(to_addrs), message.as_string())
+        self._send_message(message)
 
 
 class SmtpEmailSender(Component):
@@ -577,6 +815,9 @@ class SessionEmailResolver(Component):
     def get_address_for_session(self, sid, authenticated):
         return get_session_attribute(self.env, sid, authenticated, 'email')
 
+    def get_addresses_for_sessions(self, sessions):
+        return get_session_attributes(self.env, sessions, 'email')
+
 
 class AlwaysEmailSubscriber(Component):
     """Implement a policy to -always- send an email to a certain address.
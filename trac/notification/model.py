@@ -224,11 +224,27 @@ class Subscription(object):
     @classmethod
     def find_by_sids_and_class(cls, env, uids, class_):
         """uids should be a collection to tuples (sid, auth)"""
+        order = {}
+        for sid, auth in uids:
+            order.setdefault((sid, int(auth)), len(order))
+        sids = sorted(set(sid for sid, auth in order))
         subs = []
-        for sid, authenticated in uids:
-            subs.extend(cls._find(env, class_=class_, sid=sid,
-                                  authenticated=authenticated,
-                                  order='priority'))
+        with env.db_query as db:
+            for idx in xrange(0, len(sids), 100):
+                chunk = sids[idx:idx + 100]
+                for row in db("""
+                        SELECT id, sid, authenticated, distributor, format,
+                               priority, adverb, class
+                        FROM notify_subscription
+                        WHERE class=%%s AND sid IN (%s)
+                        """ % ','.join(['%s'] * len(chunk)),
+                        [class_] + chunk):
+                    if (row[1], int(row[2])) in order:
+                        sub = Subscription(env)
+                        sub._from_database(*row)
+                        subs.append(sub)
+        subs.sort(key=lambda sub: (order[(sub['sid'], sub['authenticated'])],
+                                   sub['priority']))
         return subs
 
     @classmethod
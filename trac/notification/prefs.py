@@ -72,6 +72,7 @@ class NotificationPreferences(Component):
         subscribers = []
         formatters = {}
         selected_format = {}
+        selected_delivery = {}
         defaults = []
 
         for i in self.subscribers:
@@ -90,6 +91,9 @@ class NotificationPreferences(Component):
             rules[t] = []
             formatters[t] = self._get_supported_styles(t)
             selected_format[t] = req.session.get('notification.format.%s' % t)
+            if self._supports_digest(t):
+                selected_delivery[t] = \
+                    req.session.get('notification.delivery.%s' % t, '')
             for r in self._iter_rules(req, t):
                 description = desc_map.get(r['class'])
                 if description:
@@ -110,6 +114,10 @@ class NotificationPreferences(Component):
 
         data = {'rules': rules, 'subscribers': subscribers,
                 'formatters': formatters, 'selected_format': selected_format,
+                'selected_delivery': selected_delivery,
+                'deliveries': ('immediate', 'digest'),
+                'delivery_labels': {'immediate': _("Immediately"),
+                                    'digest': _("Periodic digest")},
                 'default_rules': default_rules,
                 'adverbs': ('always', 'never'),
                 'adverb_labels': {'always': _("Notify"),
@@ -155,6 +163,7 @@ class NotificationPreferences(Component):
         format_ = req.args.getfirst('format-%s' % arg)
         format_ = self._normalize_format(format_, arg)
         req.session.set('notification.format.%s' % arg, format_, '')
+        self._set_delivery(arg, req)
         Subscription.update_format_by_distributor_and_sid(
             self.env, arg, req.session.sid, req.session.authenticated, format_)
 
@@ -164,6 +173,7 @@ class NotificationPreferences(Component):
             format_ = req.args.getfirst('format-' + transport)
             format_ = self._normalize_format(format_, transport)
             req.session.set('notification.format.%s' % transport, format_, '')
+            self._set_delivery(transport, req)
             adverbs = req.args.getlist('adverb-' + transport)
             classes = req.args.getlist('class-' + transport)
             for idx in xrange(min(len(adverbs), len(classes))):
@@ -178,6 +188,14 @@ class NotificationPreferences(Component):
             Subscription.replace_all(self.env, sid, authenticated,
                                      subscriptions)
 
+    def _set_delivery(self, transport, req):
+        if self._supports_digest(transport):
+            delivery = req.args.getfirst('delivery-%s' % transport)
+            if delivery not in ('immediate', 'digest'):
+                delivery = ''
+            req.session.set('notification.delivery.%s' % transport,
+                            delivery, '')
+
     def _iter_rules(self, req, transport):
         session = req.session
         for r in Subscription.find_by_sid_and_distributor(
@@ -189,6 +207,11 @@ class NotificationPreferences(Component):
             for transport in distributor.transports():
                 yield transport
 
+    def _supports_digest(self, transport):
+        return any(hasattr(distributor, 'send_digests')
+                   for distributor in self.distributors
+                   if transport in distributor.transports())
+
     def _get_supported_styles(self, transport):
         styles = set()
         for formatter in self.formatters:
@@ -19,6 +19,7 @@ from trac.notification.api import (
     IEmailAddressResolver, IEmailSender, INotificationFormatter,
     INotificationSubscriber, NotificationEvent, NotificationSystem,
 )
+from trac.notification.mail import EmailDistributor
 from trac.notification.model import Subscription
 from trac.test import EnvironmentStub
 from trac.ticket.model import _fixup_cc_list
@@ -43,6 +44,9 @@ class TestFormatter(Component):
 
     implements(INotificationFormatter)
 
+    def __init__(self):
+        self.history = []
+
     def get_supported_styles(self, transport):
         if transport == 'email':
             yield 'text/plain', 'test'
@@ -51,6 +55,7 @@ class TestFormatter(Component):
     def format(self, transport, style, event):
         if transport != 'email':
             return
+        self.history.append((style, event))
         text = event.target.text
         if style == 'text/plain':
             if 'raise-text-plain' in text:
@@ -94,6 +99,22 @@ class TestEmailAddressResolver(Component):
             return '%s@example.net' % sid
 
 
+class TestBulkEmailAddressResolver(Component):
+
+    implements(IEmailAddressResolver)
+
+    def __init__(self):
+        self.history = []
+
+    def get_address_for_session(self, sid, authenticated):
+        raise AssertionError("get_addresses_for_sessions must be used")
+
+    def get_addresses_for_sessions(self, sessions):
+        self.history.append(sorted(sessions))
+        return {(sid, authenticated): '%s@bulk.example.net' % sid
+                for sid, authenticated in sessions if sid != 'nobody'}
+
+
 class TestNotificationEvent(NotificationEvent): pass
 
 
@@ -110,7 +131,8 @@ class EmailDistributorTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(enable=['trac.*', TestEmailSender,
                                            TestFormatter, TestSubscriber,
-                                           TestEmailAddressResolver])
+                                           TestEmailAddressResolver,
+                                           TestBulkEmailAddressResolver])
         self.config = config = self.env.config
         config.set('notification', 'smtp_from', 'trac@example.org')
         config.set('notification', 'smtp_enabled', 'enabled')
@@ -181,6 +203,24 @@ class EmailDistributorTestCase(unittest.TestCase):
         self.assertEqual([body_plain, body_html],
                          [p.get_payload() for p in alternative])
 
+    def test_resolve_addresses(self):
+        self.config.set('notification', 'email_address_resolvers',
+                        'SessionEmailResolver,TestBulkEmailAddressResolver,'
+                        'TestEmailAddressResolver')
+        resolver = TestBulkEmailAddressResolver(self.env)
+        distributor = EmailDistributor(self.env)
+        addresses = distributor._resolve_addresses(
+            [('foo', 1), ('bar', 1), ('baz', 1), ('nobody', 1),
+             ('anon', 0)])
+        self.assertEqual({('foo', 1): 'foo@example.org',
+                          ('bar', 1): 'bar@example.org',
+                          ('baz', 1): 'baz@bulk.example.net',
+                          ('anon', 0): 'anon@bulk.example.net',
+                          ('nobody', 1): 'nobody@example.net'}, addresses)
+        # A single call for the sessions without email attribute
+        self.assertEqual([[('anon', 0), ('baz', 1), ('nobody', 1)]],
+                         resolver.history)
+
     def test_plain(self):
         with self.env.db_transaction:
             self._add_subscription(sid='foo')
@@ -313,6 +353,110 @@ class EmailDistributorTestCase(unittest.TestCase):
         history = self.sender.history
         self.assertEqual([], history)
 
+    def test_format_once_per_style(self):
+        with self.env.db_transaction:
+            self._add_subscription(sid='foo', format='text/plain')
+            self._add_subscription(sid='bar', format='text/html')
+        formatter = TestFormatter(self.env)
+        formatter.history[:] = ()
+        event = TestNotificationEvent('test', 'created', TestModel('blah'),
+                                      datetime_now(utc))
+        subscriptions = list(self.notsys.subscriptions(event))
+        self.notsys.distribute_event(event, subscriptions)
+        self.notsys.distribute_event(event, subscriptions)
+
+        self.assertEqual(4, len(self.sender.history))
+        self.assertEqual(['text/html', 'text/plain'],
+                         sorted(style for style, e in formatter.history))
+        for from_addr, recipients, message in self.sender.history:
+            if 'bar@example.org' in recipients:
+                self._assert_alternative_mail(message, 'blah', '<p>blah</p>')
+            else:
+                self._assert_mail(message, 'text/plain', 'blah')
+
+    def test_digest(self):
+        self._add_session('foo', {'notification.delivery.email': 'digest'})
+        with self.env.db_transaction:
+            self._add_subscription(sid='foo')
+            self._add_subscription(sid='bar')
+        distributor = EmailDistributor(self.env)
+        self._notify_event('first')
+        history = self.sender.history
+        self.assertEqual(1, len(history))
+        self.assertEqual({'bar@example.org', 'cc@example.org',
+                          'bcc@example.org'}, set(history[0][1]))
+        self._notify_event('second', category='changed', author='bar')
+
+        self.sender.history[:] = ()
+        self.assertEqual(1, distributor.send_digests())
+        history = self.sender.history
+        self.assertEqual(1, len(history))
+        from_addr, recipients, message = history[0]
+        self.assertEqual('trac@example.org', from_addr)
+        self.assertEqual(['foo@example.org'], recipients)
+        self.assertEqual('foo@example.org', message['To'])
+        self.assertEqual('[My Project] Notification digest: 2 events',
+                         message['Subject'])
+        body = message.get_payload()[0].get_payload()
+        self.assertIn('Notification digest of 2 events:', body)
+        self.assertIn(': created\n', body)
+        self.assertIn(': changed by bar\n', body)
+        self.assertLess(body.index('first'), body.index('second'))
+
+        self.sender.history[:] = ()
+        self.assertEqual(0, distributor.send_digests())
+        self.assertEqual([], self.sender.history)
+
+    def test_digest_sent_once_by_concurrent_runs(self):
+        self._add_session('foo', {'notification.delivery.email': 'digest'})
+        self._add_subscription(sid='foo')
+        self._notify_event('blah')
+        distributor = EmailDistributor(self.env)
+        send_message = distributor._send_message
+        concurrent = []
+        def _send_message(message):
+            # Another run starting while the digest is being sent
+            concurrent.append(distributor.send_digests())
+            send_message(message)
+        distributor._send_message = _send_message
+        self.sender.history[:] = ()
+
+        self.assertEqual(1, distributor.send_digests())
+        self.assertEqual([0], concurrent)
+        self.assertEqual(1, len(self.sender.history))
+
+    def test_digest_queued_again_on_error(self):
+        self._add_session('foo', {'notification.delivery.email': 'digest'})
+        self._add_subscription(sid='foo')
+        self._notify_event('blah')
+        distributor = EmailDistributor(self.env)
+        def _send_message(message):
+            raise ValueError()
+        distributor._send_message = _send_message
+
+        self.assertRaises(ValueError, distributor.send_digests)
+        del distributor._send_message
+        self.sender.history[:] = ()
+        self.assertEqual(1, distributor.send_digests())
+        self.assertEqual(['foo@example.org'], self.sender.history[0][1])
+
+    def test_digest_by_default(self):
+        self.env.config.set('notification', 'default_delivery.email',
+                            'digest')
+        self._add_session('foo', {'notification.delivery.email': 'immediate'})
+        with self.env.db_transaction:
+            self._add_subscription(sid='foo')
+            self._add_subscription(sid='bar')
+        self._notify_event('blah')
+
+        history = self.sender.history
+        self.assertEqual(1, len(history))
+        self.assertEqual({'foo@example.org', 'cc@example.org',
+                          'bcc@example.org'}, set(history[0][1]))
+        self.assertEqual(['bar@example.org'], [
+            address for address, in self.env.db_query(
+                "SELECT address FROM notify_digest")])
+
     def test_username_in_always_cc(self):
         self.env.config.set('notification', 'smtp_always_cc',
                             'foo, cc@example.org')
@@ -148,6 +148,22 @@ class SubscriptionTestCase(unittest.TestCase):
         self.assertEqual(['IrcSubscriber3', 'IrcSubscriber3'],
                          self._props(items, 'class'))
 
+    def test_find_by_sids_and_class_many_sids(self):
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO notify_subscription (
+                    time, changetime, sid, authenticated, distributor,
+                    format, priority, adverb, class)
+                VALUES (0, 0, %s, %s, 'email', 'text/plain', 1, 'always',
+                        'EmailSubscriber1')""",
+                [('user%03d' % idx, idx % 2) for idx in xrange(250)])
+        sids = [('user%03d' % idx, True) for idx in xrange(249, -1, -1)]
+        items = Subscription.find_by_sids_and_class(self.env, sids,
+                                                    'EmailSubscriber1')
+        self.assertEqual(['user%03d' % idx for idx in xrange(249, -1, -2)],
+                         self._props(items, 'sid'))
+        self.assertEqual([1] * 125, self._props(items, 'authenticated'))
+
     def test_move(self):
         def query_subs():
             return self.env.db_query("""\
@@ -20,21 +20,25 @@ from __future__ import print_function
 
 import csv
 import os
+import threading
 from itertools import groupby
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
 from trac.cache import cached
-from trac.config import ExtensionOption, OrderedExtensionsOption
+from trac.config import ExtensionOption, IntOption, ListOption, \
+                        OrderedExtensionsOption
 from trac.core import *
 from trac.resource import Resource, get_resource_name
 from trac.util import file_or_std
+from trac.util.compat import OrderedDict
 from trac.util.datefmt import time_now
 from trac.util.text import path_to_unicode, print_table, printout, \
                            stream_encoding, to_unicode, wrap
 from trac.util.translation import _, N_
 
 __all__ = ['IPermissionRequestor', 'IPermissionStore', 'IPermissionPolicy',
-           'IPermissionGroupProvider', 'PermissionError', 'PermissionSystem']
+           'IBatchPermissionPolicy', 'IPermissionGroupProvider',
+           'PermissionError', 'PermissionSystem']
 
 
 class PermissionError(TracBaseError):
@@ -164,6 +168,36 @@ class IPermissionPolicy(Interface):
         """
 
 
+class IBatchPermissionPolicy(Interface):
+    """Extension point interface for permission policies that can decide
+    on many resources at once.
+
+    A component implementing this interface must also implement
+    `IPermissionPolicy`, and is listed in the `[trac]
+    permission_policies` option like any other policy. Policies that
+    don't implement it are consulted once per resource.
+
+    :since: 1.3.4
+    """
+
+    def check_permissions(action, username, resources, perm):
+        """Check that the action can be performed by username on each
+        of the resources.
+
+        :param action: the name of the permission
+        :param username: the username string or 'anonymous' if there's no
+                         authenticated user
+        :param resources: a list of resources on which the check applies
+        :param perm: the permission cache for that username, which can
+                     be used for doing secondary checks on other
+                     permissions. Care must be taken to avoid recursion.
+
+        :return: a list with a decision for each of the `resources`, in
+                 the same order. Each decision has the same meaning as
+                 the return value of `IPermissionPolicy.check_permission`.
+        """
+
+
 class DefaultPermissionStore(Component):
     """Default implementation of permission storage and group management.
 
@@ -231,8 +265,9 @@ class DefaultPermissionStore(Component):
                                 (username, action))
         self.log.info("Granted permission for %s to %s", action, username)
 
-        # Invalidate cached property
+        # Invalidate cached properties
         del self._all_permissions
+        del self._permission_index
 
     def revoke_permission(self, username, action):
         """Revokes a users' permission to perform the specified action."""
@@ -241,8 +276,9 @@ class DefaultPermissionStore(Component):
                 (username, action))
         self.log.info("Revoked permission for %s to %s", action, username)
 
-        # Invalidate cached property
+        # Invalidate cached properties
         del self._all_permissions
+        del self._permission_index
 
     @cached
     def _all_permissions(self):
@@ -250,25 +286,42 @@ class DefaultPermissionStore(Component):
                           SELECT username, action FROM permission
                           """))
 
+    @cached
+    def _permission_index(self):
+        """Return a tuple `(actions, groups)` of dictionaries mapping each
+        subject to the actions granted directly to it, and to the closure
+        of the groups it is a member of.
+        """
+        actions = {}
+        members = {}
+        for user, action in self._all_permissions:
+            if action.isupper():
+                actions.setdefault(user, set()).add(action)
+            else:  # permission group
+                members.setdefault(user, set()).add(action)
+        groups = {}
+        for subject, direct in members.iteritems():
+            closure = set()
+            pending = list(direct)
+            while pending:
+                group = pending.pop()
+                if group not in closure:
+                    closure.add(group)
+                    pending.extend(members.get(group, ()))
+            groups[subject] = frozenset(closure)
+        return actions, groups
+
     def _get_actions_and_groups(self, subjects):
         """Get actions and groups for `subjects`, an iterable of username
         and groups that username is a member of.
         """
-        actions = set()
+        actions_by_subject, groups_by_subject = self._permission_index
         groups = set()
-        perms = self._all_permissions
-        while True:
-            num_users = len(subjects)
-            num_actions = len(actions)
-            for user, action in perms:
-                if user in subjects:
-                    if action.isupper():
-                        actions.add(action)
-                    if not action.isupper():  # permission group
-                        subjects.add(action)
-                        groups.add(action)
-            if num_users == len(subjects) and num_actions == len(actions):
-                break
+        for subject in subjects:
+            groups.update(groups_by_subject.get(subject, ()))
+        actions = set()
+        for subject in groups.union(subjects):
+            actions.update(actions_by_subject.get(subject, ()))
         return actions, groups
 
 
@@ -291,7 +344,10 @@ class DefaultPermissionGroupProvider(Component):
 class DefaultPermissionPolicy(Component):
     """Default permission policy using the IPermissionStore system."""
 
-    implements(IPermissionPolicy)
+    implements(IBatchPermissionPolicy, IPermissionPolicy)
+
+    # The decisions don't depend on the resource.
+    resource_independent = True
 
     # Number of seconds a cached user permission set is valid for.
     CACHE_EXPIRY = 5
@@ -305,6 +361,15 @@ class DefaultPermissionPolicy(Component):
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
+        return action in self._get_user_permissions(username) or None
+
+    # IBatchPermissionPolicy methods
+
+    def check_permissions(self, action, username, resources, perm):
+        decision = action in self._get_user_permissions(username) or None
+        return [decision] * len(resources)
+
+    def _get_user_permissions(self, username):
         now = time_now()
 
         if now - self.last_reap > self.CACHE_REAP_TIME:
@@ -321,7 +386,7 @@ class DefaultPermissionPolicy(Component):
                           get_user_permissions(username)
             self.permission_cache[username] = (now, permissions)
 
-        return action in permissions or None
+        return permissions
 
 
 class PermissionSystem(Component):
@@ -333,6 +398,7 @@ class PermissionSystem(Component):
 
     requestors = ExtensionPoint(IPermissionRequestor)
     group_providers = ExtensionPoint(IPermissionGroupProvider)
+    batch_policies = ExtensionPoint(IBatchPermissionPolicy)
 
     store = ExtensionOption('trac', 'permission_store', IPermissionStore,
                             'DefaultPermissionStore',
@@ -348,14 +414,33 @@ class PermissionSystem(Component):
         in which they will be applied. These components manage fine-grained
         access control to Trac resources.""")
 
+    cached_policies = ListOption('trac', 'permission_cache_policies', '',
+        doc="""List of permission policies whose decisions are kept in a
+        cache shared by all the requests served by a process. Only the
+        policies whose decisions depend solely on the user, the action,
+        the resource and the permission store or policy file should be
+        listed. The cache is cleared when permissions are granted or
+        revoked, and when the authz policy file is reloaded. Policies
+        deciding independently of the resource, like
+        `DefaultPermissionPolicy`, have a single cached decision per
+        user and action. (''since 1.3.4'')""")
+
+    cache_ttl = IntOption('trac', 'permission_cache_ttl', 60,
+        """Number of seconds a cached permission decision of the policies
+        listed in `permission_cache_policies` remains valid. Set to 0 to
+        disable the cache. (''since 1.3.4'')""")
+
     # Number of seconds a cached user permission set is valid for.
     CACHE_EXPIRY = 5
     # How frequently to clear the entire permission cache
     CACHE_REAP_TIME = 60
+    # Maximum number of cached permission decisions.
+    DECISION_CACHE_SIZE = 10000
 
     def __init__(self):
         self.permission_cache = {}
         self.last_reap = time_now()
+        self._decision_lock = threading.Lock()
 
     # Public API
 
@@ -377,6 +462,8 @@ class PermissionSystem(Component):
 
         try:
             self.store.grant_permission(username, action)
+            del self._actions_closure
+            self.reset_decision_cache()
         except self.env.db_exc.IntegrityError:
             if action in self.get_actions():
                 raise PermissionExistsError(
@@ -391,6 +478,16 @@ class PermissionSystem(Component):
         """Revokes the permission of the specified user to perform an
         action."""
         self.store.revoke_permission(username, action)
+        del self._actions_closure
+        self.reset_decision_cache()
+
+    def reset_decision_cache(self):
+        """Discard the permission decisions cached across requests, in
+        all the processes of the environment.
+
+        :since: 1.3.4
+        """
+        del self._decision_cache
 
     def get_actions_dict(self, skip=None):
         """Get all actions from permission requestors as a `dict`.
@@ -471,7 +568,7 @@ class PermissionSystem(Component):
             return dict.fromkeys(self.get_actions(), True)
 
         # Return all permissions that the given user has
-        actions = self.get_actions_dict()
+        actions = self._actions_closure
         user_permissions = self.store.get_user_permissions(username) or []
         if expand_meta:
             return {p: True for p in self.expand_actions(user_permissions)
@@ -536,17 +633,82 @@ class PermissionSystem(Component):
 
     def expand_actions(self, actions):
         """Helper method for expanding all meta actions."""
-        all_actions = self.get_actions_dict()
+        closure = self._actions_closure
         expanded_actions = set()
-        def expand_action(action):
-            if action not in expanded_actions:
-                expanded_actions.add(action)
-                for a in all_actions.get(action, ()):
-                    expand_action(a)
         for a in actions:
-            expand_action(a)
+            expanded_actions.update(closure.get(a, (a,)))
         return sorted(expanded_actions)
 
+    @cached
+    def _actions_closure(self):
+        """Map each action to the set of actions it grants, including
+        itself and all the actions covered by meta actions, recursively.
+        """
+        all_actions = self.get_actions_dict()
+        closure = {}
+        for action in all_actions:
+            expanded = set()
+            pending = [action]
+            while pending:
+                a = pending.pop()
+                if a not in expanded:
+                    expanded.add(a)
+                    pending.extend(all_actions.get(a, ()))
+            closure[action] = frozenset(expanded)
+        return closure
+
+    @cached
+    def _decision_cache(self):
+        """Map `(policy, username, action, resource path)` keys to
+        `(timestamp, decision)` tuples, in least recently used order.
+        """
+        return OrderedDict()
+
+    def _get_cached_policy_names(self):
+        if self.cache_ttl <= 0:
+            return ()
+        return set(self.cached_policies)
+
+    def _cached_decisions(self, policy, action, username, resources,
+                          decide):
+        """Return the decisions of `policy` for `resources`, calling
+        `decide` with the list of resources missing from the cache.
+
+        The decisions of a policy having a true `resource_independent`
+        attribute are cached once per user and action.
+        """
+        cache = self._decision_cache
+        name = policy.__class__.__name__
+        if getattr(policy, 'resource_independent', False):
+            keys = [(name, username, action, None)] * len(resources)
+        else:
+            keys = [(name, username, action, _resource_path(resource))
+                    for resource in resources]
+        decisions = [None] * len(resources)
+        missing = OrderedDict()
+        now = time_now()
+        with self._decision_lock:
+            for idx, key in enumerate(keys):
+                entry = cache.pop(key, None)
+                if entry and now - entry[0] < self.cache_ttl:
+                    cache[key] = entry
+                    decisions[idx] = entry[1]
+                else:
+                    missing.setdefault(key, []).append(idx)
+        if missing:
+            # Each missing key is decided once, on its first resource
+            results = decide([resources[indexes[0]]
+                              for indexes in missing.itervalues()])
+            with self._decision_lock:
+                for (key, indexes), decision in zip(missing.iteritems(),
+                                                    results):
+                    cache[key] = (now, decision)
+                    for idx in indexes:
+                        decisions[idx] = decision
+                while len(cache) > self.DECISION_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return decisions
+
     def check_permission(self, action, username=None, resource=None,
                          perm=None):
         """Return True if permission to perform action for the given
@@ -556,9 +718,16 @@ class PermissionSystem(Component):
             username = 'anonymous'
         if resource and resource.realm is None:
             resource = None
+        cached_names = self._get_cached_policy_names()
         for policy in self.policies:
-            decision = policy.check_permission(action, username, resource,
-                                               perm)
+            if policy.__class__.__name__ in cached_names:
+                decision = self._cached_decisions(
+                    policy, action, username, [resource],
+                    lambda resources: [policy.check_permission(
+                        action, username, resource, perm)])[0]
+            else:
+                decision = policy.check_permission(action, username,
+                                                   resource, perm)
             if decision is not None:
                 self.log.debug("%s %s %s performing %s on %r",
                                policy.__class__.__name__,
@@ -569,6 +738,64 @@ class PermissionSystem(Component):
                        username, action, resource)
         return False
 
+    def check_permissions(self, action, username=None, resources=(),
+                          perm=None):
+        """Return a list of booleans telling whether permission to
+        perform action is allowed for each of the given resources.
+
+        Policies implementing `IBatchPermissionPolicy` decide on all the
+        pending resources at once, the other policies are consulted for
+        each resource in turn.
+
+        :since: 1.3.4
+        """
+        if username is None:
+            username = 'anonymous'
+        if perm is None:
+            # The batch policies expect a `PermissionCache`, as they
+            # derive the per-resource caches from it.
+            perm = PermissionCache(self.env, username)
+        resources = [resource if resource and resource.realm is not None
+                     else None for resource in resources]
+        decisions = [None] * len(resources)
+        pending = range(len(resources))
+        batch_policies = set(self.batch_policies)
+        cached_names = self._get_cached_policy_names()
+        for policy in self.policies:
+            if not pending:
+                break
+            if policy in batch_policies:
+                def decide(resources):
+                    return policy.check_permissions(action, username,
+                                                    resources, perm)
+            else:
+                def decide(resources):
+                    return [policy.check_permission(action, username,
+                                                    resource, perm(resource))
+                            for resource in resources]
+            pending_resources = [resources[i] for i in pending]
+            if policy.__class__.__name__ in cached_names:
+                results = self._cached_decisions(policy, action, username,
+                                                 pending_resources, decide)
+            else:
+                results = decide(pending_resources)
+            undecided = []
+            for i, decision in zip(pending, results):
+                if decision is None:
+                    undecided.append(i)
+                else:
+                    decisions[i] = decision
+            if len(undecided) != len(pending):
+                self.log.debug("%s decided %d of %d resources for %s "
+                               "performing %s", policy.__class__.__name__,
+                               len(pending) - len(undecided), len(pending),
+                               username, action)
+            pending = undecided
+        if pending:
+            self.log.debug("No policy allowed %s performing %s on %d "
+                           "resources", username, action, len(pending))
+        return [bool(decision) for decision in decisions]
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -578,6 +805,14 @@ class PermissionSystem(Component):
         return [('TRAC_ADMIN', actions)]
 
 
+def _resource_path(resource):
+    path = ()
+    while resource:
+        path += (resource.realm, resource.id, resource.version)
+        resource = resource.parent
+    return path
+
+
 class PermissionCache(object):
     """Cache that maintains the permissions of a single user.
 
@@ -670,6 +905,35 @@ class PermissionCache(object):
 
     __contains__ = has_permission
 
+    def filter(self, action, resources):
+        """Return the list of `resources` on which the permission to
+        perform action is allowed, preserving their order.
+
+        The resources missing from the cache are decided in one pass
+        and cached, as if `has_permission` had been called for each of
+        them.
+
+        :since: 1.3.4
+        """
+        resources = list(resources)
+        pending = {}
+        for resource in resources:
+            key = (self.username, hash(resource), action)
+            cached = self._cache.get(key)
+            if not cached or resource != cached[1]:
+                pending.setdefault(key, resource)
+        if pending:
+            # Avoid recursion in policies that call has_permission.
+            for key, resource in pending.iteritems():
+                self._cache[key] = (False, resource)
+            keys = list(pending)
+            decisions = PermissionSystem(self.env).check_permissions(
+                action, self.username, [pending[key] for key in keys], self)
+            for key, decision in zip(keys, decisions):
+                self._cache[key] = (decision, pending[key])
+        return [resource for resource in resources
+                if self._has_permission(action, resource)]
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         resource = self._normalize_resource(realm_or_resource, id, version)
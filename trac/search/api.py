@@ -13,7 +13,16 @@
 
 import re
 
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.api import IEnvironmentSetupParticipant
+from trac.cache import cached
 from trac.core import *
+from trac.db.api import DatabaseManager
+from trac.resource import Resource
+from trac.util import merge_sorted
+from trac.util.datefmt import to_utimestamp
+from trac.util.text import printout
+from trac.util.translation import _
 
 
 class ISearchSource(Interface):
@@ -38,8 +47,401 @@ class ISearchSource(Interface):
 
         The events returned by this function must be tuples of the form
         `(href, title, date, author, excerpt).`
+
+        The tuples can have a sixth element, the relevance `score` of
+        the result as given by `SearchSystem.get_index_sql`. The results
+        having a score are listed first, by decreasing score.
         """
 
+    def get_search_results_page(req, terms, filters, limit, cursor):
+        """Return the search results following `cursor`, as a
+        `(results, cursor)` tuple.
+
+        This method is optional. It allows the search results of the
+        sources to be merged lazily, so that only the results shown on
+        the requested page need to be retrieved.
+
+        The `results` are those of `get_search_results` among at most
+        `limit` matches following `cursor`, sorted by decreasing
+        `search_result_key`. `cursor` is `None` for the first results,
+        and the returned `cursor` is passed for retrieving the next
+        results, or is `None` if there are no more matches.
+
+        Return `None` if the results can't be retrieved that way, in
+        which case `get_search_results` is used.
+
+        :since: 1.3.4
+        """
+
+
+class ISearchIndexer(Interface):
+    """Extension point interface for components providing the documents
+    of the full-text search index.
+
+    The indexer must keep the index up-to-date, by calling
+    `SearchSystem.index_resource` and `SearchSystem.remove_resource` when
+    the resources of its realms are changed.
+
+    :since: 1.3.4
+    """
+
+    def get_search_index_realms():
+        """Return the realms of the resources indexed by the component."""
+
+    def get_search_documents(realm, ids=None):
+        """Return an iterable of the documents of `realm`, for rebuilding
+        the index.
+
+        The documents are `(resource, time, author, title, text)` tuples,
+        where `resource` is a `Resource` with at most one parent and
+        `text` is the text searched in addition to the `title`.
+
+        If `ids` is not `None`, only the documents of the resources of
+        `realm` having these ids must be returned.
+        """
+
+
+class SearchSystem(Component):
+    """Full-text search index of the resources.
+
+    The documents of the index are provided by the `ISearchIndexer`
+    components. Depending on the database backend, the index is backed
+    by an SQLite FTS5 table or a PostgreSQL `tsvector` index. Otherwise
+    the `search_index` table is searched using `LIKE`.
+
+    :since: 1.3.4
+    """
+
+    implements(IAdminCommandProvider, IEnvironmentSetupParticipant)
+
+    indexers = ExtensionPoint(ISearchIndexer)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search reindex', '[realm] [...]',
+               """Rebuild the full-text search index
+
+               The documents of the given realms are indexed again, or
+               the documents of all the realms if no realm is specified.
+               The full-text index of the database backend is created if
+               it doesn't exist.
+               """,
+               self._complete_reindex, self._do_reindex)
+
+    def _complete_reindex(self, args):
+        return sorted(self.get_indexed_realms())
+
+    def _do_reindex(self, *realms):
+        unknown = set(realms) - self.get_indexed_realms()
+        if unknown:
+            raise AdminCommandError(_("Unknown realm(s): %(realms)s",
+                                      realms=', '.join(sorted(unknown))))
+        count = self.reindex(realms or None)
+        printout(_("%(count)s document(s) indexed.", count=count))
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        self._create_fulltext_index()
+
+    def environment_needs_upgrade(self):
+        # The upgrade adding the index requests a reindex, which is
+        # done once all the database upgrades are applied.
+        if DatabaseManager(self.env).get_database_version() < 47:
+            return True
+        return bool(self.env.db_query("""
+            SELECT value FROM system WHERE name='search_reindex'
+            """))
+
+    def upgrade_environment(self):
+        with self.env.db_transaction as db:
+            if db("SELECT value FROM system WHERE name='search_reindex'"):
+                self.reindex()
+                db("DELETE FROM system WHERE name='search_reindex'")
+
+    # Public API
+
+    def get_indexed_realms(self):
+        """Return the set of realms having an enabled indexer."""
+        return {realm for indexer in self.indexers
+                      for realm in indexer.get_search_index_realms()}
+
+    def index_resource(self, resource, time, author, title, text):
+        """Add the document of `resource` to the index, replacing the
+        existing document.
+        """
+        parent = resource.parent
+        with self.env.db_transaction as db:
+            self._remove(db, resource)
+            db("""INSERT INTO search_index (realm, target, parent_realm,
+                                            parent_target, time, author,
+                                            title, text)
+                  VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                  """, (resource.realm, unicode(resource.id),
+                        parent.realm if parent else '',
+                        unicode(parent.id) if parent else '',
+                        to_utimestamp(time), author, title, text))
+
+    def remove_resource(self, resource):
+        """Remove the document of `resource` from the index."""
+        with self.env.db_transaction as db:
+            self._remove(db, resource)
+
+    def reindex_resources(self, realm, ids):
+        """Index again the documents of the resources of `realm` having
+        the given ids, for when the resources have been modified without
+        notifying the indexers.
+        """
+        with self.env.db_transaction as db:
+            for id_ in ids:
+                self._remove(db, Resource(realm, id_))
+            for indexer in self.indexers:
+                if realm in indexer.get_search_index_realms():
+                    self._insert(db, [self._to_row(*document)
+                                      for document in
+                                      indexer.get_search_documents(realm,
+                                                                   ids)])
+
+    def reindex(self, realms=None):
+        """Rebuild the index of the documents of `realms`, or of all the
+        indexed realms if `realms` is `None`.
+
+        :return: the number of documents indexed.
+        """
+        count = 0
+        with self.env.db_transaction as db:
+            if not self._fulltext_index:
+                self._create_fulltext_index()
+            for indexer in self.indexers:
+                for realm in indexer.get_search_index_realms():
+                    if realms is not None and realm not in realms:
+                        continue
+                    db("DELETE FROM search_index WHERE realm=%s", (realm,))
+                    rows = []
+                    for document in indexer.get_search_documents(realm):
+                        rows.append(self._to_row(*document))
+                        if len(rows) >= 100:
+                            count += self._insert(db, rows)
+                            rows = []
+                    count += self._insert(db, rows)
+        return count
+
+    def query_index(self, db, realms, terms, limit, cursor=None):
+        """Return the indexed resources matching all the search `terms`,
+        by decreasing score and date, as a `(rows, cursor)` tuple.
+
+        :param realms: list of `(realm, parent_realm)` tuples, where
+                       `parent_realm` is `None` for selecting the
+                       resources of `realm` regardless of their parent.
+        :param limit: the maximum number of rows returned.
+        :param cursor: `None`, or the `cursor` returned by the previous
+                       call, for retrieving the next rows.
+
+        The `rows` are `(realm, target, parent_realm, parent_target,
+        time, author, title, text, score)` tuples. The returned `cursor`
+        is `None` if there are no more rows.
+
+        Return `None` if some of the `realms` aren't indexed.
+
+        :since: 1.3.4
+        """
+        if not set(realm for realm, parent_realm in realms) <= \
+                self.get_indexed_realms():
+            return None
+        sql, args = self._get_index_sql(db, realms, terms,
+                                        _columns + ('realm', 'parent_realm',
+                                                    'id'))
+        if cursor is not None:
+            score, time, id_ = cursor
+            sql = """
+                SELECT * FROM (%s) s
+                WHERE score < %%s OR score = %%s AND
+                  (time < %%s OR time = %%s AND id < %%s)
+                """ % sql
+            args += (score, score, time, time, id_)
+        rows = db("""
+            SELECT realm, target, parent_realm, parent_target, time, author,
+                   title, text, score, id
+            FROM (%s) s ORDER BY score DESC, time DESC, id DESC LIMIT %%s
+            """ % sql, args + (limit,))
+        if len(rows) == limit:
+            last = rows[-1]
+            cursor = last[8], last[4], last[9]
+        else:
+            cursor = None
+        return [row[:-1] for row in rows], cursor
+
+    def get_index_sql(self, db, realm, terms, parent_realm=None):
+        """Return an SQL sub-query selecting the indexed resources of
+        `realm` which match all the search `terms`, as an `(sql, args)`
+        tuple.
+
+        The sub-query has the columns `target`, `parent_target`, `time`,
+        `author`, `title`, `text` and `score`, where `score` is higher
+        for more relevant documents. A term ending with `*` matches the
+        words starting with the term.
+
+        Return `None` if the resources of `realm` aren't indexed, in
+        which case the resources must be searched directly.
+        """
+        if realm not in self.get_indexed_realms():
+            return None
+        return self._get_index_sql(db, [(realm, parent_realm)], terms,
+                                   _columns)
+
+    # Internal methods
+
+    def _get_index_sql(self, db, realms, terms, columns):
+        columns = ', '.join('search_index.' + name for name in columns)
+        where = []
+        args = []
+        for realm, parent_realm in realms:
+            if parent_realm is None:
+                where.append('search_index.realm=%s')
+                args.append(realm)
+            else:
+                where.append('search_index.realm=%s AND '
+                             'search_index.parent_realm=%s')
+                args.extend((realm, parent_realm))
+        where = '(%s)' % ' OR '.join('(%s)' % w for w in where)
+        words = [_get_words(term.rstrip('*')) for term in terms]
+        fulltext = self._fulltext_index and all(words)
+        scheme = self._get_scheme()
+        if fulltext and scheme == 'sqlite':
+            query = ' '.join(' '.join('"%s"' % word.replace('"', '""')
+                                      for word in term_words) +
+                             ('*' if term.endswith('*') else '')
+                             for term, term_words in zip(terms, words))
+            sql = """
+                SELECT %s, -bm25(search_index_fts) AS score
+                FROM search_index INNER JOIN search_index_fts
+                  ON search_index_fts.rowid=search_index.id
+                WHERE search_index_fts MATCH %%s AND %s
+                """ % (columns, where)
+            return sql, tuple([query] + args)
+        elif fulltext and scheme == 'postgres':
+            query = ' & '.join(
+                "'%s'%s" % (word.replace("'", "''"),
+                            ':*' if term.endswith('*') else '')
+                for term, term_words in zip(terms, words)
+                for word in term_words)
+            sql = """
+                SELECT %s, ts_rank(%s, to_tsquery('simple', %%s)) AS score
+                FROM search_index
+                WHERE %s @@ to_tsquery('simple', %%s) AND %s
+                """ % (columns, _tsvector_sql, _tsvector_sql, where)
+            return sql, tuple([query, query] + args)
+        else:
+            sql, like_args = search_to_sql(db, ['title', 'text'],
+                                           [term.rstrip('*') or term
+                                            for term in terms])
+            sql = """
+                SELECT %s, 0 AS score FROM search_index WHERE %s AND %s
+                """ % (columns, sql, where)
+            return sql, like_args + tuple(args)
+
+    @cached
+    def _fulltext_index(self):
+        """Whether the full-text index of the database backend exists."""
+        scheme = self._get_scheme()
+        with self.env.db_query as db:
+            if scheme == 'sqlite':
+                return db.has_table('search_index_fts')
+            elif scheme == 'postgres':
+                for count, in db("""
+                        SELECT COUNT(*) FROM pg_indexes
+                        WHERE schemaname=%s AND indexname=%s
+                        """, (db.schema, 'search_index_fts_idx')):
+                    return bool(count)
+        return False
+
+    def _create_fulltext_index(self):
+        scheme = self._get_scheme()
+        with self.env.db_transaction as db:
+            if scheme == 'sqlite':
+                try:
+                    db("""
+                        CREATE VIRTUAL TABLE search_index_fts USING fts5(
+                            title, text, content='search_index',
+                            content_rowid='id')
+                        """)
+                except self.env.db_exc.OperationalError as e:
+                    self.log.warning("Full-text search index not "
+                                     "available: %s", e)
+                    return
+                for sql in _sqlite_triggers:
+                    db(sql)
+                db("""INSERT INTO search_index_fts(search_index_fts)
+                      VALUES ('rebuild')""")
+            elif scheme == 'postgres':
+                db("CREATE INDEX search_index_fts_idx ON search_index "
+                   "USING gin(%s)" % _tsvector_sql)
+            else:
+                return
+        del self._fulltext_index
+
+    def _get_scheme(self):
+        return DatabaseManager(self.env).connection_uri.split(':', 1)[0]
+
+    def _insert(self, db, rows):
+        if rows:
+            db.executemany("""
+                INSERT INTO search_index (realm, target, parent_realm,
+                                          parent_target, time, author,
+                                          title, text)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                """, rows)
+        return len(rows)
+
+    def _remove(self, db, resource):
+        parent = resource.parent
+        db("""DELETE FROM search_index
+              WHERE realm=%s AND target=%s AND parent_realm=%s
+              AND parent_target=%s
+              """, (resource.realm, unicode(resource.id),
+                    parent.realm if parent else '',
+                    unicode(parent.id) if parent else ''))
+
+    def _to_row(self, resource, time, author, title, text):
+        parent = resource.parent
+        return (resource.realm, unicode(resource.id),
+                parent.realm if parent else '',
+                unicode(parent.id) if parent else '',
+                to_utimestamp(time), author, title, text)
+
+
+_columns = ('target', 'parent_target', 'time', 'author', 'title', 'text')
+
+_tsvector_sql = "to_tsvector('simple', COALESCE(title, '') || ' ' || " \
+                "COALESCE(text, ''))"
+
+_sqlite_triggers = (
+    """CREATE TRIGGER search_index_fts_insert AFTER INSERT ON search_index
+       BEGIN
+         INSERT INTO search_index_fts(rowid, title, text)
+         VALUES (new.id, new.title, new.text);
+       END""",
+    """CREATE TRIGGER search_index_fts_delete AFTER DELETE ON search_index
+       BEGIN
+         INSERT INTO search_index_fts(search_index_fts, rowid, title, text)
+         VALUES ('delete', old.id, old.title, old.text);
+       END""",
+    """CREATE TRIGGER search_index_fts_update AFTER UPDATE ON search_index
+       BEGIN
+         INSERT INTO search_index_fts(search_index_fts, rowid, title, text)
+         VALUES ('delete', old.id, old.title, old.text);
+         INSERT INTO search_index_fts(rowid, title, text)
+         VALUES (new.id, new.title, new.text);
+       END""",
+)
+
+_words_re = re.compile(r'\w+', re.UNICODE)
+
+
+def _get_words(term):
+    return _words_re.findall(term)
+
 
 def search_to_sql(db, columns, terms):
     """Convert a search query into an SQL WHERE clause and corresponding
@@ -91,3 +493,31 @@ def shorten_result(text='', keywords=[], maxlen=240, fuzz=60):
     if beg < len(text)-maxlen:
         msg += ' ...'
     return msg
+
+
+def search_result_key(result):
+    """Return the key by which the search results are sorted, in
+    decreasing order: the results having a relevance score first, by
+    decreasing score, and then all the results by decreasing date.
+
+    :since: 1.3.4
+    """
+    score = result[5] if len(result) > 5 else None
+    return score is not None, score or 0, result[2]
+
+
+def merge_search_results(iterables):
+    """Merge iterables of search results which are each sorted by
+    decreasing `search_result_key` into a single iterator of sorted
+    search results.
+
+    The iterables are consumed lazily.
+
+    :since: 1.3.4
+    """
+    return merge_sorted(iterables, _negated_key)
+
+
+def _negated_key(result):
+    has_score, score, date = search_result_key(result)
+    return not has_score, -score, -to_utimestamp(date)
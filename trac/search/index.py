@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.attachment import Attachment, IAttachmentChangeListener
+from trac.config import IntOption
+from trac.core import *
+from trac.mimeview.api import Mimeview
+from trac.resource import Resource, ResourceNotFound
+from trac.search.api import ISearchIndexer, SearchSystem
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.datefmt import from_utimestamp
+from trac.util.text import exception_to_unicode, printout
+from trac.util.translation import _
+from trac.versioncontrol.api import IRepositoryChangeListener, \
+                                    RepositoryManager
+from trac.wiki.api import IWikiChangeListener
+
+
+class DefaultSearchIndexer(Component):
+    """Maintain the full-text search index of the tickets, milestones,
+    wiki pages, attachments and changesets.
+
+    The text of the attachments is extracted out of the requests, by
+    `trac-admin search extract`, and added to their indexed document.
+    """
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               IMilestoneChangeListener, IRepositoryChangeListener,
+               ISearchIndexer, ITicketChangeListener, IWikiChangeListener)
+
+    attachment_text_max_size = IntOption('search',
+        'attachment_text_max_size', 65536,
+        """Maximum number of bytes read from an attachment for extracting
+        its text, which is added to the full-text search index. The text
+        of the attachments is extracted by `trac-admin search extract`.
+        Binary attachments are skipped. Set to 0 to disable the
+        extraction.
+        (''since 1.3.4'')""")
+
+    BATCH_SIZE = 100
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search extract', '[count]',
+               """Extract the text of the new attachments
+
+               The text of at most `count` attachments added since the
+               last run, or of all of them, is extracted and indexed.
+               This command is meant to be run periodically, for
+               example from cron.
+               """,
+               None, self._do_extract)
+
+    def _do_extract(self, count=None):
+        if count is not None:
+            try:
+                count = int(count)
+            except ValueError:
+                raise AdminCommandError(_("Invalid count: %(count)s",
+                                          count=count))
+        count = self.extract_attachment_texts(count)
+        printout(_("%(count)s attachment(s) extracted.", count=count))
+
+    # ISearchIndexer methods
+
+    def get_search_index_realms(self):
+        return ('attachment', 'changeset', 'milestone', 'ticket', 'wiki')
+
+    def get_search_documents(self, realm, ids=None):
+        if realm == 'ticket':
+            if ids is None:
+                ids = [id_ for id_, in
+                       self.env.db_query("SELECT id FROM ticket ORDER BY id")]
+            documents = self._batches(self._ticket_documents, list(ids))
+        elif realm == 'wiki':
+            if ids is None:
+                ids = [name for name, in
+                       self.env.db_query("SELECT name FROM wiki_head")]
+            documents = self._batches(self._wiki_documents, list(ids))
+        elif realm == 'milestone':
+            documents = self._milestone_documents()
+        elif realm == 'attachment':
+            documents = self._attachment_documents()
+        elif realm == 'changeset':
+            documents = self._changeset_documents()
+        else:
+            return
+        if ids is not None:
+            ids = set(unicode(id_) for id_ in ids)
+        for document in documents:
+            if ids is None or unicode(document[0].id) in ids:
+                yield document
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self._index_ticket(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._index_ticket(ticket.id)
+
+    def ticket_deleted(self, ticket):
+        SearchSystem(self.env).remove_resource(ticket.resource)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._index_ticket(ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._index_ticket(ticket.id)
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self._index_milestone(milestone.name)
+
+    def milestone_changed(self, milestone, old_values):
+        if 'name' in old_values:
+            SearchSystem(self.env).remove_resource(
+                Resource('milestone', old_values['name']))
+        self._index_milestone(milestone.name)
+
+    def milestone_deleted(self, milestone):
+        SearchSystem(self.env).remove_resource(milestone.resource)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_deleted(self, page):
+        SearchSystem(self.env).remove_resource(Resource('wiki', page.name))
+
+    def wiki_page_version_deleted(self, page):
+        self._index_wiki_page(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        SearchSystem(self.env).remove_resource(Resource('wiki', old_name))
+        self._index_wiki_page(page.name)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        if self.attachment_text_max_size > 0:
+            self.env.db_transaction("""
+                INSERT INTO attachment_text (type, id, filename, extracted)
+                VALUES (%s,%s,%s,0)
+                """, (attachment.parent_realm, attachment.parent_id,
+                      attachment.filename))
+        self._index_attachment(attachment)
+
+    def attachment_deleted(self, attachment):
+        with self.env.db_transaction as db:
+            db("""
+                DELETE FROM attachment_text
+                WHERE type=%s AND id=%s AND filename=%s
+                """, (attachment.parent_realm, attachment.parent_id,
+                      attachment.filename))
+            SearchSystem(self.env).remove_resource(attachment.resource)
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        with self.env.db_transaction as db:
+            db("""
+                UPDATE attachment_text SET type=%s, id=%s, filename=%s
+                WHERE type=%s AND id=%s AND filename=%s
+                """, (attachment.parent_realm, attachment.parent_id,
+                      attachment.filename, old_parent_realm, old_parent_id,
+                      old_filename))
+            SearchSystem(self.env).remove_resource(
+                Resource(old_parent_realm, old_parent_id)
+                .child('attachment', old_filename))
+            self._index_attachment(attachment)
+
+    def attachment_reparented(self, attachment, old_parent_realm,
+                              old_parent_id):
+        pass
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        self._index_changeset(repos, changeset)
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self._index_changeset(repos, changeset)
+
+    # Public API
+
+    def extract_attachment_texts(self, limit=None):
+        """Extract the text of the attachments queued when they were
+        added, and index it.
+
+        At most `attachment_text_max_size` bytes are read from each
+        attachment, and the attachments are processed by batches, so
+        that the memory used doesn't depend on the number nor on the
+        size of the attachments.
+
+        :param limit: the maximum number of attachments processed, or
+                      `None` for processing all of them.
+        :return: the number of attachments processed.
+        """
+        count = 0
+        while limit is None or count < limit:
+            size = self.BATCH_SIZE if limit is None \
+                   else min(self.BATCH_SIZE, limit - count)
+            rows = self.env.db_query("""
+                SELECT type, id, filename FROM attachment_text
+                WHERE extracted=0 ORDER BY type, id, filename LIMIT %s
+                """, (size,))
+            for type_, id_, filename in rows:
+                text = self._extract_attachment_text(type_, id_, filename)
+                with self.env.db_transaction as db:
+                    db("""
+                        UPDATE attachment_text SET extracted=1, text=%s
+                        WHERE type=%s AND id=%s AND filename=%s
+                        """, (text, type_, id_, filename))
+                    if text:
+                        self._index_attachment(
+                            Attachment(self.env, type_, id_, filename))
+            count += len(rows)
+            if len(rows) < size:
+                break
+        return count
+
+    # Internal methods
+
+    def _extract_attachment_text(self, type_, id_, filename):
+        try:
+            attachment = Attachment(self.env, type_, id_, filename)
+            with attachment.open() as fd:
+                content = fd.read(self.attachment_text_max_size)
+        except (IOError, ResourceNotFound) as e:
+            self.log.warning("Can't extract the text of attachment %s/%s/%s:"
+                             " %s", type_, id_, filename,
+                             exception_to_unicode(e))
+            return None
+        mimeview = Mimeview(self.env)
+        mimetype = mimeview.get_mimetype(filename, content)
+        if mimeview.is_binary(mimetype, filename, content):
+            return None
+        return mimeview.to_unicode(content, mimetype)
+
+    def _index_ticket(self, id):
+        search = SearchSystem(self.env)
+        for document in self._ticket_documents([id]):
+            search.index_resource(*document)
+
+    def _index_milestone(self, name):
+        search = SearchSystem(self.env)
+        for document in self._milestone_documents(name):
+            search.index_resource(*document)
+
+    def _index_wiki_page(self, name):
+        search = SearchSystem(self.env)
+        search.remove_resource(Resource('wiki', name))
+        for document in self._wiki_documents([name]):
+            search.index_resource(*document)
+
+    def _index_attachment(self, attachment):
+        for text, in self.env.db_query("""
+                SELECT text FROM attachment_text
+                WHERE type=%s AND id=%s AND filename=%s
+                """, (attachment.parent_realm, attachment.parent_id,
+                      attachment.filename)):
+            break
+        else:
+            text = None
+        SearchSystem(self.env).index_resource(
+            attachment.resource, attachment.date, attachment.author,
+            attachment.filename,
+            '\n'.join((attachment.filename, attachment.description or '',
+                       attachment.author or '', text or '')))
+
+    def _index_changeset(self, repos, changeset):
+        rev = changeset.rev
+        if hasattr(repos, 'db_rev'):
+            rev = repos.db_rev(rev)
+        resource = Resource('repository', repos.reponame) \
+                   .child('changeset', rev)
+        SearchSystem(self.env).index_resource(
+            resource, changeset.date, changeset.author, changeset.message,
+            '\n'.join((rev, changeset.message or '', changeset.author or '')))
+
+    def _batches(self, get_documents, ids):
+        for idx in xrange(0, len(ids), self.BATCH_SIZE):
+            for document in get_documents(ids[idx:idx + self.BATCH_SIZE]):
+                yield document
+
+    def _ticket_documents(self, ids):
+        holders = ','.join(['%s'] * len(ids))
+        texts = {}
+        with self.env.db_query as db:
+            for id_, value in db("""
+                    SELECT ticket, newvalue FROM ticket_change
+                    WHERE field='comment' AND ticket IN (%s)
+                    UNION ALL
+                    SELECT ticket, value FROM ticket_custom
+                    WHERE ticket IN (%s)
+                    """ % (holders, holders), list(ids) * 2):
+                if value:
+                    texts.setdefault(id_, []).append(value)
+            for id_, time, reporter, summary, keywords, description, cc \
+                    in db("""
+                    SELECT id, time, reporter, summary, keywords,
+                           description, cc
+                    FROM ticket WHERE id IN (%s)
+                    """ % holders, ids):
+                text = [unicode(id_), summary, keywords, description,
+                        reporter, cc] + texts.get(id_, [])
+                yield (Resource('ticket', id_), from_utimestamp(time),
+                       reporter, summary,
+                       '\n'.join(value for value in text if value))
+
+    def _wiki_documents(self, names):
+        with self.env.db_query as db:
+            for name, time, author, text in db("""
+                    SELECT w1.name, w1.time, w1.author, w1.text
+                    FROM wiki w1, wiki_head w2
+                    WHERE w1.version=w2.version AND w1.name=w2.name
+                    AND w2.name IN (%s)
+                    """ % ','.join(['%s'] * len(names)), names):
+                yield (Resource('wiki', name), from_utimestamp(time), author,
+                       name, '\n'.join((text or '', author or '')))
+
+    def _milestone_documents(self, name=None):
+        sql = "SELECT name, due, completed, description FROM milestone"
+        args = ()
+        if name is not None:
+            sql += " WHERE name=%s"
+            args = (name,)
+        for name, due, completed, description in \
+                self.env.db_query(sql, args):
+            yield (Resource('milestone', name),
+                   from_utimestamp(completed or due or 0), '', name,
+                   description or '')
+
+    def _attachment_documents(self):
+        for type_, id_, filename, time, description, author, text in \
+                self.env.db_query("""
+                SELECT a.type, a.id, a.filename, a.time, a.description,
+                       a.author, t.text
+                FROM attachment a
+                LEFT OUTER JOIN attachment_text t
+                  ON t.type=a.type AND t.id=a.id AND t.filename=a.filename
+                """):
+            yield (Resource(type_, id_).child('attachment', filename),
+                   from_utimestamp(time), author, filename,
+                   '\n'.join((filename, description or '', author or '',
+                              text or '')))
+
+    def _changeset_documents(self):
+        rm = RepositoryManager(self.env)
+        reponames = {info['id']: name
+                     for name, info in rm.get_all_repositories().iteritems()}
+        for id_, rev, time, author, message in self.env.db_query("""
+                SELECT repos, rev, time, author, message FROM revision
+                """):
+            if id_ in reponames:
+                yield (Resource('repository', reponames[id_])
+                       .child('changeset', rev),
+                       from_utimestamp(time), author, message,
+                       '\n'.join((rev, message or '', author or '')))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+import os.path
+import unittest
+
+from trac.admin.api import AdminCommandError
+from trac.attachment import Attachment
+from trac.search.api import SearchSystem
+from trac.search.index import DefaultSearchIndexer
+from trac.search.web_ui import SearchModule
+from trac.test import EnvironmentStub, MockRequest, mkdtemp
+from trac.ticket.model import Milestone
+from trac.ticket.roadmap import MilestoneModule
+from trac.ticket.test import insert_ticket
+from trac.ticket.web_ui import TicketModule
+from trac.util import create_file
+from trac.wiki.admin import WikiAdmin
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(path=mkdtemp())
+        self.search = SearchSystem(self.env)
+        self.search.reindex()
+
+    def tearDown(self):
+        self.env.reset_db_and_disk()
+
+    def _search(self, query, filters=('milestone', 'ticket', 'wiki')):
+        req = MockRequest(self.env)
+        terms = SearchModule(self.env)._parse_query(req, query)
+        return list(SearchModule(self.env)._do_search(req, terms,
+                                                      list(filters)))
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def _count_documents(self, realm):
+        return self.env.db_query("""
+            SELECT COUNT(*) FROM search_index WHERE realm=%s
+            """, (realm,))[0][0]
+
+    def test_indexed_realms(self):
+        self.assertEqual({'attachment', 'changeset', 'milestone', 'ticket',
+                          'wiki'}, self.search.get_indexed_realms())
+
+    def test_reindex(self):
+        insert_ticket(self.env, summary='Indexed ticket')
+        self._insert_page('IndexedPage', 'Indexed text')
+        self.env.db_transaction("DELETE FROM search_index")
+
+        self.assertEqual([], self._search('indexed'))
+        self.assertEqual(2, self.search.reindex(['ticket', 'wiki']))
+        self.assertEqual(['/trac.cgi/ticket/1', '/trac.cgi/wiki/IndexedPage'],
+                         sorted(r[0] for r in self._search('indexed')))
+
+    def test_ticket_listener(self):
+        ticket = insert_ticket(self.env, summary='Summary',
+                               description='Fulltext')
+        self.assertEqual(['/trac.cgi/ticket/1'],
+                         [r[0] for r in self._search('fulltext')])
+
+        ticket.save_changes('joe', 'A comment about searching')
+        self.assertEqual(['/trac.cgi/ticket/1'],
+                         [r[0] for r in self._search('searching')])
+
+        ticket.delete()
+        self.assertEqual(0, self._count_documents('ticket'))
+        self.assertEqual([], self._search('fulltext'))
+
+    def test_wiki_listener(self):
+        page = self._insert_page('SearchPage', 'Original text')
+        page.text = 'Modified text'
+        page.save('joe', 'Modified')
+        self.assertEqual([], self._search('original'))
+        self.assertEqual(1, len(self._search('modified')))
+
+        page.rename('RenamedPage')
+        self.assertEqual(['/trac.cgi/wiki/RenamedPage'],
+                         [r[0] for r in self._search('modified')])
+
+        page.delete()
+        self.assertEqual(0, self._count_documents('wiki'))
+
+    def test_milestone_listener(self):
+        milestone = Milestone(self.env)
+        milestone.name = 'milestone5'
+        milestone.description = 'Searchable milestone'
+        milestone.insert()
+        milestone.name = 'milestone6'
+        milestone.update()
+        self.assertEqual(['/trac.cgi/milestone/milestone6'],
+                         [r[0] for r in self._search('searchable')])
+
+        milestone.delete()
+        self.assertEqual([], self._search('searchable'))
+
+    def test_wiki_import_page(self):
+        filename = os.path.join(self.env.path, 'ImportedPage')
+        create_file(filename, 'Imported text')
+        WikiAdmin(self.env).import_page(filename, 'ImportedPage')
+        self.assertEqual(['/trac.cgi/wiki/ImportedPage'],
+                         [r[0] for r in self._search('imported')])
+
+    def _insert_attachment(self, filename, content):
+        attachment = Attachment(self.env, 'ticket', 1)
+        attachment.insert(filename, io.BytesIO(content), len(content))
+        return attachment
+
+    def test_extract_attachment_text(self):
+        insert_ticket(self.env, summary='Ticket')
+        self._insert_attachment('notes.txt', 'Attached content\n')
+        self.assertEqual([], self._search('content'))
+
+        self.assertEqual(1, DefaultSearchIndexer(self.env)
+                            .extract_attachment_texts())
+        self.assertEqual(['/trac.cgi/attachment/ticket/1/notes.txt'],
+                         [r[0] for r in self._search('content')])
+        self.assertEqual(0, DefaultSearchIndexer(self.env)
+                            .extract_attachment_texts())
+
+    def test_extract_attachment_text_limit(self):
+        insert_ticket(self.env, summary='Ticket')
+        self._insert_attachment('1.txt', 'Attached content\n')
+        self._insert_attachment('2.txt', 'Attached content\n')
+        indexer = DefaultSearchIndexer(self.env)
+
+        self.assertEqual(1, indexer.extract_attachment_texts(1))
+        self.assertEqual(1, len(self._search('content')))
+        self.assertEqual(1, indexer.extract_attachment_texts(1))
+        self.assertEqual(2, len(self._search('content')))
+
+    def test_extract_attachment_text_binary(self):
+        insert_ticket(self.env, summary='Ticket')
+        self._insert_attachment('data.bin', 'Binary\x00content')
+
+        self.assertEqual(1, DefaultSearchIndexer(self.env)
+                            .extract_attachment_texts())
+        self.assertEqual([], self._search('content'))
+
+    def test_extract_attachment_text_max_size(self):
+        self.env.config.set('search', 'attachment_text_max_size', 10)
+        insert_ticket(self.env, summary='Ticket')
+        self._insert_attachment('notes.txt', 'Attached content\n')
+
+        DefaultSearchIndexer(self.env).extract_attachment_texts()
+        self.assertEqual(1, len(self._search('attached')))
+        self.assertEqual([], self._search('content'))
+
+    def test_extract_attachment_text_deleted(self):
+        insert_ticket(self.env, summary='Ticket')
+        attachment = self._insert_attachment('notes.txt', 'Content\n')
+        attachment.delete()
+
+        self.assertEqual(0, DefaultSearchIndexer(self.env)
+                            .extract_attachment_texts())
+        self.assertEqual([], self.env.db_query("""
+            SELECT * FROM attachment_text"""))
+
+    def test_prefix_term(self):
+        insert_ticket(self.env, summary='Prefixed words')
+        self.assertEqual([], self._search('prefix'))
+        self.assertEqual(1, len(self._search('prefix*')))
+
+    def test_results_have_score(self):
+        insert_ticket(self.env, summary='Score')
+        results = self._search('score')
+        self.assertEqual(1, len(results))
+        self.assertEqual(6, len(results[0]))
+
+    def test_scored_results_sorted_by_score(self):
+        insert_ticket(self.env, summary='Relevance',
+                      description='relevance relevance relevance')
+        insert_ticket(self.env, summary='Other',
+                      description='Some text about relevance and '
+                                  'many other words which are not related')
+        results = self._search('relevance')
+        self.assertEqual(['/trac.cgi/ticket/1', '/trac.cgi/ticket/2'],
+                         [r[0] for r in results])
+        self.assertGreater(results[0][5], results[1][5])
+
+    def test_query_index_pages(self):
+        for idx in xrange(5):
+            insert_ticket(self.env, summary='Paged %d' % idx)
+        rows = []
+        cursor = None
+        with self.env.db_query as db:
+            while True:
+                page, cursor = self.search.query_index(
+                    db, [('ticket', None)], ['paged'], 2, cursor)
+                self.assertGreaterEqual(2, len(page))
+                rows.extend(page)
+                if cursor is None:
+                    break
+        self.assertEqual(['1', '2', '3', '4', '5'],
+                         sorted(row[1] for row in rows))
+        self.assertEqual(sorted(rows, key=lambda row: (row[8], row[4]),
+                                reverse=True), rows)
+
+    def test_query_index_realm_not_indexed(self):
+        with self.env.db_query as db:
+            self.assertIsNone(self.search.query_index(
+                db, [('ticket', None), ('report', None)], ['term'], 10))
+
+    def test_search_results_page(self):
+        for idx in xrange(25):
+            insert_ticket(self.env, summary='Paged %d' % idx)
+        self._insert_page('PagedPage', 'Paged text')
+        req = MockRequest(self.env)
+        terms = ['paged']
+        filters = ['ticket', 'wiki']
+        results = SearchModule(self.env)._do_search(req, terms, filters)
+        paged_results = SearchModule(self.env)._do_search(req, terms,
+                                                          filters, limit=3)
+        hrefs = [r[0] for r in results]
+        self.assertEqual(26, len(hrefs))
+        self.assertEqual(hrefs, [r[0] for r in paged_results])
+
+        results, cursor = TicketModule(self.env).get_search_results_page(
+            req, terms, filters, 10, None)
+        self.assertEqual(10, len(results))
+        self.assertIsNotNone(cursor)
+
+    def test_process_request_page(self):
+        for idx in xrange(25):
+            insert_ticket(self.env, summary='Paged %d' % idx)
+        req = MockRequest(self.env, args={'page': '2', 'q': 'paged',
+                                          'ticket': 'on'})
+
+        data = SearchModule(self.env).process_request(req)[1]
+
+        self.assertEqual(1, data['results'].page)
+        self.assertEqual(10, len(data['results']))
+        self.assertEqual(25, data['results'].num_items)
+
+    def test_get_index_sql_realm_not_indexed(self):
+        with self.env.db_query as db:
+            self.assertIsNone(self.search.get_index_sql(db, 'report',
+                                                        ['term']))
+
+    def test_reindex_unknown_realm(self):
+        self.assertRaises(AdminCommandError, self.search._do_reindex,
+                          'report')
+
+
+class SearchWithoutIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(disable=[DefaultSearchIndexer])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_no_indexer(self):
+        insert_ticket(self.env, summary='Unindexed')
+        req = MockRequest(self.env)
+        results = list(TicketModule(self.env).get_search_results(
+            req, ['unindexed'], ['ticket']))
+        self.assertEqual(set(), SearchSystem(self.env).get_indexed_realms())
+        self.assertEqual(1, len(results))
+        self.assertEqual(5, len(results[0]))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SearchIndexTestCase))
+    suite.addTest(unittest.makeSuite(SearchWithoutIndexTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -16,11 +16,13 @@
 
 import pkg_resources
 import re
+from itertools import islice
 
 from trac.config import IntOption, ListOption
 from trac.core import *
 from trac.perm import IPermissionRequestor
-from trac.search.api import ISearchSource
+from trac.search.api import ISearchSource, merge_search_results, \
+                            search_result_key
 from trac.util.datefmt import format_datetime, user_time
 from trac.util.html import Markup, escape, find_element, tag
 from trac.util.presentation import Paginator
@@ -106,7 +108,11 @@ class SearchModule(Component):
 
             terms = self._parse_query(req, query)
             if terms:
-                results = self._do_search(req, terms, filters)
+                page = req.args.getint('page', 1, min=1)
+                # Retrieve the results of the pages shown in the page index
+                limit = (page + 10) * self.RESULTS_PER_PAGE + 1
+                results = list(islice(self._do_search(req, terms, filters,
+                                                       limit), limit))
                 if results:
                     data.update(self._prepare_results(req, filters, results))
             if noquickjump and filters:
@@ -229,12 +235,38 @@ class SearchModule(Component):
                            'Query must be at least %(num)s characters long.',
                            num=self.min_query_length))
 
-    def _do_search(self, req, terms, filters):
-        results = []
+    def _do_search(self, req, terms, filters, limit=None):
+        """Return an iterator of the search results of all the sources,
+        sorted by decreasing `search_result_key`.
+
+        The sources implementing `get_search_results_page` are queried
+        lazily, for `limit` results at a time.
+        """
+        iterables = []
         for source in self.search_sources:
-            results.extend(source.get_search_results(req, terms, filters)
-                           or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
+            page = None
+            if limit and hasattr(source, 'get_search_results_page'):
+                page = source.get_search_results_page(req, terms, filters,
+                                                      limit, None)
+            if page is not None:
+                iterables.append(self._iter_search_results_pages(
+                    source, req, terms, filters, limit, page))
+            else:
+                iterables.append(
+                    sorted(source.get_search_results(req, terms, filters)
+                           or [], key=search_result_key, reverse=True))
+        return merge_search_results(iterables)
+
+    def _iter_search_results_pages(self, source, req, terms, filters, limit,
+                                   page):
+        results, cursor = page
+        while True:
+            for result in results:
+                yield result
+            if cursor is None:
+                break
+            results, cursor = source.get_search_results_page(
+                req, terms, filters, limit, cursor)
 
     def _prepare_results(self, req, filters, results):
         page = req.args.getint('page', 1, min=1)
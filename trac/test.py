@@ -142,6 +142,9 @@ class MockPerm(object):
     def __call__(self, realm_or_resource, id=False, version=False):
         return self
 
+    def filter(self, action, resources):
+        return list(resources)
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         pass
@@ -150,6 +150,8 @@ class AttachmentTestCase(unittest.TestCase):
         with self.env.db_transaction as db:
             db("INSERT INTO wiki (name,version) VALUES ('WikiStart',1)")
             db("INSERT INTO wiki (name,version) VALUES ('SomePage',1)")
+            db("INSERT INTO wiki_head (name,version) VALUES ('WikiStart',1)")
+            db("INSERT INTO wiki_head (name,version) VALUES ('SomePage',1)")
             db("INSERT INTO ticket (id) VALUES (42)")
             db("INSERT INTO ticket (id) VALUES (43)")
             db("INSERT INTO attachment VALUES (%s,%s,%s,%s,%s,%s,%s)",
@@ -696,6 +698,8 @@ class TracAdminTestCase(TracAdminTestCaseBase):
         with self.env.db_transaction as db:
             db("INSERT INTO wiki (name,version) VALUES ('WikiStart',1)")
             db("INSERT INTO wiki (name,version) VALUES ('SomePage',1)")
+            db("INSERT INTO wiki_head (name,version) VALUES ('WikiStart',1)")
+            db("INSERT INTO wiki_head (name,version) VALUES ('SomePage',1)")
             db("INSERT INTO ticket (id) VALUES (42)")
             db("INSERT INTO ticket (id) VALUES (43)")
             db("INSERT INTO attachment VALUES (%s,%s,%s,%s,%s,%s,%s)",
@@ -271,6 +271,18 @@ class PermissionSystemTestCase(BaseTestCase):
                           'TEST_MODIFY': True,  'TEST_ADMIN': True},
                          self.perm.get_user_permissions('jane'))
 
+    def test_grant_revoke_group_membership(self):
+        self.perm.grant_permission('dev', 'TEST_ADMIN')
+        self.perm.grant_permission('admin', 'dev')
+        self.perm.grant_permission('bob', 'admin')
+        self.assertEqual({'TEST_CREATE': True, 'TEST_DELETE': True,
+                          'TEST_MODIFY': True, 'TEST_ADMIN': True},
+                         self.perm.get_user_permissions('bob'))
+        self.perm.revoke_permission('admin', 'dev')
+        self.assertEqual({}, self.perm.get_user_permissions('bob'))
+        self.assertEqual(['admin', 'anonymous', 'authenticated'],
+                         self.perm.get_permission_groups('bob'))
+
     def test_undefined_permissions(self):
         """Only defined actions are returned in the dictionary."""
         self.perm.grant_permission('bob', 'TEST_CREATE')
@@ -515,6 +527,88 @@ class PermissionPolicyTestCase(BaseTestCase):
                          {('testuser', 'TEST_MODIFY'): True,
                           ('testuser', 'TEST_ADMIN'): None})
 
+    def test_filter(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'TestPermissionPolicy,DefaultPermissionPolicy')
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        system = perm.PermissionSystem(self.env)
+        system.grant_permission('testuser', 'TEST_ADMIN')
+        resources = [Resource('wiki', 'WikiStart'), Resource('wiki', 'Other'),
+                     Resource('wiki', 'WikiStart')]
+
+        self.assertEqual(resources, self.perm.filter('TEST_MODIFY',
+                                                     resources))
+        self.assertEqual(resources, self.perm.filter('TEST_ADMIN', resources))
+        self.assertEqual([], self.perm.filter('TRAC_ADMIN', resources))
+        self.assertEqual([], self.perm.filter('TEST_ADMIN', []))
+        self.assertEqual(self.policy.results,
+                         {('testuser', 'TEST_MODIFY'): True,
+                          ('testuser', 'TEST_ADMIN'): None,
+                          ('testuser', 'TRAC_ADMIN'): None})
+        # The decisions are cached
+        system.revoke_permission('testuser', 'TEST_ADMIN')
+        self.assertIn('TEST_ADMIN', self.perm('wiki', 'Other'))
+
+    def test_decision_cache_disabled_by_default(self):
+        system = perm.PermissionSystem(self.env)
+        resource = Resource('wiki', 'WikiStart')
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        self.assertTrue(system.check_permission('TEST_MODIFY', 'testuser',
+                                                resource))
+        self.policy.revoke('testuser', ['TEST_MODIFY'])
+        self.assertFalse(system.check_permission('TEST_MODIFY', 'testuser',
+                                                 resource))
+
+    def test_decision_cache_resource_independent_policy(self):
+        self.env.config.set('trac', 'permission_policies',
+                            'DefaultPermissionPolicy')
+        self.env.config.set('trac', 'permission_cache_policies',
+                            'DefaultPermissionPolicy')
+        system = perm.PermissionSystem(self.env)
+        system.grant_permission('testuser', 'TEST_ADMIN')
+        resources = [Resource('wiki', 'WikiStart'), Resource('wiki', 'Other'),
+                     Resource('ticket', 1)]
+
+        self.assertEqual([True] * 3, system.check_permissions(
+            'TEST_ADMIN', 'testuser', resources))
+        self.assertTrue(system.check_permission('TEST_ADMIN', 'testuser',
+                                                Resource('milestone', 'm1')))
+        self.assertEqual([('DefaultPermissionPolicy', 'testuser',
+                           'TEST_ADMIN', None)],
+                         list(system._decision_cache))
+
+    def test_decision_cache(self):
+        self.env.config.set('trac', 'permission_cache_policies',
+                            'TestPermissionPolicy')
+        system = perm.PermissionSystem(self.env)
+        resource = Resource('wiki', 'WikiStart')
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        self.assertTrue(system.check_permission('TEST_MODIFY', 'testuser',
+                                                resource))
+
+        # Decisions are shared across permission caches
+        self.policy.revoke('testuser', ['TEST_MODIFY'])
+        perm_cache = perm.PermissionCache(self.env, 'testuser')
+        self.assertIn('TEST_MODIFY', perm_cache(resource))
+        self.assertEqual([True], system.check_permissions(
+            'TEST_MODIFY', 'testuser', [resource]))
+        self.assertFalse(system.check_permission('TEST_MODIFY', 'testuser',
+                                                 Resource('wiki', 'Other')))
+
+        # Granting or revoking a permission resets the cache
+        system.grant_permission('testuser', 'TEST_ADMIN')
+        self.assertFalse(system.check_permission('TEST_MODIFY', 'testuser',
+                                                 resource))
+
+        # The cache is disabled when the TTL is 0
+        self.policy.grant('testuser', ['TEST_MODIFY'])
+        self.env.config.set('trac', 'permission_cache_ttl', 0)
+        self.assertTrue(system.check_permission('TEST_MODIFY', 'testuser',
+                                                resource))
+        self.policy.revoke('testuser', ['TEST_MODIFY'])
+        self.assertFalse(system.check_permission('TEST_MODIFY', 'testuser',
+                                                 resource))
+
 
 class RecursivePolicyTestCase(unittest.TestCase):
     """Test case for policies that perform recursive permission checks."""
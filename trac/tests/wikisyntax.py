@@ -131,6 +131,8 @@ def attachment_setup(tc):
     tc.env.path = mkdtemp()
     with tc.env.db_transaction as db:
         db("INSERT INTO wiki (name,version) VALUES ('SomePage/SubPage',1)")
+        db("INSERT INTO wiki_head (name,version) "
+           "VALUES ('SomePage/SubPage',1)")
         db("INSERT INTO ticket (id) VALUES (123)")
     attachment = Attachment(tc.env, 'ticket', 123)
     attachment.insert('file.txt', io.BytesIO(b''), 0)
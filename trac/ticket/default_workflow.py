@@ -636,6 +636,10 @@ class WorkflowMacro(WikiMacroBase):
     }}}
     """)
 
+    def is_memoizable(self, name):
+        # Each graph needs its own element id and script data
+        return False
+
     def expand_macro(self, formatter, name, content, args=None):
         if content is not None:
             content = content.strip()
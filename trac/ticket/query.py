@@ -797,6 +797,12 @@ class Query(object):
             return ''
         field_names = sorted(fields, key=by_label)
 
+        # Decide on all the tickets at once, the permission checks done
+        # while rendering the results are then answered from the cache.
+        if context.perm is not None:
+            context.perm.filter('TICKET_VIEW', [Resource('ticket', t['id'])
+                                                for t in tickets])
+
         groups = {}
         groupsequence = []
         for ticket in tickets:
@@ -1012,6 +1018,9 @@ class QueryModule(Component):
                      query.get_href(req.href, format=conversion.key),
                      conversion.name, conversion.out_mimetype, conversion.key)
 
+        if format == 'rss' and req.method == 'GET':
+            self._check_feed_modified(req, query)
+
         if format:
             filename = 'query' if format != 'rss' else None
             Mimeview(self.env).send_converted(req, 'trac.ticket.Query', query,
@@ -1203,6 +1212,8 @@ class QueryModule(Component):
             chrome = Chrome(self.env)
             context = web_context(req)
             results = query.execute(req)
+            req.perm.filter('TICKET_VIEW', [Resource(self.realm, result['id'])
+                                            for result in results])
             for result in results:
                 ticket = Resource(self.realm, result['id'])
                 if 'TICKET_VIEW' in req.perm(ticket):
@@ -1221,6 +1232,18 @@ class QueryModule(Component):
 
         return iterate(), '%s;charset=utf-8' % mimetype
 
+    def _check_feed_modified(self, req, query):
+        """Send a "304 Not Modified" response if no ticket changed since
+        the client retrieved the feed.
+        """
+        for changetime, count in self.env.db_query("""
+                SELECT MAX(changetime), COUNT(*) FROM ticket"""):
+            # Relative date constraints depend on the current day
+            today = datetime_now(req.tz).date()
+            req.check_modified(from_utimestamp(changetime or 0),
+                               [query.get_href(req.href), count, today,
+                                req.locale])
+
     def _export_rss(self, req, query):
         context = web_context(req, 'query', absurls=True)
         query_href = query.get_href(context.href)
@@ -1384,7 +1407,8 @@ class TicketQueryMacro(WikiMacroBase):
             raise MacroError(e)
 
         if format in ('count', 'rawcount'):
-            cnt = query.count(req)
+            cnt = formatter.memoize((name, 'count', query_string),
+                                    query.count, req)
             title = ngettext("%(num)s ticket matching %(criteria)s",
                              "%(num)s tickets matching %(criteria)s", cnt,
                              criteria=query_string.replace('&', ', '))
@@ -1395,7 +1419,9 @@ class TicketQueryMacro(WikiMacroBase):
                              title=title)
 
         try:
-            tickets = query.execute(req)
+            # The tickets are shared by the calls with other formats
+            tickets = formatter.memoize((name, 'execute', query_string),
+                                        query.execute, req)
         except QueryValueError as e:
             raise MacroError(e)
 
@@ -1479,8 +1505,9 @@ class TicketQueryMacro(WikiMacroBase):
         # Formats above had their own permission checks, here we need to
         # do it explicitly:
 
-        tickets = [t for t in tickets
-                   if 'TICKET_VIEW' in req.perm(self.realm, t['id'])]
+        allowed = set(resource.id for resource in req.perm.filter(
+            'TICKET_VIEW', [Resource(self.realm, t['id']) for t in tickets]))
+        tickets = [t for t in tickets if t['id'] in allowed]
 
         if not tickets:
             return tag.span(_("No results"), class_='query_no_results')
@@ -26,7 +26,8 @@ from trac.core import *
 from trac.notification.api import NotificationSystem
 from trac.perm import IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_regexps, shorten_result
+from trac.search import ISearchSource, SearchSystem, search_to_regexps, \
+                         shorten_result
 from trac.util import as_bool, partition
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
                                from_utimestamp, get_datetime_format_hint,
@@ -39,7 +40,7 @@ from trac.util.translation import _, tag_
 from trac.ticket.api import TicketSystem
 from trac.ticket.notification import BatchTicketChangeEvent
 from trac.ticket.model import Milestone, MilestoneCache, Ticket
-from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.api import ITimelineEventProvider, merge_timeline_events
 from trac.web.api import HTTPBadRequest, IRequestHandler, RequestDone
 from trac.web.chrome import (Chrome, INavigationContributor, accesskey,
                              add_link, add_notice, add_stylesheet, add_warning,
@@ -358,8 +359,11 @@ def get_num_tickets_for_milestone(env, milestone, exclude_closed=False):
 def apply_ticket_permissions(env, req, tickets):
     """Apply permissions to a set of milestone tickets as returned by
     `get_tickets_for_milestone()`."""
-    return [t for t in tickets
-            if 'TICKET_VIEW' in req.perm('ticket', t['id'])]
+    tickets = list(tickets)
+    allowed = req.perm.filter('TICKET_VIEW', [Resource('ticket', t['id'])
+                                              for t in tickets])
+    allowed = set(resource.id for resource in allowed)
+    return [t for t in tickets if t['id'] in allowed]
 
 
 def milestone_stats_data(env, req, stat, name, grouped_by='component',
@@ -698,21 +702,53 @@ class MilestoneModule(Component):
             yield ('milestone', _("Milestones completed"))
 
     def get_timeline_events(self, req, start, stop, filters):
+        events = self.get_cacheable_timeline_events(start, stop, filters)
+        return self.filter_timeline_events(req, events, filters)
+
+    def is_timeline_sorted(self):
+        return True
+
+    def get_cacheable_timeline_events(self, start, stop, filters):
         if 'milestone' in filters:
             milestone_realm = Resource(self.realm)
+            events = []
             for name, due, completed, description \
                     in MilestoneCache(self.env).milestones.itervalues():
                 if completed and start <= completed <= stop:
                     # TODO: creation and (later) modifications should also be
                     #       reported
                     milestone = milestone_realm(id=name)
-                    if 'MILESTONE_VIEW' in req.perm(milestone):
-                        yield ('milestone', completed, '',  # FIXME: author?
-                               (milestone, description))
+                    # FIXME: author?
+                    events.append(('milestone', completed, '',
+                                   (milestone, description)))
+            events.sort(key=lambda event: event[1], reverse=True)
 
             # Attachments
-            for event in AttachmentModule(self.env).get_timeline_events(
-                    req, milestone_realm, start, stop):
+            attachment_events = AttachmentModule(self.env) \
+                                .get_cacheable_timeline_events(milestone_realm,
+                                                               start, stop)
+
+            for event in merge_timeline_events([events, attachment_events]):
+                yield event
+
+    def get_timeline_last_modified(self, filters):
+        if 'milestone' in filters:
+            now = datetime_now(utc)
+            last_modified, attachments = AttachmentModule(self.env) \
+                .get_timeline_last_modified(Resource(self.realm))
+            completed = [completed for name, due, completed, description
+                         in MilestoneCache(self.env).milestones.itervalues()
+                         if completed and completed <= now]
+            return max(filter(None, [last_modified] + completed) or [None]), \
+                   (len(completed), attachments)
+
+    def filter_timeline_events(self, req, events, filters):
+        attachment = AttachmentModule(self.env)
+        for event in events:
+            if event[0] == 'attachment':
+                for event in attachment.filter_timeline_events(req, [event]):
+                    yield event
+            elif 'MILESTONE_VIEW' in req.perm(event[3][0]):
                 yield event
 
     def render_timeline_event(self, context, field, event):
@@ -1163,19 +1199,33 @@ class MilestoneModule(Component):
     def get_search_results(self, req, terms, filters):
         if 'milestone' not in filters:
             return
-        term_regexps = search_to_regexps(terms)
         milestone_realm = Resource(self.realm)
-        for name, due, completed, description \
-                in MilestoneCache(self.env).milestones.itervalues():
-            if all(r.search(description) or r.search(name)
-                   for r in term_regexps):
-                milestone = milestone_realm(id=name)
-                if 'MILESTONE_VIEW' in req.perm(milestone):
-                    dt = (completed if completed else
-                          due if due else datetime_now(utc))
-                    yield (get_resource_url(self.env, milestone, req.href),
-                           get_resource_name(self.env, milestone), dt,
-                           '', shorten_result(description, terms))
+        milestones = MilestoneCache(self.env).milestones
+        with self.env.db_query as db:
+            index_sql = SearchSystem(self.env).get_index_sql(db, self.realm,
+                                                             terms)
+            if index_sql:
+                sql, args = index_sql
+                matches = db("SELECT target, score FROM (%s) s" % sql, args)
+            else:
+                term_regexps = search_to_regexps(terms)
+                matches = [(name, None)
+                           for name, due, completed, description
+                           in milestones.itervalues()
+                           if all(r.search(description) or r.search(name)
+                                  for r in term_regexps)]
+        for name, score in matches:
+            if name not in milestones:
+                continue
+            name, due, completed, description = milestones[name]
+            milestone = milestone_realm(id=name)
+            if 'MILESTONE_VIEW' in req.perm(milestone):
+                dt = (completed if completed else
+                      due if due else datetime_now(utc))
+                result = (get_resource_url(self.env, milestone, req.href),
+                          get_resource_name(self.env, milestone), dt,
+                          '', shorten_result(description, terms))
+                yield result if score is None else result + (score,)
 
         # Attachments
         for result in AttachmentModule(self.env).get_search_results(
@@ -14,6 +14,7 @@
 from __future__ import print_function
 
 import os
+import re
 import tempfile
 import textwrap
 import unittest
@@ -30,6 +31,8 @@ from trac.ticket.web_ui import TicketModule
 from trac.util import create_file
 from trac.util.datefmt import to_utimestamp
 from trac.web.api import RequestDone
+from trac.web.chrome import web_context
+from trac.wiki.formatter import format_to_html
 from tracopt.perm.authz_policy import AuthzPolicy
 
 
@@ -678,6 +681,28 @@ class SetResolutionAttributeTestCase(unittest.TestCase):
             self.assertIn('but uses undefined resolutions', unicode(e))
 
 
+class WorkflowMacroTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.req = MockRequest(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_identical_calls(self):
+        """Each call of the macro renders a graph with its own id."""
+        text = "[[Workflow(go = here -> there)]]\n" \
+               "[[Workflow(go = here -> there)]]\n"
+        html = unicode(format_to_html(self.env, web_context(self.req), text))
+        ids = re.findall(r'id="trac-workflow-graph-(\w+)"', html)
+        self.assertEqual(2, len(ids))
+        self.assertNotEqual(ids[0], ids[1])
+        script_data = self.req.chrome['script_data']
+        for id_ in ids:
+            self.assertIn('graph_' + id_, script_data)
+
+
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ConfigurableTicketWorkflowTestCase))
@@ -686,6 +711,7 @@ def test_suite():
     suite.addTest(unittest.makeSuite(SetOwnerToSelfAttributeTestCase))
     suite.addTest(unittest.makeSuite(RestrictOwnerTestCase))
     suite.addTest(unittest.makeSuite(SetResolutionAttributeTestCase))
+    suite.addTest(unittest.makeSuite(WorkflowMacroTestCase))
     return suite
 
 
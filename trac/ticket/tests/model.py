@@ -28,6 +28,7 @@ from trac.ticket.model import (
 )
 from trac.ticket.roadmap import MilestoneModule
 from trac.ticket.test import insert_ticket
+from trac.ticket.web_ui import TicketTimelineCacheInvalidator
 from trac.util.datefmt import datetime_now, from_utimestamp, to_utimestamp, utc
 
 
@@ -69,7 +70,8 @@ class TicketTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(default_data=True,
                                    enable=['trac.ticket.*'] +
-                                           self.ticket_change_listeners)
+                                           self.ticket_change_listeners,
+                                   disable=[TicketTimelineCacheInvalidator])
         self.env.config.set('ticket-custom', 'foo', 'text')
         self.env.config.set('ticket-custom', 'cbon', 'checkbox')
         self.env.config.set('ticket-custom', 'cboff', 'checkbox')
@@ -559,7 +561,8 @@ class TicketCommentEditTestCase(TicketCommentTestCase):
     def setUp(self):
         self.env = EnvironmentStub(default_data=True,
                                    enable=['trac.ticket.*'] +
-                                          self.ticket_change_listeners)
+                                          self.ticket_change_listeners,
+                                   disable=[TicketTimelineCacheInvalidator])
         self.created = datetime(2001, 1, 1, 1, 0, 0, 0, utc)
         self._insert_ticket('Test ticket', self.created,
                             owner='john', keywords='a, b, c')
@@ -749,7 +752,8 @@ class TicketCommentDeleteTestCase(TicketCommentTestCase):
     def setUp(self):
         self.env = EnvironmentStub(default_data=True,
                                    enable=['trac.ticket.*'] +
-                                          self.ticket_change_listeners)
+                                          self.ticket_change_listeners,
+                                   disable=[TicketTimelineCacheInvalidator])
         self.env.config.set('ticket-custom', 'foo', 'text')
         self.created = datetime(2001, 1, 1, 1, 0, 0, 0, utc)
         self._insert_ticket('Test ticket', self.created,
@@ -1047,7 +1051,8 @@ class MilestoneTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(default_data=True,
                                    enable=['trac.ticket.*'] +
-                                          self.milestone_change_listeners)
+                                          self.milestone_change_listeners,
+                                   disable=[TicketTimelineCacheInvalidator])
         self.env.path = mkdtemp()
         self.created_at = datetime(2001, 1, 1, tzinfo=utc)
         self.updated_at = self.created_at + timedelta(seconds=1)
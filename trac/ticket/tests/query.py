@@ -24,7 +24,7 @@ from trac.ticket.test import insert_ticket
 from trac.util.datefmt import utc
 from trac.web.api import arg_list_to_args, parse_arg_list
 from trac.web.chrome import web_context
-from trac.wiki.formatter import LinkFormatter
+from trac.wiki.formatter import LinkFormatter, format_to_html
 from trac.wiki.tests import formatter
 
 # Note: we don't want to replicate 1:1 all the SQL dialect abstraction
@@ -1439,6 +1439,26 @@ class TicketQueryMacroTestCase(unittest.TestCase):
                            dict(col='status|summary', max='0', order='id'),
                            'list')
 
+    def test_tickets_shared_by_formats(self):
+        env = EnvironmentStub(default_data=True)
+        insert_ticket(env, summary='Summary', status='new')
+        queries = []
+        execute = Query.execute
+        def execute_recorded(query, *args, **kwargs):
+            queries.append(query)
+            return execute(query, *args, **kwargs)
+        Query.execute = execute_recorded
+        try:
+            html = unicode(format_to_html(env, web_context(MockRequest(env)),
+                                          "[[TicketQuery(status=new)]]\n"
+                                          "[[TicketQuery(status=new, "
+                                          "format=compact)]]\n"))
+        finally:
+            Query.execute = execute
+            env.reset_db()
+        self.assertEqual(1, len(queries))
+        self.assertEqual(2, html.count('href="/trac.cgi/ticket/1"'))
+
 QUERY_TEST_CASES = u"""
 
 ============================== TicketQuery
@@ -147,7 +147,8 @@ class DefaultTicketGroupStatsProviderTestCase(unittest.TestCase):
 class MilestoneModuleTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.env = EnvironmentStub(default_data=True)
+        self.env = EnvironmentStub(default_data=True,
+                                   disable=['trac.search.index.*'])
         self.mmodule = MilestoneModule(self.env)
         self.terms = ['MilestoneAlpha', 'MilestoneBeta', 'MilestoneGamma']
         for term in self.terms + [' '.join(self.terms)]:
@@ -24,7 +24,8 @@ from trac.ticket.model import Milestone, Ticket, Version
 from trac.ticket.test import insert_ticket
 from trac.ticket.web_ui import DefaultTicketPolicy, TicketModule
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
-                               timezone, to_utimestamp, user_time, utc)
+                               from_utimestamp, timezone, to_utimestamp,
+                               user_time, utc)
 from trac.util.html import HTMLTransform
 from trac.web.api import HTTPBadRequest, RequestDone
 from trac.web.chrome import Chrome
@@ -113,6 +114,72 @@ class TicketModuleTestCase(unittest.TestCase):
         self.assertEqual(ts.max_description_size, tm.max_description_size)
         self.assertEqual(ts.max_summary_size, tm.max_summary_size)
 
+    def test_timeline_events_sorted(self):
+        """The timeline events are produced newest first."""
+        t0 = datetime(2018, 1, 1, tzinfo=utc)
+        when = lambda hours: t0 + timedelta(hours=hours)
+        ticket1 = self._insert_ticket(summary='Ticket 1', when=when(0))
+        ticket2 = self._insert_ticket(summary='Ticket 2', when=when(1))
+        ticket1['status'] = 'closed'
+        ticket1['resolution'] = 'fixed'
+        ticket1.save_changes('joe', when=when(2))
+        for ticket in (ticket1, ticket2):
+            ticket['keywords'] = 'batch'
+            ticket.save_changes('joe', when=when(3))
+        req = MockRequest(self.env, authname='admin')
+
+        self.assertTrue(self.ticket_module.is_timeline_sorted())
+        events = list(self.ticket_module.get_timeline_events(
+            req, when(0), when(4), ['ticket', 'ticket_details']))
+        self.assertEqual([('batchmodify', when(3)), ('closedticket', when(2)),
+                          ('newticket', when(1)), ('newticket', when(0))],
+                         [event[:2] for event in events])
+        self.assertEqual([1, 2], events[0][3][0])
+
+    def test_timeline_events_filtered_lazily(self):
+        """The events are filtered by chunks, as they are consumed."""
+        t0 = datetime(2018, 1, 1, tzinfo=utc)
+        for idx in xrange(5):
+            self._insert_ticket(summary='Ticket', when=t0 + timedelta(idx))
+        self.ticket_module.TIMELINE_CHUNK_SIZE = 2
+        consumed = []
+        def events():
+            for event in self.ticket_module.get_cacheable_timeline_events(
+                    t0, t0 + timedelta(5), ['ticket']):
+                consumed.append(event)
+                yield event
+        req = MockRequest(self.env, authname='admin')
+
+        filtered = self.ticket_module.filter_timeline_events(
+            req, events(), ['ticket'])
+        self.assertEqual(5, next(filtered)[3][0].id)
+        self.assertEqual(2, len(consumed))
+        self.assertEqual([4, 3, 2, 1],
+                         [event[3][0].id for event in filtered])
+        self.assertEqual(5, len(consumed))
+
+    def test_timeline_events_current_values(self):
+        """The cacheable events don't hold the values of the ticket
+        fields, which can change after the events are cached.
+        """
+        t0 = datetime(2018, 1, 1, tzinfo=utc)
+        ticket = self._insert_ticket(summary='Old summary', reporter='joe',
+                                     when=t0)
+        ticket.save_changes('jim', 'Comment', when=t0 + timedelta(hours=1))
+        events = list(self.ticket_module.get_cacheable_timeline_events(
+            t0, t0 + timedelta(1), ['ticket', 'ticket_details']))
+        ticket['summary'] = 'New summary'
+        ticket['reporter'] = 'jane'
+        ticket.save_changes('jim', when=t0 + timedelta(days=2))
+        req = MockRequest(self.env, authname='admin')
+
+        events = list(self.ticket_module.filter_timeline_events(
+            req, events, ['ticket', 'ticket_details']))
+        self.assertEqual([('editedticket', 'jim', 'New summary'),
+                          ('newticket', 'jane', 'New summary')],
+                         [(event[0], event[2], event[3][3])
+                          for event in events])
+
     def test_ticket_module_as_default_handler(self):
         """The New Ticket mainnav entry is active when TicketModule is the
         `default_handler` and navigating to the base url. Test for regression
@@ -330,6 +397,66 @@ class TicketModuleTestCase(unittest.TestCase):
         resp = self.ticket_module.process_request(req)
         self.assertEqual([], resp[1]['history'])
 
+    def test_history_paginated(self):
+        self.env.config.set('ticket', 'history_items_per_page', 2)
+        ticket = self._insert_ticket(description='Version 0')
+        for idx in xrange(1, 4):
+            ticket['description'] = 'Version %d' % idx
+            ticket.save_changes('joe')
+        req = MockRequest(self.env, args={'action': 'history', 'id': '1',
+                                          'history_page': '2'})
+
+        data = self.ticket_module.process_request(req)[1]
+        self.assertEqual([1, 0], [h['version'] for h in data['history']])
+        self.assertEqual(4, data['paginator'].num_items)
+        self.assertNotIn('next', req.chrome['links'])
+        self.assertEqual('/trac.cgi/ticket/1?action=history&history_page=1',
+                         req.chrome['links']['prev'][0]['href'])
+
+    def test_comment_history_paginated(self):
+        self.env.config.set('ticket', 'history_items_per_page', 2)
+        ticket = self._insert_ticket()
+        ticket.save_changes('joe', 'Comment 0')
+        for idx in xrange(1, 4):
+            ticket.modify_comment(ticket.get_change(cnum=1)['date'], 'joe',
+                                  'Comment %d' % idx)
+        req = MockRequest(self.env, args={'action': 'comment-history',
+                                          'id': '1', 'cnum': '1'})
+
+        data = self.ticket_module.process_request(req)[1]
+        self.assertEqual([3, 2], [h['version'] for h in data['history']])
+        self.assertEqual('/trac.cgi/ticket/1?action=comment-history&'
+                         'cnum=1&history_page=2',
+                         req.chrome['links']['next'][0]['href'])
+
+    def test_rss_not_modified(self):
+        ticket = self._insert_ticket(summary='Summary')
+        def process_request(etag=None):
+            req = MockRequest(self.env, path_info='/ticket/1',
+                              args={'id': '1', 'format': 'rss'})
+            if etag:
+                req.environ['HTTP_IF_NONE_MATCH'] = etag
+            self.assertRaises(RequestDone,
+                              self.ticket_module.process_request, req)
+            return req
+
+        etag = process_request().headers_sent['ETag']
+        req = process_request(etag)
+        self.assertEqual(['304 Not Modified'], req.status_sent)
+
+        ticket.save_changes('joe', 'Comment',
+                            datetime_now(utc) + timedelta(seconds=1))
+        req = process_request(etag)
+        self.assertEqual(['200 Ok'], req.status_sent)
+
+        # Editing a comment doesn't change the ticket change time
+        etag = req.headers_sent['ETag']
+        ticket = Ticket(self.env, 1)
+        ticket.modify_comment(ticket.get_change(cnum=1)['date'], 'joe',
+                              'Edited comment')
+        req = process_request(etag)
+        self.assertEqual(['200 Ok'], req.status_sent)
+
     def test_comment_diff_cnum_missing_raises(self):
         self._test_invalid_cnum_raises('comment-diff')
 
@@ -945,6 +1072,18 @@ class DefaultTicketPolicyTestCase(unittest.TestCase):
         self.assertIsNone(self.policy.check_permission(
             action, perm_cache.username, ticket3.resource, perm_cache))
 
+    def test_check_permissions_without_permission_cache(self):
+        """The batch check creates the permission cache when none is
+        given.
+        """
+        self.perm_sys.grant_permission('somebody1', 'TICKET_CHGPROP')
+        ticket1 = self._insert_ticket('somebody1')
+        ticket2 = self._insert_ticket('somebody2')
+
+        self.assertEqual([True, False], self.perm_sys.check_permissions(
+            'TICKET_EDIT_DESCRIPTION', 'somebody1',
+            [ticket1.resource, ticket2.resource]))
+
     def test_reporter_cannot_edit_other_ticket_description(self):
         """Authenticated user cannot modify description of ticket they
         didn't report.
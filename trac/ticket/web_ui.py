@@ -17,25 +17,29 @@
 import csv
 from datetime import datetime
 import io
+from itertools import islice
 import pkg_resources
 import re
 
-from trac.attachment import AttachmentModule
-from trac.config import BoolOption, Option
+from trac.attachment import Attachment, AttachmentModule
+from trac.config import BoolOption, IntOption, Option
 from trac.core import *
 from trac.mimeview.api import Mimeview, IContentConverter
 from trac.notification.api import NotificationSystem
-from trac.perm import IPermissionPolicy
+from trac.perm import IBatchPermissionPolicy, IPermissionPolicy
 from trac.resource import (
     Resource, ResourceNotFound, get_resource_url, render_resource_link,
     get_resource_shortname
 )
-from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search import ISearchSource, SearchSystem, search_to_sql, \
+                         shorten_result
 from trac.ticket import model
-from trac.ticket.api import TicketSystem, ITicketManipulator
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener, \
+                            ITicketManipulator, TicketSystem
 from trac.ticket.notification import TicketChangeEvent
 from trac.ticket.roadmap import group_milestones
-from trac.timeline.api import ITimelineEventProvider
+from trac.timeline.api import ITimelineEventProvider, TimelineEventCache, \
+                              merge_timeline_events
 from trac.util import as_bool, as_int, get_reporter_id, lazy
 from trac.util.datefmt import (
     datetime_now, format_datetime, format_date_or_datetime, from_utimestamp,
@@ -46,15 +50,15 @@ from trac.util.html import Markup, tag, to_fragment
 from trac.util.text import (
     exception_to_unicode, empty, is_obfuscated, shorten_line
 )
-from trac.util.presentation import separated
+from trac.util.presentation import Paginator, separated
 from trac.util.translation import _, tag_, tagn_, N_, ngettext
 from trac.versioncontrol.diff import get_diff_options, diff_blocks
 from trac.web.api import IRequestHandler, arg_list_to_args, parse_arg_list
 from trac.web.chrome import (
     Chrome, INavigationContributor, ITemplateProvider, accesskey,
     add_ctxtnav, add_link, add_notice, add_script, add_script_data,
-    add_stylesheet, add_warning, auth_link, chrome_info_script, prevnext_nav,
-    web_context
+    add_stylesheet, add_warning, auth_link, chrome_info_script,
+    prepare_paginator, prevnext_nav, web_context
 )
 from trac.wiki.formatter import format_to, format_to_html
 
@@ -107,8 +111,19 @@ class TicketModule(Component):
             [TracQuery#UsingTracLinks Trac links].
             """)
 
+    history_items_per_page = IntOption('ticket', 'history_items_per_page',
+                                       100,
+        """Number of versions shown on each page of the history of a
+        ticket description or comment. Set to 0 to show all the
+        versions on a single page.
+        (''since 1.3.4'')""")
+
     ticket_path_re = re.compile(r'/ticket/([0-9]+)$')
 
+    #: Number of timeline events read at once, for which the permissions
+    #: are checked together
+    TIMELINE_CHUNK_SIZE = 100
+
     def __init__(self):
         self._warn_for_moved_attr = set()
 
@@ -201,43 +216,102 @@ class TicketModule(Component):
             return
         ticket_realm = Resource(self.realm)
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['summary', 'keywords',
-                                           'description', 'reporter', 'cc',
-                                           db.cast('id', 'text')], terms)
-            sql2, args2 = search_to_sql(db, ['newvalue'], terms)
-            sql3, args3 = search_to_sql(db, ['value'], terms)
-            ticketsystem = TicketSystem(self.env)
-            for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
-                                 time, status, resolution
-                          FROM ticket
-                          WHERE id IN (
-                              SELECT id FROM ticket WHERE %s
-                            UNION
-                              SELECT ticket FROM ticket_change
-                              WHERE field='comment' AND %s
-                            UNION
-                              SELECT ticket FROM ticket_custom WHERE %s
-                          )
-                          """ % (sql, sql2, sql3),
-                          args + args2 + args3):
-                t = ticket_realm(id=tid)
-                if 'TICKET_VIEW' in req.perm(t):
-                    yield (req.href.ticket(tid),
-                           tag_("%(title)s: %(message)s",
-                                title=tag.span(
-                                    get_resource_shortname(self.env, t),
-                                    class_=status),
-                                message=ticketsystem.format_summary(
-                                    summary, status, resolution, type)),
-                           from_utimestamp(ts), author,
-                           shorten_result(desc, terms))
+            index_sql = SearchSystem(self.env).get_index_sql(db, self.realm,
+                                                             terms)
+            if index_sql:
+                sql, args = index_sql
+                rows = db("""SELECT t.summary, t.description, t.reporter,
+                                    t.type, t.id, t.time, t.status,
+                                    t.resolution, s.score
+                             FROM ticket t INNER JOIN (%s) s
+                               ON t.id=%s
+                             """ % (sql, db.cast('s.target', 'int')), args)
+            else:
+                sql, args = search_to_sql(db, ['summary', 'keywords',
+                                               'description', 'reporter',
+                                               'cc', db.cast('id', 'text')],
+                                          terms)
+                sql2, args2 = search_to_sql(db, ['newvalue'], terms)
+                sql3, args3 = search_to_sql(db, ['value'], terms)
+                rows = db("""SELECT summary, description, reporter, type, id,
+                                    time, status, resolution, NULL
+                             FROM ticket
+                             WHERE id IN (
+                                 SELECT id FROM ticket WHERE %s
+                               UNION
+                                 SELECT ticket FROM ticket_change
+                                 WHERE field='comment' AND %s
+                               UNION
+                                 SELECT ticket FROM ticket_custom WHERE %s
+                             )
+                             """ % (sql, sql2, sql3),
+                             args + args2 + args3)
+            req.perm.filter('TICKET_VIEW', [ticket_realm(id=row[4])
+                                            for row in rows])
+            for row in rows:
+                result = self._get_search_result(req, terms, *row)
+                if result:
+                    yield result
 
         # Attachments
         for result in AttachmentModule(self.env).get_search_results(
             req, ticket_realm, terms):
             yield result
 
+    def get_search_results_page(self, req, terms, filters, limit, cursor):
+        if 'ticket' not in filters:
+            return [], None
+        ticket_realm = Resource(self.realm)
+        with self.env.db_query as db:
+            page = SearchSystem(self.env).query_index(
+                db, [(self.realm, None), ('attachment', self.realm)], terms,
+                limit, cursor)
+            if page is None:
+                return None
+            rows, cursor = page
+            ids = [int(row[1]) for row in rows if row[0] == self.realm]
+            tickets = {}
+            if ids:
+                for row in db("""
+                        SELECT summary, description, reporter, type, id,
+                               time, status, resolution
+                        FROM ticket WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(ids)), ids):
+                    tickets[row[4]] = row
+        req.perm.filter('TICKET_VIEW', [ticket_realm(id=id_) for id_ in ids])
+        results = []
+        for realm, target, parent_realm, parent_target, time, author, \
+                title, text, score in rows:
+            if realm == self.realm:
+                if int(target) in tickets:
+                    result = self._get_search_result(
+                        req, terms, *tickets[int(target)] + (score,))
+                else:
+                    result = None
+            else:
+                attachment = ticket_realm(id=parent_target) \
+                             .child(realm, target)
+                result = AttachmentModule(self.env).get_search_result(
+                    req, attachment, from_utimestamp(time), author, text,
+                    terms, score)
+            if result:
+                results.append(result)
+        return results, cursor
+
+    def _get_search_result(self, req, terms, summary, desc, author, type,
+                           tid, ts, status, resolution, score):
+        t = Resource(self.realm, tid)
+        if 'TICKET_VIEW' in req.perm(t):
+            result = (req.href.ticket(tid),
+                      tag_("%(title)s: %(message)s",
+                           title=tag.span(get_resource_shortname(self.env, t),
+                                          class_=status),
+                           message=TicketSystem(self.env).format_summary(
+                               summary, status, resolution, type)),
+                      from_utimestamp(ts), author,
+                      shorten_result(desc, terms))
+            return result if score is None else result + (score,)
+
     # ITimelineEventProvider methods
 
     def get_timeline_filters(self, req):
@@ -247,9 +321,104 @@ class TicketModule(Component):
                 yield ('ticket_details', _("Ticket updates"), True)
 
     def get_timeline_events(self, req, start, stop, filters):
+        events = self.get_cacheable_timeline_events(start, stop, filters)
+        return self.filter_timeline_events(req, events, filters)
+
+    def is_timeline_sorted(self):
+        return True
+
+    def get_cacheable_timeline_events(self, start, stop, filters):
+        # The events only hold the immutable data of the ticket changes,
+        # the current values of the ticket fields are retrieved by
+        # filter_timeline_events.
         ts_start = to_utimestamp(start)
         ts_stop = to_utimestamp(stop)
 
+        def produce_ticket_change_events(db):
+            data = None
+            for id, t, author, field, oldvalue, newvalue in db("""
+                    SELECT t.id, tc.time, tc.author, tc.field, tc.oldvalue,
+                           tc.newvalue
+                    FROM ticket_change tc
+                    INNER JOIN ticket t ON
+                        t.id = tc.ticket AND tc.time>=%%s AND tc.time<=%%s
+                    LEFT OUTER JOIN enum p ON
+                        p.type='priority' AND p.name=t.priority
+                    ORDER BY tc.time DESC, COALESCE(p.value,'')='', %s,
+                             tc.ticket
+                    """ % db.cast('p.value', 'int'), (ts_start, ts_stop)):
+                if not (oldvalue or newvalue):
+                    # ignore empty change corresponding to custom field
+                    # created (None -> '') or deleted ('' -> None)
+                    continue
+                if not data or (id, t) != data[:2]:
+                    if data:
+                        yield (status, from_utimestamp(data[1]), data[2],
+                               (data, fields, comment, cid))
+                    status, fields, comment, cid = 'edit', {}, '', None
+                    data = (id, t, author)
+                if field == 'comment':
+                    comment = newvalue
+                    cid = oldvalue and oldvalue.split('.')[-1]
+                    # Always use the author from the comment field
+                    data = data[:2] + (author,)
+                elif field == 'status' and \
+                        newvalue in ('reopened', 'closed'):
+                    status = newvalue
+                elif field[0] != '_':
+                    # properties like _comment{n} are hidden
+                    fields[field] = newvalue
+            if data:
+                yield (status, from_utimestamp(data[1]), data[2],
+                       (data, fields, comment, cid))
+
+        def produce_new_ticket_events(db):
+            for row in db("""SELECT id, time, reporter
+                             FROM ticket WHERE time>=%s AND time<=%s
+                             ORDER BY time DESC, id
+                             """, (ts_start, ts_stop)):
+                yield ('new', from_utimestamp(row[1]), row[2],
+                       (row, {}, None, None))
+
+        with self.env.db_query as db:
+            iterables = []
+            # Ticket changes
+            if 'ticket' in filters or 'ticket_details' in filters:
+                iterables.append(produce_ticket_change_events(db))
+            # New tickets
+            if 'ticket' in filters:
+                iterables.append(produce_new_ticket_events(db))
+            # Attachments
+            if 'ticket_details' in filters:
+                iterables.append(AttachmentModule(self.env)
+                                 .get_cacheable_timeline_events(
+                                     Resource(self.realm), start, stop))
+            for event in merge_timeline_events(iterables):
+                yield event
+
+    def get_timeline_last_modified(self, filters):
+        if 'ticket' not in filters and 'ticket_details' not in filters:
+            return None
+        times = []
+        state = []
+        with self.env.db_query as db:
+            for ts, count in db("""
+                    SELECT MAX(changetime), COUNT(*) FROM ticket"""):
+                if ts:
+                    times.append(from_utimestamp(ts))
+                state.append(count)
+            # Comment edits and deleted changes don't update the ticket
+            # change time, but change the number of ticket_change rows
+            for count, in db("SELECT COUNT(*) FROM ticket_change"):
+                state.append(count)
+        if 'ticket_details' in filters:
+            last_modified, attachments = AttachmentModule(self.env) \
+                .get_timeline_last_modified(Resource(self.realm))
+            times.append(last_modified)
+            state.append(attachments)
+        return max(filter(None, times) or [None]), state
+
+    def filter_timeline_events(self, req, events, filters):
         status_map = {'new': ('newticket', 'created'),
                       'reopened': ('reopenedticket', 'reopened'),
                       'closed': ('closedticket', 'closed'),
@@ -259,11 +428,18 @@ class TicketModule(Component):
 
         field_labels = TicketSystem(self.env).get_ticket_field_labels()
 
+        # The current values of the fields of the viewable tickets
+        tickets = {}
+        checked = set()
+
         def produce_event(values, status, fields, comment, cid):
-            id, ts, author, type, summary, description, component = values
-            ticket = ticket_realm(id=id)
-            if 'TICKET_VIEW' not in req.perm(ticket):
+            id, ts, author = values
+            if id not in tickets:
                 return None
+            type, summary, description, component, reporter = tickets[id]
+            if status == 'new':
+                author = reporter
+            ticket = ticket_realm(id=id)
             resolution = fields.get('resolution')
             info = ''
             if status == 'edit':
@@ -290,95 +466,75 @@ class TicketModule(Component):
                     (ticket, verb, info, summary, status, resolution, type,
                      description, component, comment, cid))
 
-        def produce_ticket_change_events(db):
-            data = None
-            for (id, t, author, type, summary,
-                 component, field, oldvalue, newvalue) in db("""
-                    SELECT t.id, tc.time, tc.author, t.type, t.summary,
-                           t.component, tc.field, tc.oldvalue, tc.newvalue
-                    FROM ticket_change tc
-                    INNER JOIN ticket t ON
-                        t.id = tc.ticket AND tc.time>=%%s AND tc.time<=%%s
-                    LEFT OUTER JOIN enum p ON
-                        p.type='priority' AND p.name=t.priority
-                    ORDER BY tc.time, COALESCE(p.value,'')='', %s, tc.ticket
-                    """ % db.cast('p.value', 'int'), (ts_start, ts_stop)):
-                if not (oldvalue or newvalue):
-                    # ignore empty change corresponding to custom field
-                    # created (None -> '') or deleted ('' -> None)
+        def produce_events(events):
+            # The changes of several tickets at the same time are
+            # grouped in a batch event. The events are sorted newest
+            # first, and the changes come before the other events having
+            # the same time.
+            held_t = held_ev = None
+            for event in events:
+                if event[0] == 'attachment':
+                    ev = None
+                    for ev in attachment.filter_timeline_events(req,
+                                                                [event]):
+                        pass
+                    if ev:
+                        if held_ev:
+                            yield held_ev
+                            held_t = held_ev = None
+                        yield ev
                     continue
-                if not data or (id, t) != data[:2]:
-                    if data:
-                        ev = produce_event(data, status, fields, comment,
-                                           cid)
-                        if ev:
-                            yield (ev, data[1])
-                    status, fields, comment, cid = 'edit', {}, '', None
-                    data = (id, t, author, type, summary, None, component)
-                if field == 'comment':
-                    comment = newvalue
-                    cid = oldvalue and oldvalue.split('.')[-1]
-                    # Always use the author from the comment field
-                    data = data[:2] + (author,) + data[3:]
-                elif field == 'status' and \
-                        newvalue in ('reopened', 'closed'):
-                    status = newvalue
-                elif field[0] != '_':
-                    # properties like _comment{n} are hidden
-                    fields[field] = newvalue
-            if data:
-                ev = produce_event(data, status, fields, comment, cid)
-                if ev:
-                    yield (ev, data[1])
-
-        # Ticket changes
-        with self.env.db_query as db:
-            if 'ticket' in filters or 'ticket_details' in filters:
-                prev_t = None
-                prev_ev = None
-                batch_ev = None
-                for ev, t in produce_ticket_change_events(db):
-                    if batch_ev:
-                        if prev_t == t:
-                            ticket = ev[3][0]
-                            batch_ev[3][0].append(ticket.id)
-                        else:
-                            yield batch_ev
-                            prev_ev = ev
-                            prev_t = t
-                            batch_ev = None
-                    elif prev_t and prev_t == t:
-                        prev_ticket = prev_ev[3][0]
-                        ticket = ev[3][0]
-                        tickets = [prev_ticket.id, ticket.id]
-                        batch_data = (tickets,) + ev[3][1:]
-                        batch_ev = ('batchmodify', ev[1], ev[2], batch_data)
+                status, date, author, (values, fields, comment, cid) = event
+                ev = produce_event(values, status, fields, comment, cid)
+                if not ev:
+                    continue
+                if status != 'new' and held_ev and held_t == values[1]:
+                    if held_ev[0] == 'batchmodify':
+                        held_ev[3][0].append(ev[3][0].id)
                     else:
-                        if prev_ev:
-                            yield prev_ev
-                        prev_ev = ev
-                        prev_t = t
-                if batch_ev:
-                    yield batch_ev
-                elif prev_ev:
-                    yield prev_ev
-
-                # New tickets
-                if 'ticket' in filters:
-                    for row in db("""SELECT id, time, reporter, type, summary,
-                                            description, component
-                                     FROM ticket WHERE time>=%s AND time<=%s
-                                     """, (ts_start, ts_stop)):
-                        ev = produce_event(row, 'new', {}, None, None)
-                        if ev:
-                            yield ev
-
-            # Attachments
-            if 'ticket_details' in filters:
-                for event in AttachmentModule(self.env).get_timeline_events(
-                    req, ticket_realm, start, stop):
+                        ids = [held_ev[3][0].id, ev[3][0].id]
+                        held_ev = ('batchmodify', ev[1], ev[2],
+                                   (ids,) + ev[3][1:])
+                    continue
+                if held_ev:
+                    yield held_ev
+                    held_t = held_ev = None
+                if status == 'new':
+                    yield ev
+                else:
+                    held_t, held_ev = values[1], ev
+            if held_ev:
+                yield held_ev
+
+        def produce_chunks():
+            # Decide on the tickets of a chunk of events at once, before
+            # reading the next chunk, so that the events are produced
+            # without reading the whole period.
+            iterator = iter(events)
+            while True:
+                chunk = list(islice(iterator, self.TIMELINE_CHUNK_SIZE))
+                if not chunk:
+                    break
+                ids = set(event[3][0][0] for event in chunk
+                          if event[0] != 'attachment') - checked
+                checked.update(ids)
+                ids = [resource.id for resource in req.perm.filter(
+                    'TICKET_VIEW', [ticket_realm(id=id)
+                                    for id in sorted(ids)])]
+                if ids:
+                    for row in self.env.db_query("""
+                            SELECT id, type, summary, description,
+                                   component, reporter
+                            FROM ticket WHERE id IN (%s)
+                            """ % ','.join(['%s'] * len(ids)), ids):
+                        tickets[row[0]] = row[1:]
+                for event in chunk:
                     yield event
 
+        attachment = AttachmentModule(self.env)
+        for event in produce_events(produce_chunks()):
+            yield event
+
     def render_timeline_event(self, context, field, event):
         kind = event[0]
         if kind == 'batchmodify':
@@ -588,6 +744,9 @@ class TicketModule(Component):
         action = req.args.get('action', ('history' in req.args and 'history' or
                                          'view'))
 
+        if req.args.get('format') == 'rss' and req.method == 'GET':
+            self._check_feed_modified(req, ticket)
+
         data = self._prepare_data(req, ticket)
 
         if action in ('history', 'diff'):
@@ -895,14 +1054,36 @@ class TicketModule(Component):
                         'date': ticket['time'],
                         'author': ticket['reporter']  # not 100% accurate...
                         })
+        paginator = self._paginate_history(
+            req, history,
+            lambda num: req.href.ticket(ticket.id, action='history',
+                                        field=req.args.get('field'),
+                                        history_page=num))
         data.update({'title': _("Ticket History"),
                      'resource': ticket.resource,
-                     'history': history})
+                     'history': paginator.items,
+                     'paginator': paginator})
 
         add_ctxtnav(req, _("Back to Ticket #%(num)s", num=ticket.id),
                     req.href.ticket(ticket.id))
         return 'history_view.html', data
 
+    def _paginate_history(self, req, history, page_href):
+        """Return a `Paginator` for the versions of the `history` shown
+        on the requested page.
+        """
+        max_per_page = self.history_items_per_page
+        if max_per_page <= 0:
+            max_per_page = max(len(history), 1)
+        page = req.args.getint('history_page', 1, min=1)
+        try:
+            paginator = Paginator(history, page - 1, max_per_page)
+        except TracError:
+            add_warning(req, _("Page %(page)s is out of range.", page=page))
+            paginator = Paginator(history, 0, max_per_page)
+        prepare_paginator(req, paginator, page_href)
+        return paginator
+
     def _render_diff(self, req, ticket, data, text_fields):
         """Show differences between two versions of a ticket description.
 
@@ -1086,6 +1267,10 @@ class TicketModule(Component):
         req.perm(ticket.resource).require('TICKET_VIEW')
         history = self._get_comment_history(req, ticket, cnum)
         history.reverse()
+        paginator = self._paginate_history(
+            req, history,
+            lambda num: req.href.ticket(ticket.id, action='comment-history',
+                                        cnum=cnum, history_page=num))
         url = self._make_comment_url(req, ticket, cnum)
         data.update({
             'title': _("Ticket Comment History"),
@@ -1094,7 +1279,8 @@ class TicketModule(Component):
                       num=ticket.id, cnum=cnum),
             'url': url,
             'diff_action': 'comment-diff', 'diff_args': [('cnum', cnum)],
-            'history': history,
+            'history': paginator.items,
+            'paginator': paginator,
         })
         add_ctxtnav(req, _("Back to Ticket #%(num)s", num=ticket.id), url)
         return 'history_view.html', data
@@ -1223,6 +1409,34 @@ class TicketModule(Component):
         writer.writerow(cols)
         return content.getvalue(), '%s;charset=utf-8' % mimetype
 
+    def _check_feed_modified(self, req, ticket):
+        """Send a "304 Not Modified" response if the ticket and its
+        attachments didn't change since the client retrieved the feed.
+        """
+        last_modified = ticket['changetime']
+        with self.env.db_query as db:
+            # Comment edits and deleted changes don't update the ticket
+            # change time, but change the number of ticket_change rows
+            for count, in db("""
+                    SELECT COUNT(*) FROM ticket_change WHERE ticket=%s
+                    """, (ticket.id,)):
+                pass
+            for edited, in db("""
+                    SELECT newvalue FROM ticket_change
+                    WHERE ticket=%%s AND field %s
+                    """ % db.prefix_match(),
+                    (ticket.id, db.prefix_match_value('_comment'))):
+                edited = as_int(edited, None)
+                if edited:
+                    last_modified = max(last_modified,
+                                        from_utimestamp(edited))
+        attachments = []
+        for attachment in Attachment.select(self.env, self.realm, ticket.id):
+            attachments.append(attachment.filename)
+            last_modified = max(last_modified, attachment.date)
+        req.check_modified(last_modified, [ticket.version, count,
+                                           attachments, req.locale])
+
     def _export_rss(self, req, ticket):
         changes = []
 
@@ -1908,10 +2122,15 @@ class DefaultTicketPolicy(Component):
       user doesn't have `TICKET_EDIT_CC`.
     """
 
-    implements(IPermissionPolicy)
+    implements(IBatchPermissionPolicy, IPermissionPolicy)
 
     realm = TicketSystem.realm
 
+    actions = ('TICKET_CHG_MILESTONE', 'TICKET_EDIT_CC',
+               'TICKET_EDIT_COMMENT', 'TICKET_EDIT_DESCRIPTION')
+
+    # IPermissionPolicy methods
+
     def check_permission(self, action, username, resource, perm):
 
         if action == 'TICKET_CHG_MILESTONE' and \
@@ -1943,6 +2162,55 @@ class DefaultTicketPolicy(Component):
             if not ticket.exists:
                 return True
 
+    # IBatchPermissionPolicy methods
+
+    def check_permissions(self, action, username, resources, perm):
+        if action not in self.actions:
+            return [None] * len(resources)
+        return [self.check_permission(action, username, resource,
+                                      perm(resource))
+                for resource in resources]
+
     def _is_valid_resource(self, resource, expected_realm, exists=True):
         return resource and resource.realm == expected_realm and \
                (resource.id is not None if exists else resource.id is None)
+
+
+class TicketTimelineCacheInvalidator(Component):
+    """Invalidate the cached timeline events when tickets or milestones
+    are changed in a way that affects past events.
+    """
+
+    implements(IMilestoneChangeListener, ITicketChangeListener)
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        pass
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        # The cached events don't hold the values of the ticket fields,
+        # which are retrieved when the events are filtered
+        pass
+
+    def ticket_deleted(self, ticket):
+        TimelineEventCache(self.env).reset()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        TimelineEventCache(self.env).reset()
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        TimelineEventCache(self.env).reset()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        pass
+
+    def milestone_changed(self, milestone, old_values):
+        if set(old_values) & {'completed', 'description', 'name'}:
+            TimelineEventCache(self.env).reset()
+
+    def milestone_deleted(self, milestone):
+        TimelineEventCache(self.env).reset()
@@ -17,7 +17,15 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+from datetime import datetime, timedelta
+
+from trac.cache import cached
+from trac.config import IntOption
 from trac.core import *
+from trac.util import merge_sorted
+from trac.util.compat import OrderedDict
+from trac.util.concurrency import threading
+from trac.util.datefmt import datetime_now, to_utimestamp, utc
 
 
 class ITimelineEventProvider(Interface):
@@ -52,6 +60,64 @@ class ITimelineEventProvider(Interface):
         like this happens when calling `AttachmentModule.get_timeline_events()`
         the tuple can also specify explicitly the provider by returning tuples
         of the following form: `(kind, date, author, data, provider)`.
+
+        The events can be returned in any order, unless
+        `is_timeline_sorted` returns `True`.
+        """
+
+    def is_timeline_sorted():
+        """Return `True` if `get_timeline_events` returns the events
+        sorted by date, newest first.
+
+        This method is optional. When the events are sorted, the
+        timeline only retrieves as many events as it displays, otherwise
+        all the events of the period are retrieved and sorted.
+
+        :since: 1.3.4
+        """
+
+    def get_cacheable_timeline_events(start, stop, filters):
+        """Return a list of events in the time range given by the `start`
+        and `stop` parameters, regardless of the user and request.
+
+        This method is optional, and must be implemented together with
+        `filter_timeline_events`. The events are `(kind, date, author,
+        data)` tuples which are only used by `filter_timeline_events`,
+        and they must only depend on the time range and on the `filters`.
+        The timeline may keep them in its event cache, in which case the
+        provider must call `TimelineEventCache.reset()` when past events
+        are modified.
+
+        :since: 1.3.4
+        """
+
+    def filter_timeline_events(req, events, filters):
+        """Return the timeline events for the request, given events
+        returned by `get_cacheable_timeline_events`.
+
+        This is where the permissions are checked. Calling this method
+        on the result of `get_cacheable_timeline_events` must be
+        equivalent to calling `get_timeline_events`.
+
+        :since: 1.3.4
+        """
+
+    def get_timeline_last_modified(filters):
+        """Return a `(last_modified, state)` tuple for the events which
+        would be returned for the given `filters`, or `None` if the
+        filters select none of the provider's events.
+
+        `last_modified` is the `datetime` of the latest modification of
+        the events, or `None` if there are no such events. `state` is any
+        value which changes when past events are deleted, like a number
+        of rows.
+
+        This method is optional. It must be cheap to compute, as it is
+        used for answering conditional requests of the timeline feed
+        without retrieving the events. The timeline feed can only be
+        validated when all the event providers implement this method.
+
+        :since: 1.3.4
         """
 
     def render_timeline_event(context, field, event):
@@ -64,3 +130,126 @@ class ITimelineEventProvider(Interface):
                       the 'url'
         :param event: the event tuple, as returned by `get_timeline_events`
         """
+
+
+class TimelineEventCache(Component):
+    """Cache of the events of the timeline event providers implementing
+    `get_cacheable_timeline_events`, shared by the requests.
+
+    :since: 1.3.4
+    """
+
+    horizon = IntOption('timeline', 'event_cache_horizon', 0,
+        """Number of days after which the events of the timeline event
+        providers supporting it are cached. The events of each day older
+        than that are only retrieved once, and remain cached until past
+        events are modified. With 0, events are not cached.
+        (''since 1.3.4'')
+        """)
+
+    # Maximum number of cached (provider, filters, day) event lists.
+    CACHE_SIZE = 5000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Discard the cached timeline events, in all the processes of
+        the environment.
+
+        Event providers call this method when past events are modified.
+        """
+        if self.horizon > 0:
+            del self._cache
+
+    def get_events(self, provider, start, stop, filters):
+        """Return the cacheable events of `provider` for the given period
+        of time, newest day first.
+
+        The events of each UTC day older than `horizon` days are
+        retrieved once and kept in the cache.
+        """
+        one_day = timedelta(days=1)
+        now = datetime_now(utc)
+        horizon = datetime(now.year, now.month, now.day, tzinfo=utc) - \
+                  timedelta(days=self.horizon)
+        stop = stop.astimezone(utc)
+        start = start.astimezone(utc)
+        first_day = datetime(start.year, start.month, start.day, tzinfo=utc)
+
+        def fetch(range_start, range_stop):
+            return list(provider.get_cacheable_timeline_events(
+                range_start, range_stop, filters) or [])
+
+        # The days after the horizon aren't cached
+        days = []
+        events = []
+        day = first_day
+        while day <= stop:
+            if day + one_day > horizon:
+                events.extend(fetch(day, stop))
+                break
+            days.append(day)
+            day += one_day
+
+        cache = self._cache
+        key = (provider.__class__.__name__, tuple(sorted(filters)))
+        buckets = {}
+        with self._lock:
+            for day in days:
+                bucket = cache.pop((key, day), None)
+                if bucket is not None:
+                    cache[(key, day)] = buckets[day] = bucket
+        missing = [day for day in days if day not in buckets]
+        while missing:
+            # Retrieve consecutive missing days at once
+            count = 1
+            while count < len(missing) and \
+                    missing[count] == missing[0] + count * one_day:
+                count += 1
+            range_days, missing = missing[:count], missing[count:]
+            fetched = dict((day, []) for day in range_days)
+            for event in fetch(range_days[0],
+                               range_days[-1] + one_day -
+                               timedelta(microseconds=1)):
+                date = event[1].astimezone(utc)
+                day = datetime(date.year, date.month, date.day, tzinfo=utc)
+                if day in fetched:
+                    fetched[day].append(event)
+            buckets.update(fetched)
+            with self._lock:
+                for day, bucket in fetched.iteritems():
+                    cache[(key, day)] = bucket
+                while len(cache) > self.CACHE_SIZE:
+                    cache.popitem(last=False)
+
+        for day in reversed(days):
+            events.extend(buckets[day])
+        return [event for event in events if start <= event[1] <= stop]
+
+    @cached
+    def _cache(self):
+        """Map `((provider, filters), day)` keys to the list of cacheable
+        events of the provider on that UTC day, in least recently used
+        order.
+        """
+        return OrderedDict()
+
+
+def merge_timeline_events(iterables, key=None):
+    """Merge iterables of timeline events which are each sorted by date,
+    newest first, into a single iterator of events sorted newest first.
+
+    The iterables are consumed lazily. Events having the same date are
+    produced in the order of the iterables.
+
+    :param key: function returning the event tuple from an item of the
+                iterables, if they don't produce event tuples.
+
+    :since: 1.3.4
+    """
+    if key is None:
+        sort_key = lambda event: -to_utimestamp(event[1])
+    else:
+        sort_key = lambda item: -to_utimestamp(key(item)[1])
+    return merge_sorted(iterables, sort_key)
@@ -10,21 +10,31 @@
 # This software consists of voluntary contributions made by many
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
+import os.path
 import textwrap
+import threading
+import time
 import unittest
 from datetime import datetime, timedelta
 from xml.dom import minidom
 
 from trac.core import Component, ComponentMeta, implements
 from trac.perm import PermissionError, PermissionSystem
-from trac.test import EnvironmentStub, Mock, MockRequest, locale_en
-from trac.timeline.api import ITimelineEventProvider
+from trac.test import EnvironmentStub, Mock, MockRequest, locale_en, \
+                      mkdtemp
+from trac.ticket.model import Ticket
+from trac.ticket.web_ui import TicketModule
+from trac.timeline.api import ITimelineEventProvider, TimelineEventCache
 from trac.timeline.web_ui import TimelineModule
 from trac.util.datefmt import (
     datetime_now, format_date, format_datetime, format_time,
     get_date_format_hint, pretty_timedelta, utc,
 )
 from trac.util.html import plaintext, tag
+from trac.versioncontrol.web_ui.changeset import ChangesetModule
+from trac.wiki.model import WikiPage
+from trac.wiki.web_ui import WikiModule
+from trac.web.api import RequestDone
 from trac.web.chrome import Chrome
 from trac.web.tests.api import RequestHandlerPermissionsTestCaseBase
 
@@ -230,8 +240,63 @@ class TimelineEventProviderTestCase(unittest.TestCase):
             def render_timeline_event(self, context, field, event):
                 return event[3].render(context, field, event)
 
+        class SortedTimelineEventProvider(Component):
+            implements(ITimelineEventProvider)
+
+            def __init__(self):
+                self._events = None
+                self.consumed = 0
+
+            def get_timeline_filters(self, req):
+                yield ('sorted', 'Sorted')
+
+            def get_timeline_events(self, req, start, stop, filters):
+                for event in self._events or ():
+                    self.consumed += 1
+                    yield event
+
+            def is_timeline_sorted(self):
+                return True
+
+            def render_timeline_event(self, context, field, event):
+                return event[3]
+
+        class CacheableTimelineEventProvider(Component):
+            implements(ITimelineEventProvider)
+
+            def __init__(self):
+                self._events = None
+                self.fetched = []
+
+            def get_timeline_filters(self, req):
+                yield ('cacheable', 'Cacheable')
+
+            def get_timeline_events(self, req, start, stop, filters):
+                events = self.get_cacheable_timeline_events(start, stop,
+                                                            filters)
+                return self.filter_timeline_events(req, events, filters)
+
+            def is_timeline_sorted(self):
+                return True
+
+            def get_cacheable_timeline_events(self, start, stop, filters):
+                for event in self._events or ():
+                    if start <= event[1] <= stop:
+                        self.fetched.append(event[3])
+                        yield event
+
+            def filter_timeline_events(self, req, events, filters):
+                for event in events:
+                    if not event[3].startswith('private'):
+                        yield event
+
+            def render_timeline_event(self, context, field, event):
+                return event[3]
+
         cls.timeline_event_providers = {
             'normal': TimelineEventProvider,
+            'sorted': SortedTimelineEventProvider,
+            'cacheable': CacheableTimelineEventProvider,
         }
 
     @classmethod
@@ -245,6 +310,25 @@ class TimelineEventProviderTestCase(unittest.TestCase):
     def tearDown(self):
         self.env.reset_db()
 
+    def _create_file_backed_env(self):
+        """Replace the environment by one whose database is shared by
+        the threads retrieving the events, with the providers of the
+        tickets, wiki pages and changesets enabled.
+        """
+        self.env.reset_db()
+        self.env = EnvironmentStub(
+            path=mkdtemp(), destroying=True,
+            enable=['trac.timeline.*', 'trac.web.*', 'trac.ticket.*',
+                    'trac.wiki.*', 'trac.versioncontrol.*', TicketModule,
+                    WikiModule, ChangesetModule] +
+                   self.timeline_event_providers.values())
+        self.addCleanup(self.env.reset_db_and_disk)
+        if self.env.dburi == 'sqlite::memory:':
+            os.mkdir(os.path.join(self.env.path, 'db'))
+            self.env.dburi = 'sqlite:db/trac.db'
+            self.env.config.set('trac', 'database', self.env.dburi)
+        self.env.reset_db(default_data=True)
+
     def test_rss(self):
         def render(context, field, event):
             if event[0] == 'test&1':
@@ -306,6 +390,162 @@ class TimelineEventProviderTestCase(unittest.TestCase):
         self.assertEqual('<?xml version="1.0"?>', output[:21])
         minidom.parseString(output)  # verify valid xml
 
+    def test_rss_not_modified(self):
+        env = EnvironmentStub(enable=['trac.attachment.*',
+                                      'trac.timeline.web_ui.*',
+                                      'trac.wiki.web_ui.*'])
+        module = TimelineModule(env)
+        def make_request(etag=None):
+            req = MockRequest(env, path_info='/timeline',
+                              args={'format': 'rss'})
+            if etag:
+                req.environ['HTTP_IF_NONE_MATCH'] = etag
+            return req
+        def save_page(name, t):
+            page = WikiPage(env, name)
+            page.text = 'Text'
+            page.save('joe', '', t=t)
+
+        try:
+            save_page('WikiStart', datetime(2018, 1, 1, tzinfo=utc))
+            req = make_request()
+            module.process_request(req)
+            etag = dict(req._outheaders)['ETag']
+
+            req = make_request(etag)
+            self.assertRaises(RequestDone, module.process_request, req)
+            self.assertEqual(['304 Not Modified'], req.status_sent)
+
+            save_page('SandBox', datetime(2018, 1, 2, tzinfo=utc))
+            req = make_request(etag)
+            module.process_request(req)
+            etag2 = dict(req._outheaders)['ETag']
+            self.assertNotEqual(etag, etag2)
+
+            # Deleting an older page doesn't change the latest time
+            WikiPage(env, 'WikiStart').delete()
+            req = make_request(etag2)
+            module.process_request(req)
+            self.assertNotEqual(etag2, dict(req._outheaders)['ETag'])
+        finally:
+            env.reset_db()
+
+    def test_merge_sorted_providers(self):
+        now = datetime_now(utc)
+        def event(name, hours, author='joe'):
+            return ('test', now - timedelta(hours=hours), author, name)
+        normal = self.timeline_event_providers['normal'](self.env)
+        normal._events = [event('n3', 5), event('n1', 1),
+                          event('n2', 3, 'jim')]
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = [event('s1', 2), event('s2', 4), event('s3', 6),
+                           event('s4', 7), event('s5', 8)]
+        req = MockRequest(self.env, path_info='/timeline',
+                          args={'max': '4', 'authors': '-jim'})
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual(['n1', 's1', 's2', 'n3'],
+                         [e['data'] for e in data['events']])
+        self.assertEqual(3, sorted_.consumed)
+
+    def test_parallel_providers(self):
+        self._create_file_backed_env()
+        now = datetime_now(utc)
+        def event(name, hours):
+            return ('test', now - timedelta(hours=hours), 'joe', name)
+        normal = self.timeline_event_providers['normal'](self.env)
+        normal._events = [event('n2', 3), event('n1', 1)]
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = [event('s1', 2), event('s2', 4)]
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'The summary'
+        ticket['reporter'] = 'joe'
+        ticket.insert(when=now - timedelta(hours=5))
+        page = WikiPage(self.env, 'NewPage')
+        page.text = 'The text'
+        page.save('joe', 'Comment', now - timedelta(minutes=30))
+        self.env.config.set('timeline', 'parallel_providers', 2)
+        req = MockRequest(self.env, path_info='/timeline')
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual(['wiki', 'test', 'test', 'test', 'test',
+                          'newticket'],
+                         [e['kind'] for e in data['events']])
+        self.assertEqual(['n1', 's1', 'n2', 's2'],
+                         [e['data'] for e in data['events']
+                          if e['kind'] == 'test'])
+        self.assertEqual([], req.chrome['warnings'])
+
+    def test_parallel_providers_timeout(self):
+        self._create_file_backed_env()
+        now = datetime_now(utc)
+        blocked = threading.Event()
+        def blocking_events():
+            blocked.wait()
+            yield ('test', now, 'joe', 's1')
+        normal = self.timeline_event_providers['normal'](self.env)
+        normal._events = [('test', now - timedelta(hours=1), 'joe', 'n1')]
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = blocking_events()
+        self.env.config.set('timeline', 'parallel_providers', 2)
+        self.env.config.set('timeline', 'provider_timeout', 1)
+        req = MockRequest(self.env, path_info='/timeline')
+
+        try:
+            data = TimelineModule(self.env).process_request(req)[1]
+        finally:
+            blocked.set()
+
+        self.assertEqual(['n1'], [e['data'] for e in data['events']])
+        self.assertEqual(1, len(req.chrome['warnings']))
+
+    def test_parallel_providers_timeout_per_provider(self):
+        """The timeout of a provider starts when it's started."""
+        self._create_file_backed_env()
+        now = datetime_now(utc)
+        def slow_events(name, hours):
+            time.sleep(0.6)
+            yield ('test', now - timedelta(hours=hours), 'joe', name)
+        normal = self.timeline_event_providers['normal'](self.env)
+        normal._events = slow_events('n1', 1)
+        sorted_ = self.timeline_event_providers['sorted'](self.env)
+        sorted_._events = slow_events('s1', 2)
+        self.env.config.set('timeline', 'parallel_providers', 1)
+        self.env.config.set('timeline', 'provider_timeout', 1)
+        req = MockRequest(self.env, path_info='/timeline')
+
+        data = TimelineModule(self.env).process_request(req)[1]
+
+        self.assertEqual(['n1', 's1'], [e['data'] for e in data['events']])
+        self.assertEqual([], req.chrome['warnings'])
+
+    def test_event_cache(self):
+        now = datetime_now(utc)
+        def event(name, days):
+            return ('test', now - timedelta(days=days), 'joe', name)
+        provider = self.timeline_event_providers['cacheable'](self.env)
+        provider._events = [event('c1', 0), event('c2', 5),
+                            event('private', 6), event('c3', 10)]
+        self.env.config.set('timeline', 'event_cache_horizon', 2)
+        module = TimelineModule(self.env)
+        def process_request():
+            req = MockRequest(self.env, path_info='/timeline')
+            data = module.process_request(req)[1]
+            return [e['data'] for e in data['events']]
+
+        self.assertEqual(['c1', 'c2', 'c3'], process_request())
+        self.assertEqual(['c1', 'c2', 'private', 'c3'], provider.fetched)
+
+        del provider.fetched[:]
+        provider._events.append(event('c4', 8))
+        self.assertEqual(['c1', 'c2', 'c3'], process_request())
+        self.assertEqual(['c1'], provider.fetched)
+
+        TimelineEventCache(self.env).reset()
+        self.assertEqual(['c1', 'c2', 'c4', 'c3'], process_request())
+
     def _process_request(self, req):
         mod = TimelineModule(self.env)
         req = MockRequest(self.env, path_info='/timeline',
@@ -20,15 +20,20 @@
 import pkg_resources
 import re
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 from trac.config import IntOption, BoolOption
 from trac.core import *
-from trac.perm import IPermissionRequestor
-from trac.timeline.api import ITimelineEventProvider
+from trac.perm import IPermissionRequestor, PermissionCache
+from trac.timeline.api import ITimelineEventProvider, TimelineEventCache, \
+                              merge_timeline_events
+from trac.util import translation
+from trac.util.concurrency import get_thread_id, threading
 from trac.util.datefmt import (datetime_now, format_date, format_datetime,
                                format_time, localtz, parse_date,
-                               pretty_timedelta, to_datetime, to_utimestamp,
-                               truncate_datetime, user_time, utc)
+                               pretty_timedelta, time_now, to_datetime,
+                               to_utimestamp, truncate_datetime, user_time,
+                               utc)
 from trac.util.html import tag
 from trac.util.text import to_unicode
 from trac.util.translation import _
@@ -66,8 +71,28 @@ class TimelineModule(Component):
         specific event providers, see their own documentation.
         """)
 
+    parallel_providers = IntOption('timeline', 'parallel_providers', 0,
+        """Number of threads retrieving the events of the timeline event
+        providers concurrently. The threads are shared by all the requests
+        of the environment. With 0, the providers are queried one after
+        another, and only as many events as displayed are retrieved from
+        the providers returning sorted events. (''since 1.3.4'')
+        """)
+
+    provider_timeout = IntOption('timeline', 'provider_timeout', 30,
+        """Maximum number of seconds to wait for the events of each timeline
+        event provider, from the time it starts retrieving them, when the
+        providers are queried concurrently. The events of a provider which
+        didn't complete in time are left out. (''since 1.3.4'')
+        """)
+
     _authors_pattern = re.compile(r'(-)?(?:"([^"]*)"|\'([^\']*)\'|([^\s]+))')
 
+    def __init__(self):
+        self._pool = None
+        self._pool_size = None
+        self._pool_lock = threading.Lock()
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -186,22 +211,29 @@ class TimelineModule(Component):
             else:
                 include.add(name)
 
-        # gather all events for the given period of time
+        if format == 'rss':
+            self._check_feed_modified(req, filters, daysback, authors,
+                                      maxrows, stop)
+
+        # merge the events of the providers for the given period of time,
+        # newest first, stopping as soon as enough events have been found
+        if self.parallel_providers > 0:
+            provider_events = self._parallel_provider_events(
+                req, self.event_providers, start, stop, filters)
+        else:
+            provider_events = [
+                self._provider_events(req, provider, start, stop, filters)
+                for provider in self.event_providers]
         events = []
-        for provider in self.event_providers:
-            with component_guard(self.env, req, provider):
-                for event in provider.get_timeline_events(req, start, stop,
-                                                          filters) or []:
-                    author = (event[2] or '').lower()
-                    if ((not include or author in include) and
-                        author not in exclude):
-                        events.append(
-                            self._event_data(req, provider, event, lastvisit))
-
-        # prepare sorted global list
-        events = sorted(events, key=lambda e: e['datetime'], reverse=True)
-        if maxrows:
-            events = events[:maxrows]
+        for event, provider in merge_timeline_events(
+                provider_events, key=lambda item: item[0]):
+            author = (event[2] or '').lower()
+            if ((not include or author in include) and
+                author not in exclude):
+                events.append(
+                    self._event_data(req, provider, event, lastvisit))
+                if maxrows and len(events) >= maxrows:
+                    break
 
         data['events'] = events
 
@@ -362,6 +394,146 @@ class TimelineModule(Component):
 
     # Internal methods
 
+    def _check_feed_modified(self, req, filters, daysback, authors, maxrows,
+                             stop):
+        """Send a "304 Not Modified" response if the feed didn't change
+        since the client retrieved it, when all the event providers can
+        tell the time of their latest modification.
+        """
+        times = []
+        states = []
+        for provider in self.event_providers:
+            get_last_modified = getattr(provider,
+                                        'get_timeline_last_modified', None)
+            if get_last_modified is None:
+                return
+            modified = get_last_modified(filters)
+            if modified:
+                times.append(modified[0])
+                states.append(modified[1])
+        last_modified = max(filter(None, times) or [to_datetime(0, utc)])
+        req.check_modified(last_modified, [sorted(filters), daysback,
+                                           authors, maxrows,
+                                           to_utimestamp(stop), states,
+                                           req.locale])
+
+    def _provider_events(self, req, provider, start, stop, filters):
+        """Generate the `(event, provider)` pairs of `provider` for the
+        given period of time, newest first.
+        """
+        events = []
+        is_sorted = False
+        with component_guard(self.env, req, provider):
+            if hasattr(provider, 'is_timeline_sorted'):
+                is_sorted = provider.is_timeline_sorted()
+            event_cache = TimelineEventCache(self.env)
+            if event_cache.horizon > 0 and \
+                    hasattr(provider, 'get_cacheable_timeline_events'):
+                generator = provider.filter_timeline_events(
+                    req, event_cache.get_events(provider, start, stop,
+                                                filters), filters)
+            else:
+                generator = provider.get_timeline_events(req, start, stop,
+                                                         filters)
+            if is_sorted:
+                events = generator or []
+            else:
+                for event in generator or []:
+                    events.append(event)
+        if not is_sorted:
+            events.sort(key=lambda e: to_utimestamp(e[1]), reverse=True)
+        events = iter(events)
+        while True:
+            event = None
+            with component_guard(self.env, req, provider):
+                event = next(events, None)
+            if event is None:
+                break
+            yield event, provider
+
+    def _parallel_provider_events(self, req, providers, start, stop,
+                                  filters):
+        """Retrieve the events of the `providers` in the pool of
+        `parallel_providers` threads of the environment, and return the
+        lists of `(event, provider)` pairs of the providers which
+        completed within `provider_timeout` seconds of being started.
+
+        Each provider uses a copy of the permission cache of the request.
+        The providers which didn't start or complete in time are
+        cancelled, and stop retrieving events as soon as they produce the
+        next one.
+        """
+        pool = self._get_pool()
+        jobs = []
+        for provider in providers:
+            perm = req.perm
+            if isinstance(perm, PermissionCache):
+                perm = PermissionCache(self.env, perm.username,
+                                       cache=dict(perm._cache))
+            job = _TimelineJob(provider)
+            pool.apply_async(self._run_job,
+                             (job, req, _WorkerRequest(req, perm), start,
+                              stop, filters))
+            jobs.append(job)
+
+        provider_events = []
+        for job in jobs:
+            # The jobs of the other requests may delay the start
+            if job.started.wait(self.provider_timeout):
+                timeout = job.start_time + self.provider_timeout - time_now()
+                completed = job.done.wait(max(0, timeout))
+            else:
+                completed = False
+            if completed:
+                provider_events.append(job.events)
+            else:
+                job.cancelled.set()
+                name = job.provider.__class__.__name__
+                self.log.warning("Timeline event provider %s didn't complete "
+                                 "within %d seconds", name,
+                                 self.provider_timeout)
+                add_warning(req, _("The events of %(component)s were left "
+                                   "out as they took too long to retrieve.",
+                                   component=name))
+        return provider_events
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool_size != self.parallel_providers:
+                if self._pool:
+                    self._pool.close()
+                self._pool = ThreadPool(self.parallel_providers)
+                self._pool_size = self.parallel_providers
+            return self._pool
+
+    def _run_job(self, job, req, worker_req, start, stop, filters):
+        """Retrieve the events of a provider in a thread of the pool."""
+        if job.cancelled.is_set():
+            return
+        translation.make_activable(lambda: req.locale, self.env.path)
+        try:
+            job.start_time = time_now()
+            job.started.set()
+            with self.env.db_query:
+                for event in self._provider_events(worker_req, job.provider,
+                                                   start, stop, filters):
+                    if job.cancelled.is_set():
+                        return
+                    job.events.append(event)
+            self.log.debug("Timeline event provider %s returned %d events "
+                           "in %.3f seconds",
+                           job.provider.__class__.__name__, len(job.events),
+                           time_now() - job.start_time)
+        except Exception:
+            self.log.error("Timeline event provider %s failed",
+                           job.provider.__class__.__name__, exc_info=True)
+        finally:
+            job.done.set()
+            translation.deactivate()
+            # Release the database connection and the repositories used
+            # by the thread
+            self.env.shutdown(get_thread_id())
+
     def _event_data(self, req, provider, event, lastvisit):
         """Compose the timeline event date from the event tuple and prepared
         provider methods"""
@@ -379,3 +551,30 @@ class TimelineModule(Component):
                 'render': render,
                 'unread': lastvisit and lastvisit < datetime_uid,
                 'event': event, 'data': data, 'provider': provider}
+
+
+class _TimelineJob(object):
+    """Retrieval of the events of a timeline event provider by a thread
+    of the pool.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.start_time = None
+        self.events = []
+
+
+class _WorkerRequest(object):
+    """Request of a timeline worker thread, having its own permission
+    cache and delegating the other attributes to the request.
+    """
+
+    def __init__(self, req, perm):
+        self._req = req
+        self.perm = perm
+
+    def __getattr__(self, name):
+        return getattr(self._req, name)
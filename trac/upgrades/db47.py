@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `search_index` table, and request the indexing of the
+    existing resources.
+    """
+    schema = [
+        Table('search_index', key='id')[
+            Column('id', auto_increment=True),
+            Column('realm'),
+            Column('target'),
+            Column('parent_realm'),
+            Column('parent_target'),
+            Column('time', type='int64'),
+            Column('author'),
+            Column('title'),
+            Column('text'),
+            Index(['realm', 'target', 'parent_realm', 'parent_target'])],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
+    # The resources are indexed by `SearchSystem` once the database is
+    # upgraded, as the indexers use the tables of the later versions.
+    cursor.execute("""
+        INSERT INTO system (name, value) VALUES ('search_reindex', '1')
+        """)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `attachment_text` table and queue the existing
+    attachments for the extraction of their text.
+    """
+    schema = [
+        Table('attachment_text', key=('type', 'id', 'filename'))[
+            Column('type'),
+            Column('id'),
+            Column('filename'),
+            Column('extracted', type='int'),
+            Column('text'),
+            Index(['extracted'])],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
+    cursor.execute("""
+        INSERT INTO attachment_text (type, id, filename, extracted)
+        SELECT type, id, filename, 0 FROM attachment
+        """)
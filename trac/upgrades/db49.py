@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `wiki_render_cache` table."""
+    schema = [
+        Table('wiki_render_cache', key='hash')[
+            Column('hash'),
+            Column('name'),
+            Column('version', type='int'),
+            Column('time', type='int64'),
+            Column('size', type='int'),
+            Column('html'),
+            Column('macros'),
+            Index(['name']),
+            Index(['time'])],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
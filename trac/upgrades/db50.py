@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `wiki_head` table, with the latest version of each wiki
+    page.
+    """
+    schema = [
+        Table('wiki_head', key='name')[
+            Column('name'),
+            Column('version', type='int'),
+            Column('time', type='int64'),
+            Column('author'),
+            Index(['time'])],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
+    cursor.execute("""
+        INSERT INTO wiki_head (name, version, time, author)
+        SELECT w1.name, w1.version, w1.time, w1.author
+        FROM wiki w1, (SELECT name, max(version) AS ver
+                       FROM wiki GROUP BY name) w2
+        WHERE w1.name=w2.name AND w1.version=w2.ver
+        """)
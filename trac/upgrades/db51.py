@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Table
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `wiki_delta` table, for the versions of the wiki pages
+    stored as deltas.
+    """
+    schema = [
+        Table('wiki_delta', key=('name', 'version'))[
+            Column('name'),
+            Column('version', type='int'),
+            Column('data')],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+from trac.util.text import printout
+from trac.util.translation import _
+
+
+def do_upgrade(env, version, cursor):
+    """Add the `wiki_link` table.
+
+    The links of the existing wiki pages and tickets are extracted by
+    `trac-admin wiki relink` rather than within the upgrade transaction.
+    """
+    schema = [
+        Table('wiki_link', key=('source_realm', 'source_id', 'target_realm',
+                                'target_id'))[
+            Column('source_realm'),
+            Column('source_id'),
+            Column('target_realm'),
+            Column('target_id'),
+            Index(['target_realm', 'target_id'])],
+    ]
+
+    DatabaseManager(env).create_tables(schema)
+
+    cursor.execute("SELECT COUNT(*) FROM wiki_head")
+    pages = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM ticket")
+    tickets = cursor.fetchone()[0]
+    if pages or tickets:
+        # TRANSLATOR: Wrap message to 80 columns
+        printout(_("""\
+The links between the wiki pages and tickets must be extracted by running
+"trac-admin %(path)s wiki relink".
+""", path=env.path))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.db.api import DatabaseManager
+from trac.search.api import SearchSystem
+from trac.search.index import DefaultSearchIndexer
+from trac.test import EnvironmentStub
+from trac.ticket.test import insert_ticket
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    # The tables added after version 45
+    tables = ('notify_digest', 'search_index', 'search_index_fts',
+              'attachment_text', 'wiki_render_cache', 'wiki_head',
+              'wiki_delta', 'wiki_link')
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=('trac.*', DefaultSearchIndexer))
+        insert_ticket(self.env, summary='The summary',
+                      description='The description')
+        with self.env.db_transaction as db:
+            for table in self.tables:
+                db.drop_table(table)
+            db.executemany("""
+                INSERT INTO wiki (name, version, time, author, text)
+                VALUES (%s,%s,%s,%s,%s)
+                """, [('PageA', 1, 1000000, 'joe', 'Old text'),
+                      ('PageA', 2, 2000000, 'jane', 'New text')])
+        DatabaseManager(self.env).set_database_version(45)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_upgrade_from_version_45(self):
+        self.assertTrue(SearchSystem(self.env).environment_needs_upgrade())
+
+        self.env.upgrade()
+
+        self.assertFalse(DatabaseManager(self.env).environment_needs_upgrade())
+        self.assertFalse(SearchSystem(self.env).environment_needs_upgrade())
+        self.assertEqual([('ticket', '1', 'The summary')],
+                         self.env.db_query("""
+                            SELECT realm, target, title FROM search_index
+                            WHERE realm='ticket'"""))
+        # The wiki pages are indexed from wiki_head, added by db50
+        self.assertEqual([('wiki', 'PageA', 'jane', 'New text\njane')],
+                         self.env.db_query("""
+                            SELECT realm, target, author, text
+                            FROM search_index WHERE realm='wiki'
+                            AND target='PageA'"""))
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
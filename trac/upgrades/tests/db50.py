@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.test import EnvironmentStub
+from trac.upgrades import db50
+
+
+class UpgradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            db.drop_table('wiki_head')
+            db.executemany("""
+                INSERT INTO wiki (name, version, time, author)
+                VALUES (%s,%s,%s,%s)
+                """, [('PageA', 1, 1000, 'joe'),
+                      ('PageA', 2, 2000, 'jane'),
+                      ('PageB', 1, 1500, 'joe')])
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_wiki_head_filled(self):
+        with self.env.db_transaction as db:
+            db50.do_upgrade(self.env, 50, db.cursor())
+
+        self.assertEqual([('PageA', 2, 2000, 'jane'),
+                          ('PageB', 1, 1500, 'joe')],
+                         self.env.db_query("""
+                            SELECT name, version, time, author
+                            FROM wiki_head ORDER BY name"""))
+
+
+def test_suite():
+    return unittest.makeSuite(UpgradeTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -21,6 +21,7 @@ import csv
 import errno
 import functools
 import hashlib
+import heapq
 import inspect
 import io
 try:
@@ -1315,6 +1316,38 @@ def partition(iterable, order=None):
     return [result[key] for key in order]
 
 
+def merge_sorted(iterables, key=None):
+    """Merge iterables which are each sorted by increasing `key` into
+    a single iterator sorted by increasing `key`.
+
+    The iterables are consumed lazily. Items having the same key are
+    produced in the order of the iterables.
+
+    >>> list(merge_sorted([[1, 4, 7], [2, 3, 8], []]))
+    [1, 2, 3, 4, 7, 8]
+    >>> list(merge_sorted([['b', 'dd'], ['c', 'eee']], key=len))
+    ['b', 'c', 'dd', 'eee']
+
+    :since: 1.3.4
+    """
+    if key is None:
+        key = lambda item: item
+    heap = []
+    for idx, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            heap.append((key(item), idx, item, iterator))
+            break
+    heapq.heapify(heap)
+    while heap:
+        idx, item, iterator = heap[0][1:]
+        yield item
+        for item in iterator:
+            heapq.heapreplace(heap, (key(item), idx, item, iterator))
+            break
+        else:
+            heapq.heappop(heap)
+
 def as_int(s, default, min=None, max=None):
     """Convert s to an int and limit it to the given range, or return default
     if unsuccessful."""
@@ -29,10 +29,12 @@ from trac.core import *
 from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import ResourceNotFound
-from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
+from trac.search import ISearchSource, SearchSystem, search_to_sql, \
+                         shorten_result
+from trac.timeline.api import ITimelineEventProvider, merge_timeline_events
 from trac.util import as_bool, content_disposition, embedded_numbers, pathjoin
-from trac.util.datefmt import from_utimestamp, pretty_timedelta
+from trac.util.datefmt import datetime_now, from_utimestamp, \
+                              pretty_timedelta, to_utimestamp, utc
 from trac.util.html import tag
 from trac.util.presentation import to_json
 from trac.util.text import CRLF, exception_to_unicode, shorten_line, \
@@ -40,6 +42,7 @@ from trac.util.text import CRLF, exception_to_unicode, shorten_line, \
 from trac.util.translation import _, ngettext, tag_
 from trac.versioncontrol.api import Changeset, NoSuchChangeset, Node, \
                                     RepositoryManager
+from trac.versioncontrol.cache import CachedRepository
 from trac.versioncontrol.diff import diff_blocks, get_diff_options, \
                                      unified_diff
 from trac.versioncontrol.web_ui.browser import BrowserModule
@@ -866,6 +869,9 @@ class ChangesetModule(Component):
         else:
             return []
 
+    def is_timeline_sorted(self):
+        return True
+
     def get_timeline_events(self, req, start, stop, filters):
         all_repos = 'changeset' in filters
         repo_filters = {f for f in filters if f.startswith('repo-')}
@@ -907,17 +913,51 @@ class ChangesetModule(Component):
                                (viewable_changesets,
                                 show_location, show_files))
 
+            def repository_events(repos):
+                try:
+                    for event in generate_changesets(repos):
+                        yield event
+                except TracError as e:
+                    self.log.error("Timeline event provider for repository"
+                                   " '%s' failed: %r",
+                                   repos.reponame, exception_to_unicode(e))
+
             rm = RepositoryManager(self.env)
+            iterables = []
             for repos in sorted(rm.get_real_repositories(),
                                 key=lambda repos: repos.reponame):
                 if all_repos or ('repo-' + repos.reponame) in repo_filters:
-                    try:
-                        for event in generate_changesets(repos):
-                            yield event
-                    except TracError as e:
-                        self.log.error("Timeline event provider for repository"
-                                       " '%s' failed: %r",
-                                       repos.reponame, exception_to_unicode(e))
+                    events = repository_events(repos)
+                    if not isinstance(repos, CachedRepository):
+                        # Direct repositories generate the changesets in
+                        # revision order, which may not follow the dates
+                        events = sorted(events, reverse=True,
+                                        key=lambda e: to_utimestamp(e[1]))
+                    iterables.append(events)
+            for event in merge_timeline_events(iterables):
+                yield event
+
+    def get_timeline_last_modified(self, filters):
+        all_repos = 'changeset' in filters
+        repo_filters = {f for f in filters if f.startswith('repo-')}
+        if not all_repos and not repo_filters:
+            return None
+        times = []
+        youngest_revs = []
+        rm = RepositoryManager(self.env)
+        for repos in rm.get_real_repositories():
+            if all_repos or ('repo-' + repos.reponame) in repo_filters:
+                try:
+                    youngest_rev = repos.youngest_rev
+                    if youngest_rev is not None:
+                        times.append(repos.get_changeset(youngest_rev).date)
+                except TracError as e:
+                    self.log.warning("Can't retrieve the youngest changeset "
+                                     "of repository '%s': %s",
+                                     repos.reponame, exception_to_unicode(e))
+                    return datetime_now(utc), None
+                youngest_revs.append((repos.reponame, youngest_rev))
+        return max(times or [None]), sorted(youngest_revs)
 
     def render_timeline_event(self, context, field, event):
         changesets, show_location, show_files = event[3]
@@ -1132,32 +1172,73 @@ class ChangesetModule(Component):
         if not 'changeset' in filters:
             return
         rm = RepositoryManager(self.env)
-        repositories = {repos.params['id']: repos
-                        for repos in rm.get_real_repositories()}
         uids_seen = set()
         with self.env.db_query as db:
-            sql, args = search_to_sql(db, ['rev', 'message', 'author'], terms)
-            for id, rev, ts, author, log in db("""
-                    SELECT repos, rev, time, author, message
-                    FROM revision WHERE """ + sql, args):
-                repos = repositories.get(id)
-                if not repos:
-                    continue  # revisions for a no longer active repository
-                try:
-                    rev = repos.normalize_rev(rev)
-                    drev = repos.display_rev(rev)
-                except NoSuchChangeset:
-                    continue
-                uid = repos.get_changeset_uid(rev)
-                if uid in uids_seen:
-                    continue
-                cset = repos.resource.child(self.realm, rev)
-                if 'CHANGESET_VIEW' in req.perm(cset):
-                    uids_seen.add(uid)
-                    yield (req.href.changeset(rev, repos.reponame or None),
-                           '[%s]: %s' % (drev, shorten_line(log)),
-                           from_utimestamp(ts), author,
-                           shorten_result(log, terms))
+            index_sql = SearchSystem(self.env).get_index_sql(db, self.realm,
+                                                             terms)
+            if index_sql:
+                repositories = {repos.reponame: repos
+                                for repos in rm.get_real_repositories()}
+                sql, args = index_sql
+                rows = db("""
+                        SELECT parent_target, target, time, author, title,
+                               score
+                        FROM (%s) s""" % sql, args)
+            else:
+                repositories = {repos.params['id']: repos
+                                for repos in rm.get_real_repositories()}
+                sql, args = search_to_sql(db, ['rev', 'message', 'author'],
+                                          terms)
+                rows = db("""
+                        SELECT repos, rev, time, author, message, NULL
+                        FROM revision WHERE """ + sql, args)
+        for result in self._get_search_results(req, terms, repositories,
+                                               rows, uids_seen):
+            yield result
+
+    def get_search_results_page(self, req, terms, filters, limit, cursor):
+        if not 'changeset' in filters:
+            return [], None
+        # The cursor also holds the changesets already found, which are
+        # not listed again for the other repositories
+        cursor, uids_seen = cursor or (None, set())
+        with self.env.db_query as db:
+            page = SearchSystem(self.env).query_index(
+                db, [(self.realm, None)], terms, limit, cursor)
+        if page is None:
+            return None
+        rows, cursor = page
+        rm = RepositoryManager(self.env)
+        repositories = {repos.reponame: repos
+                        for repos in rm.get_real_repositories()}
+        rows = [(parent_target, target, time, author, title, score)
+                for realm, target, parent_realm, parent_target, time, author,
+                    title, text, score in rows]
+        results = list(self._get_search_results(req, terms, repositories,
+                                                rows, uids_seen))
+        return results, ((cursor, uids_seen) if cursor else None)
+
+    def _get_search_results(self, req, terms, repositories, rows, uids_seen):
+        for id, rev, ts, author, log, score in rows:
+            repos = repositories.get(id)
+            if not repos:
+                continue  # revisions for a no longer active repository
+            try:
+                rev = repos.normalize_rev(rev)
+                drev = repos.display_rev(rev)
+            except NoSuchChangeset:
+                continue
+            uid = repos.get_changeset_uid(rev)
+            if uid in uids_seen:
+                continue
+            cset = repos.resource.child(self.realm, rev)
+            if 'CHANGESET_VIEW' in req.perm(cset):
+                uids_seen.add(uid)
+                result = (req.href.changeset(rev, repos.reponame or None),
+                          '[%s]: %s' % (drev, shorten_line(log)),
+                          from_utimestamp(ts), author,
+                          shorten_result(log, terms))
+                yield result if score is None else result + (score,)
 
 
 class AnyDiffModule(Component):
@@ -283,6 +283,36 @@ def prevnext_nav(req, prev_label, next_label, up_label=None):
                               class_='missing' if not next_link else None))
 
 
+def prepare_paginator(req, paginator, page_href, page_index_count=21):
+    """Add the Previous/Next Page links of a `Paginator`, and set its
+    `shown_pages` and `current_page` attributes used by the
+    `page_index.html` template.
+
+    :param              req: a `Request` object
+    :param        paginator: a `trac.util.presentation.Paginator` object
+    :param        page_href: a function returning the URL of a page given
+                             its 1-based number
+    :param page_index_count: the maximum number of the pages shown in the
+                             page index
+
+    :since: 1.3.4
+    """
+    if paginator.has_next_page:
+        add_link(req, 'next', page_href(paginator.page + 2),
+                 _("Next Page"))
+    if paginator.has_previous_page:
+        add_link(req, 'prev', page_href(paginator.page),
+                 _("Previous Page"))
+    fields = ['href', 'class', 'string', 'title']
+    paginator.shown_pages = [
+        dict(zip(fields, [page_href(num), None, str(num),
+                          _("Page %(num)d", num=num)]))
+        for num in paginator.get_shown_pages(page_index_count)]
+    paginator.current_page = {'href': None, 'class': 'current',
+                              'string': str(paginator.page + 1),
+                              'title': None}
+
+
 def web_context(req, resource=None, id=False, version=False, parent=False,
                 absurls=False):
     """Create a rendering context from a request.
@@ -574,3 +574,28 @@ def get_session_attribute(env, sid, authenticated, name, default=None):
         return row[0]
     else:
         return default
+
+
+def get_session_attributes(env, sids, name):
+    """Return the `name` attribute of several sessions at once.
+
+    :param sids: an iterable of `(sid, authenticated)` tuples
+    :return: a dictionary mapping `(sid, authenticated)` tuples to the
+             attribute value, for the sessions having the attribute
+    :since: 1.3.4
+    """
+    sids = set((sid, 1 if authenticated else 0)
+               for sid, authenticated in sids)
+    names = sorted(set(sid for sid, authenticated in sids))
+    values = {}
+    with env.db_query as db:
+        for idx in xrange(0, len(names), 100):
+            chunk = names[idx:idx + 100]
+            for sid, authenticated, value in db("""
+                    SELECT sid, authenticated, value FROM session_attribute
+                    WHERE name=%%s AND sid IN (%s)
+                    """ % ','.join(['%s'] * len(chunk)), [name] + chunk):
+                key = (sid, authenticated)
+                if key in sids:
+                    values[key] = value
+    return values
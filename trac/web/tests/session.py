@@ -24,7 +24,8 @@ from trac.util.datefmt import format_date, get_datetime_format_hint, \
                               time_now, to_datetime
 from trac.web.api import IRequestHandler
 from trac.web.session import DetachedSession, PURGE_AGE, Session, \
-                             SessionAdmin, SessionDict, UPDATE_INTERVAL
+                             SessionAdmin, SessionDict, UPDATE_INTERVAL, \
+                             get_session_attributes
 
 
 def _prep_session_table(env, spread_visits=False):
@@ -662,6 +663,20 @@ class SessionTestCase(unittest.TestCase):
         self.assertEqual(name, known_users[0][1])
         self.assertIsNone(known_users[0][2])
 
+    def test_get_session_attributes(self):
+        self.env.insert_users([('john', 'John', 'john@example.org', 1),
+                               ('jane', 'Jane', None, 1),
+                               ('joe', 'Joe', 'joe@example.net', 0)])
+        emails = get_session_attributes(self.env, [('john', True),
+                                                   ('jane', 1),
+                                                   ('joe', 1),
+                                                   ('joe', 0),
+                                                   ('jim', 1)], 'email')
+        self.assertEqual({('john', 1): 'john@example.org',
+                          ('jane', 1): None,
+                          ('joe', 0): 'joe@example.net'}, emails)
+        self.assertEqual({}, get_session_attributes(self.env, [], 'email'))
+
     def test_session_admin_list(self):
         auth_list, anon_list, all_list = _prep_session_table(self.env)
         sess_admin = SessionAdmin(self.env)
@@ -11,21 +11,30 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/.
 
+import io
 import os.path
 import pkg_resources
 import sys
+import tarfile
+import zipfile
+from multiprocessing.pool import ThreadPool
 
 from trac.admin import *
 from trac.api import IEnvironmentSetupParticipant
+from trac.config import IntOption
 from trac.core import *
+from trac.search.api import SearchSystem
 from trac.wiki import model
 from trac.wiki.api import WikiSystem, validate_page_name
+from trac.wiki.cache import WikiRenderingCache
+from trac.wiki.links import WikiLinkGraph
 from trac.util import read_file
 from trac.util.datefmt import datetime_now, format_datetime, from_utimestamp, \
                               to_utimestamp, utc
 from trac.util.text import path_to_unicode, print_table, printout, \
                            to_unicode, unicode_quote, unicode_unquote
 from trac.util.translation import _
+from trac.web.chrome import add_notice
 
 
 class WikiAdmin(Component):
@@ -33,6 +42,17 @@ class WikiAdmin(Component):
 
     implements(IAdminCommandProvider, IEnvironmentSetupParticipant)
 
+    import_readers = IntOption('wiki', 'import_readers', 0,
+        """Number of threads reading the files of the wiki pages
+        concurrently when a directory is imported by `trac-admin wiki
+        load` or `wiki replace`. With 0, the files are read one after
+        another.
+        (''since 1.3.4'')""")
+
+    #: Number of wiki pages imported or exported at once, and imported
+    #: in each transaction
+    BATCH_SIZE = 100
+
     # IAdminCommandProvider methods
 
     def get_admin_commands(self):
@@ -57,14 +77,19 @@ class WikiAdmin(Component):
                Individual wiki page names can be specified after the directory.
                A name ending with a * means that all wiki pages starting with
                that prefix should be dumped. If no name is specified, all wiki
-               pages are dumped.""",
+               pages are dumped.
+
+               If the directory name ends with .zip, .tar, .tar.gz, .tgz
+               or .tar.bz2, the files are written to an archive of that
+               format instead.""",
                self._complete_dump, self._do_dump)
         yield ('wiki load', '<path> [...]',
                """Import wiki pages from files
 
                If a given path is a file, it is imported as a page with the
-               name of the file. If a path is a directory, all files in that
-               directory are imported.""",
+               name of the file. If a path is a directory or an archive
+               written by "wiki dump", all files in that directory or
+               archive are imported.""",
                self._complete_load_replace, self._do_load)
         yield ('wiki replace', '<path> [...]',
                """Replace content of wiki pages from files (DANGEROUS!)
@@ -75,8 +100,9 @@ class WikiAdmin(Component):
                metadata of the page (time, author) is not changed either.
 
                If a given path is a file, it is imported as a page with the
-               name of the file. If a path is a directory, all files in that
-               directory are imported.
+               name of the file. If a path is a directory or an archive
+               written by "wiki dump", all files in that directory or
+               archive are imported.
 
                WARNING: This operation results in the loss of the previous
                content and cannot be undone. It may be advisable to backup
@@ -85,6 +111,16 @@ class WikiAdmin(Component):
         yield ('wiki upgrade', '',
                'Upgrade default wiki pages to current version',
                None, self._do_upgrade)
+        yield ('wiki compact', '[page] [...]',
+               """Convert the storage of the wiki page versions
+
+               The versions are stored in full or as compressed deltas,
+               according to the `[wiki] history_snapshot_interval`
+               option. Individual wiki page names can be specified. A
+               name ending with a * means that all wiki pages starting
+               with that prefix should be converted. If no name is
+               specified, all wiki pages are converted, one at a time.""",
+               self._complete_page, self._do_compact)
 
     def get_wiki_list(self):
         return list(WikiSystem(self.env).get_pages())
@@ -109,9 +145,6 @@ class WikiAdmin(Component):
 
     def import_page(self, filename, title, create_only=[],
                     replace=False):
-        if not validate_page_name(title):
-            raise AdminCommandError(_("Invalid Wiki page name '%(name)s'",
-                                      name=title))
         if filename:
             if not os.path.isfile(filename):
                 raise AdminCommandError(_("'%(name)s' is not a file",
@@ -119,51 +152,48 @@ class WikiAdmin(Component):
             data = read_file(filename)
         else:
             data = sys.stdin.read()
-        data = to_unicode(data, 'utf-8')
+        return bool(self.import_pages([(title, data)], create_only, replace))
 
-        with self.env.db_transaction as db:
-            # Make sure we don't insert the exact same page twice
-            old = db("""SELECT text FROM wiki WHERE name=%s
-                        ORDER BY version DESC LIMIT 1
-                        """, (title,))
-            if old and title in create_only:
-                printout(_("  %(title)s already exists", title=title))
-                return False
-            if old and data == old[0][0]:
-                printout(_("  %(title)s is already up to date", title=title))
-                return False
-
-            if replace and old:
-                db("""UPDATE wiki SET text=%s
-                      WHERE name=%s
-                        AND version=(SELECT max(version) FROM wiki
-                                     WHERE name=%s)
-                      """, (data, title, title))
-            else:
-                db("""INSERT INTO wiki (version, readonly, name, time, author,
-                                        text)
-                      SELECT 1 + COALESCE(max(version), 0),
-                             COALESCE(max(readonly), 0),
-                             %s, %s, 'trac', %s FROM wiki
-                      WHERE name=%s AND version=(SELECT max(version)
-                                                 FROM wiki WHERE name=%s)
-                      """, (title, to_utimestamp(datetime_now(utc)), data,
-                            title, title))
-            if not old:
-                del WikiSystem(self.env).pages
-        return True
+    def import_pages(self, pages, create_only=[], replace=False):
+        """Import the `(title, text)` pairs of the `pages` iterable, in
+        batches of `BATCH_SIZE` pages per transaction, and return the
+        titles of the pages which have been imported.
+
+        A new version is added to the existing pages, unless `replace`
+        is `True` or the page is in `create_only`.
+
+        :since: 1.3.4
+        """
+        imported = []
+        for batch in _batches(pages, self.BATCH_SIZE):
+            imported.extend(self._import_batch(batch, create_only, replace))
+        return imported
 
     def load_pages(self, dir, ignore=[], create_only=[], replace=False):
-        with self.env.db_transaction:
-            for page in os.listdir(dir):
-                if page in ignore:
-                    continue
-                filename = os.path.join(dir, page)
-                page = unicode_unquote(page.encode('utf-8'))
-                if os.path.isfile(filename):
-                    if self.import_page(filename, page, create_only, replace):
-                        self.log.info("%s imported from %s",
-                                      page, path_to_unicode(filename))
+        files = []
+        for page in os.listdir(dir):
+            if page in ignore:
+                continue
+            filename = os.path.join(dir, page)
+            page = unicode_unquote(page.encode('utf-8'))
+            if os.path.isfile(filename):
+                files.append((page, filename))
+        filenames = dict(files)
+        for page in self.import_pages(self._read_files(files), create_only,
+                                      replace):
+            self.log.info("%s imported from %s", page,
+                          path_to_unicode(filenames[page]))
+
+    def load_archive(self, filename, create_only=[], replace=False):
+        """Import the wiki pages of a tar or zip archive written by
+        `trac-admin wiki dump`.
+
+        :since: 1.3.4
+        """
+        for page in self.import_pages(self._read_archive(filename),
+                                      create_only, replace):
+            self.log.info("%s imported from %s", page,
+                          path_to_unicode(filename))
 
     def _complete_page(self, args):
         if len(args) == 1:
@@ -190,8 +220,8 @@ class WikiAdmin(Component):
             [(title, int(edits), format_datetime(from_utimestamp(modified),
                                                  console_datetime_format))
              for title, edits, modified in self.env.db_query("""
-                    SELECT name, max(version), max(time)
-                    FROM wiki GROUP BY name ORDER BY name""")
+                    SELECT name, version, time
+                    FROM wiki_head ORDER BY name""")
              ], [_("Title"), _("Edits"), _("Modified")])
 
     def _do_rename(self, name, new_name):
@@ -231,6 +261,13 @@ class WikiAdmin(Component):
         if not names:
             names = ['*']
         pages = self.get_wiki_list()
+        if _archive_format(directory):
+            self._dump_archive(directory,
+                               [p for p in pages
+                                if any(p == name or (name.endswith('*') and
+                                                     p.startswith(name[:-1]))
+                                       for name in names)])
+            return
         if not os.path.isdir(directory):
             if not os.path.exists(directory):
                 os.mkdir(directory)
@@ -246,16 +283,17 @@ class WikiAdmin(Component):
                 self.export_page(p, dst)
 
     def _load_or_replace(self, paths, replace):
-        with self.env.db_transaction:
-            for path in paths:
-                if os.path.isdir(path):
-                    self.load_pages(path, replace=replace)
-                else:
-                    page = os.path.basename(path)
-                    page = unicode_unquote(page.encode('utf-8'))
-                    if self.import_page(path, page, replace=replace):
-                        printout(_("  %(page)s imported from %(filename)s",
-                                   filename=path_to_unicode(path), page=page))
+        for path in paths:
+            if os.path.isdir(path):
+                self.load_pages(path, replace=replace)
+            elif _archive_format(path) and os.path.isfile(path):
+                self.load_archive(path, replace=replace)
+            else:
+                page = os.path.basename(path)
+                page = unicode_unquote(page.encode('utf-8'))
+                if self.import_page(path, page, replace=replace):
+                    printout(_("  %(page)s imported from %(filename)s",
+                               filename=path_to_unicode(path), page=page))
 
     def _do_load(self, *paths):
         self._load_or_replace(paths, replace=False)
@@ -263,12 +301,175 @@ class WikiAdmin(Component):
     def _do_replace(self, *paths):
         self._load_or_replace(paths, replace=True)
 
+    def _do_compact(self, *names):
+        if not names:
+            names = ['*']
+        count = 0
+        for p in self.get_wiki_list():
+            if any(p == name or (name.endswith('*')
+                                 and p.startswith(name[:-1]))
+                   for name in names):
+                count += model.WikiPage.compact(self.env, p)
+        printout(_("%(count)s version(s) converted.", count=count))
+
     def _do_upgrade(self):
         self.load_pages(pkg_resources.resource_filename('trac.wiki',
                                                         'default-pages'),
                         ignore=['WikiStart', 'SandBox'],
                         create_only=['InterMapTxt'])
 
+    # Internal methods
+
+    def _import_batch(self, pages, create_only, replace):
+        for title, data in pages:
+            if not validate_page_name(title):
+                raise AdminCommandError(_("Invalid Wiki page name '%(name)s'",
+                                          name=title))
+        titles = list(set(title for title, data in pages))
+        now = to_utimestamp(datetime_now(utc))
+        imported = []
+        rows = []
+        row_indexes = {}
+        heads = {}
+        with self.env.db_transaction as db:
+            latest = {}
+            for name, version, readonly, text in db("""
+                    SELECT w.name, w.version, w.readonly, w.text
+                    FROM wiki w, wiki_head h
+                    WHERE w.name=h.name AND w.version=h.version
+                    AND w.name IN (%s)
+                    """ % ','.join(['%s'] * len(titles)), titles):
+                latest[name] = (version, readonly, text)
+            created = set(titles) - set(latest)
+            for title, data in pages:
+                data = to_unicode(data, 'utf-8')
+                old = latest.get(title)
+                # Make sure we don't insert the exact same page twice
+                if old and title in create_only:
+                    printout(_("  %(title)s already exists", title=title))
+                    continue
+                if old and data == old[2]:
+                    printout(_("  %(title)s is already up to date",
+                               title=title))
+                    continue
+                if replace and old:
+                    if title in row_indexes:
+                        # The page has been inserted earlier in the batch
+                        rows[row_indexes[title]] = \
+                            (title, old[0], now, 'trac', data, old[1])
+                    else:
+                        model.WikiPage.replace_text(self.env, title, data)
+                    latest[title] = (old[0], old[1], data)
+                else:
+                    version = old[0] + 1 if old else 1
+                    readonly = old[1] if old else 0
+                    row_indexes[title] = len(rows)
+                    rows.append((title, version, now, 'trac', data,
+                                 readonly))
+                    heads[title] = (version, now, 'trac')
+                    latest[title] = (version, readonly, data)
+                imported.append(title)
+            db.executemany("""
+                INSERT INTO wiki (name, version, time, author, text, readonly)
+                VALUES (%s,%s,%s,%s,%s,%s)
+                """, rows)
+            db.executemany("DELETE FROM wiki_head WHERE name=%s",
+                           [(title,) for title in heads])
+            db.executemany("""
+                INSERT INTO wiki_head (name, version, time, author)
+                VALUES (%s,%s,%s,%s)
+                """, [(title,) + head for title, head in heads.iteritems()])
+            if created & set(heads):
+                del WikiSystem(self.env).pages
+                # The links to the new pages are no longer missing
+                WikiRenderingCache(self.env).clear()
+            if imported:
+                SearchSystem(self.env).reindex_resources('wiki',
+                                                         set(imported))
+                if self.env.is_component_enabled(WikiLinkGraph):
+                    graph = WikiLinkGraph(self.env)
+                    for title in set(imported):
+                        graph.update_links('wiki', title, [latest[title][2]])
+        return imported
+
+    def _read_files(self, files):
+        """Read the `(title, filename)` files, concurrently if
+        `import_readers` is set, and yield the `(title, text)` pairs.
+        """
+        pool = ThreadPool(self.import_readers) \
+               if self.import_readers > 0 else None
+        try:
+            for batch in _batches(files, self.BATCH_SIZE):
+                filenames = [filename for title, filename in batch]
+                texts = pool.map(read_file, filenames) if pool else \
+                        [read_file(filename) for filename in filenames]
+                for (title, filename), text in zip(batch, texts):
+                    yield title, text
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def _read_archive(self, filename):
+        """Yield the `(title, text)` pairs of the files of a tar or
+        zip archive, one at a time.
+        """
+        if _archive_format(filename) == 'zip':
+            archive = zipfile.ZipFile(filename)
+            try:
+                for info in archive.infolist():
+                    if not info.filename.endswith('/'):
+                        yield (_archive_page_name(info.filename),
+                               archive.read(info))
+            finally:
+                archive.close()
+        else:
+            archive = tarfile.open(filename, 'r|*')
+            try:
+                for member in archive:
+                    if member.isfile():
+                        yield (_archive_page_name(member.name),
+                               archive.extractfile(member).read())
+            finally:
+                archive.close()
+
+    def _dump_archive(self, filename, pages):
+        """Write the latest version of the wiki `pages` to a tar or zip
+        archive, fetching `BATCH_SIZE` pages at once.
+        """
+        if os.path.exists(filename):
+            raise AdminCommandError(_("File '%(name)s' exists",
+                                      name=path_to_unicode(filename)))
+        format = _archive_format(filename)
+        if format == 'zip':
+            archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            archive = tarfile.open(filename, _tar_modes[format])
+        try:
+            for batch in _batches(pages, self.BATCH_SIZE):
+                for name, time, text in self.env.db_query("""
+                        SELECT w.name, w.time, w.text
+                        FROM wiki w, wiki_head h
+                        WHERE w.name=h.name AND w.version=h.version
+                        AND w.name IN (%s) ORDER BY w.name
+                        """ % ','.join(['%s'] * len(batch)), batch):
+                    member = unicode_quote(name, '')
+                    data = text.encode('utf-8')
+                    mtime = from_utimestamp(time)
+                    printout(' %s => %s:%s' % (name, filename, member))
+                    if format == 'zip':
+                        info = zipfile.ZipInfo(member,
+                                               mtime.timetuple()[:6])
+                        info.compress_type = zipfile.ZIP_DEFLATED
+                        archive.writestr(info, data)
+                    else:
+                        info = tarfile.TarInfo(member)
+                        info.size = len(data)
+                        info.mtime = to_utimestamp(mtime) // 1000000
+                        archive.addfile(info, io.BytesIO(data))
+        finally:
+            archive.close()
+
     # IEnvironmentSetupParticipant methods
 
     def environment_created(self):
@@ -287,3 +488,66 @@ class WikiAdmin(Component):
 
     def upgrade_environment(self):
         pass
+
+
+# The modes for writing the tar archives, by format
+_tar_modes = {'tar': 'w|', 'tar.gz': 'w|gz', 'tar.bz2': 'w|bz2'}
+
+
+def _archive_format(filename):
+    """Return the format of the archive, from the extension of its
+    `filename`: `'zip'`, `'tar'`, `'tar.gz'` or `'tar.bz2'`, or `None`.
+    """
+    filename = filename.lower()
+    if filename.endswith('.zip'):
+        return 'zip'
+    if filename.endswith('.tar'):
+        return 'tar'
+    if filename.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    if filename.endswith('.tar.bz2'):
+        return 'tar.bz2'
+
+
+def _archive_page_name(member):
+    if isinstance(member, unicode):
+        member = member.encode('utf-8')
+    return unicode_unquote(member.rsplit('/', 1)[-1])
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class MacroStatsAdminPanel(Component):
+    """Admin panel showing the time spent expanding the wiki macros."""
+
+    implements(IAdminPanelProvider)
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if 'TRAC_ADMIN' in req.perm('admin', 'general/macros'):
+            yield ('general', _("General"), 'macros', _("Wiki Macros"))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        wiki = WikiSystem(self.env)
+        if req.method == 'POST':
+            if req.args.get('reset'):
+                wiki.reset_macro_stats()
+                add_notice(req, _("The statistics of the wiki macros have "
+                                  "been reset."))
+            req.redirect(req.href.admin(cat, page))
+
+        stats = [{'name': name, 'calls': calls, 'time': time_,
+                  'average': time_ / calls, 'max_time': max_time}
+                 for name, calls, time_, max_time in wiki.get_macro_stats()]
+        return 'admin_macro_stats.html', {'stats': stats,
+                                          'budget': wiki.macro_time_budget}
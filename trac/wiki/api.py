@@ -17,9 +17,11 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 
 import re
+import threading
+from bisect import bisect_left
 
 from trac.cache import cached
-from trac.config import BoolOption, ListOption
+from trac.config import BoolOption, FloatOption, IntOption, ListOption
 from trac.core import *
 from trac.resource import IResourceManager
 from trac.util.html import is_safe_origin, tag
@@ -111,6 +113,31 @@ class IWikiMacroProvider(Interface):
         .. versionadded :: 1.0
         """
 
+    def is_cacheable(name):
+        """Return `True` if the content generated by the macro only
+        depends on its arguments and on the wiki text containing it,
+        regardless of the request, the user and the state of the
+        environment.
+
+        This method is optional. The content of the cacheable macros
+        is kept in the cache of the rendered wiki pages, while the other
+        macros are expanded each time the page is viewed.
+
+        .. versionadded :: 1.3.4
+        """
+
+    def is_memoizable(name):
+        """Return `False` if the macro must be expanded for each of
+        its calls, even when it is called several times with the same
+        arguments and content in the same wiki text.
+
+        This method is optional. By default, the output of the identical
+        calls of a macro is computed only once while rendering a wiki
+        text, including the nested blocks of wiki text.
+
+        .. versionadded :: 1.3.4
+        """
+
     def expand_macro(formatter, name, content, args=None):
         """Called by the formatter when rendering the parsed wiki text.
 
@@ -245,6 +272,35 @@ def validate_page_name(pagename):
            all(part not in ('', '.', '..') for part in pagename.split('/'))
 
 
+class WikiPageNames(frozenset):
+    """Set of wiki page names, which are also kept sorted for retrieving
+    the names starting with a prefix.
+
+    >>> names = WikiPageNames(['WikiStart', 'Trac/Guide', 'Trac', 'Sandbox'])
+    >>> 'Trac' in names
+    True
+    >>> list(names.startswith('Trac'))
+    ['Trac', 'Trac/Guide']
+    >>> list(names.startswith('Trac/'))
+    ['Trac/Guide']
+
+    :since: 1.3.4
+    """
+
+    def __init__(self, names=()):
+        super(WikiPageNames, self).__init__()
+        self.sorted = sorted(self)
+
+    def startswith(self, prefix):
+        """Iterate over the sorted names starting with `prefix`."""
+        names = self.sorted
+        for idx in xrange(bisect_left(names, prefix), len(names)):
+            name = names[idx]
+            if not name.startswith(prefix):
+                break
+            yield name
+
+
 class WikiSystem(Component):
     """Wiki system manager."""
 
@@ -258,6 +314,23 @@ class WikiSystem(Component):
     START_PAGE = 'WikiStart'
     TITLE_INDEX_PAGE = 'TitleIndex'
 
+    history_snapshot_interval = IntOption('wiki',
+        'history_snapshot_interval', 0,
+        """Interval between the versions of the wiki pages which are
+        stored in full. The other versions are stored as compressed
+        differences to the next version, except for the latest version
+        which is always stored in full. Set to 0 to store all the
+        versions in full. The history saved before changing the
+        interval is converted by `trac-admin wiki compact`.
+        (''since 1.3.4'')""")
+
+    macro_time_budget = FloatOption('wiki', 'macro_time_budget', 0,
+        """Maximum time in seconds spent expanding each wiki macro
+        while processing a request. Once a macro has used its time, its
+        further calls in the request are replaced by an error message.
+        Set to 0 to disable the limit.
+        (''since 1.3.4'')""")
+
     ignore_missing_pages = BoolOption('wiki', 'ignore_missing_pages', 'false',
         """Enable/disable highlighting CamelCase links to missing pages.
         """)
@@ -290,28 +363,85 @@ class WikiSystem(Component):
 
         To make any origins safe, specify "*" in the list.""")
 
+    def __init__(self):
+        self._macro_stats = {}
+        self._macro_stats_lock = threading.Lock()
+
     @cached
     def pages(self):
-        """Return the names of all existing wiki pages."""
-        return {name for name,
-                     in self.env.db_query("SELECT DISTINCT name FROM wiki")}
+        """Return the names of all existing wiki pages, as a
+        `WikiPageNames` set.
+        """
+        return WikiPageNames(name for name, in self.env.db_query("""
+                             SELECT name FROM wiki_head"""))
 
     # Public API
 
     def get_pages(self, prefix=None):
-        """Iterate over the names of existing Wiki pages.
+        """Iterate over the names of existing Wiki pages, sorted by name.
 
         :param prefix: if given, only names that start with that
           prefix are included.
         """
-        for page in self.pages:
-            if not prefix or page.startswith(prefix):
-                yield page
+        return self.pages.startswith(prefix or '')
 
     def has_page(self, pagename):
         """Whether a page with the specified name exists."""
         return pagename.rstrip('/') in self.pages
 
+    def get_macro_stats(self, req=None):
+        """Return the `(name, calls, time, max_time)` of the wiki macros
+        expanded while processing `req`, or since the environment was
+        loaded, sorted by decreasing cumulative time.
+
+        :since: 1.3.4
+        """
+        if req is not None:
+            stats = getattr(req, '_macro_stats', {})
+        else:
+            with self._macro_stats_lock:
+                stats = dict((name, list(values))
+                             for name, values in self._macro_stats.iteritems())
+        return sorted(((name,) + tuple(values)
+                       for name, values in stats.iteritems()),
+                      key=lambda row: (-row[2], row[0]))
+
+    def reset_macro_stats(self):
+        """Forget the wiki macros expanded since the environment was
+        loaded.
+
+        :since: 1.3.4
+        """
+        with self._macro_stats_lock:
+            self._macro_stats.clear()
+
+    def record_macro_call(self, req, name, duration):
+        """Add a call of the wiki macro `name` which took `duration`
+        seconds to the statistics of `req` and of the environment.
+
+        :since: 1.3.4
+        """
+        self.log.debug("Wiki macro %s expanded in %.3f s", name, duration)
+        if req is not None:
+            stats = getattr(req, '_macro_stats', None)
+            if stats is None:
+                stats = req._macro_stats = {}
+            _add_macro_call(stats, name, duration)
+        with self._macro_stats_lock:
+            _add_macro_call(self._macro_stats, name, duration)
+
+    def is_macro_over_budget(self, req, name):
+        """Return `True` if the wiki macro `name` has used its time
+        budget (see `[wiki] macro_time_budget`) while processing `req`.
+
+        :since: 1.3.4
+        """
+        budget = self.macro_time_budget
+        if req is None or budget <= 0:
+            return False
+        values = getattr(req, '_macro_stats', {}).get(name)
+        return values is not None and values[1] >= budget
+
     def is_safe_origin(self, uri, req=None):
         return is_safe_origin(self.safe_origins, uri, req=req)
 
@@ -463,12 +593,13 @@ class WikiSystem(Component):
         referrer = referrer.split('/')
         if len(referrer) == 1:           # Non-hierarchical referrer
             return pagename
+        pages = self.pages
         # Test for pages with same name, higher in the hierarchy
         for i in xrange(len(referrer) - 1, 0, -1):
             name = '/'.join(referrer[:i]) + '/' + pagename
-            if self.has_page(name):
+            if name.rstrip('/') in pages:
                 return name
-        if self.has_page(pagename):
+        if pagename.rstrip('/') in pages:
             return pagename
         # If we are on First/Second/Third, and pagename is Second/Other,
         # resolve to First/Second/Other instead of First/Second/Second/Other
@@ -478,7 +609,7 @@ class WikiSystem(Component):
             for (i, part) in enumerate(referrer):
                 if first == part:
                     anchor = '/'.join(referrer[:i + 1])
-                    if self.has_page(anchor):
+                    if anchor in pages:
                         return anchor + '/' + rest
         # Assume the user wants a sibling of referrer
         return '/'.join(referrer[:-1]) + '/' + pagename
@@ -530,3 +661,13 @@ class WikiSystem(Component):
         return bool(self.env.db_query(
             "SELECT name FROM wiki WHERE name=%s AND version=%s",
             (resource.id, resource.version)))
+
+
+def _add_macro_call(stats, name, duration):
+    values = stats.get(name)
+    if values is None:
+        stats[name] = [1, duration, duration]
+    else:
+        values[0] += 1
+        values[1] += duration
+        values[2] = max(values[2], duration)
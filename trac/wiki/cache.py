@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import hashlib
+import io
+import json
+import re
+import threading
+from datetime import datetime
+
+from trac.cache import cached
+from trac.config import IntOption
+from trac.core import *
+from trac.util.compat import OrderedDict
+from trac.util.datefmt import to_utimestamp, utc
+from trac.util.html import Markup
+from trac.util.presentation import to_json
+from trac.util.text import to_unicode
+from trac.wiki.api import IWikiChangeListener
+from trac.wiki.formatter import Formatter, MacroPlaceholders, WikiProcessor
+from trac.wiki.parser import WikiParser
+
+__all__ = ['WikiRenderingCache']
+
+
+class WikiRenderingCache(Component):
+    """Keep the rendered wiki pages in the `wiki_render_cache` table.
+
+    The output of the macros and processors which aren't cacheable
+    (see `IWikiMacroProvider.is_cacheable`) is not kept in the cache:
+    placeholders are stored instead and they are expanded each time the
+    page is viewed.
+
+    The cache is keyed by the page name, version and text, by the
+    rendering hints, by the base URL and locale of the request and by
+    the user, as the rendering of the links depends on the permissions.
+
+    The pages are rendered block by block, and the rendered blocks are
+    also kept in memory, so that only the modified blocks of a page are
+    rendered again when the page is modified or previewed.
+    """
+
+    implements(IWikiChangeListener)
+
+    render_cache_size = IntOption('wiki', 'render_cache_size', 0,
+        """Maximum size in bytes of the rendered wiki pages kept in the
+        database. When the cache is full, the pages which were rendered
+        first are evicted. The cached pages are only rendered again when
+        wiki pages are added, renamed or deleted, so the links to the
+        other resources, like tickets and milestones, keep their state
+        and the permissions of the time they were rendered. Set to 0 to
+        disable the cache. (''since 1.3.4'')""")
+
+    render_block_cache_size = IntOption('wiki', 'render_block_cache_size', 0,
+        """Maximum number of rendered blocks of wiki text (paragraphs,
+        lists, tables, code blocks, ...) kept in memory, so that only
+        the modified blocks are rendered again when a page is modified
+        or previewed. Like the pages cached by `render_cache_size`, the
+        blocks are only rendered again when wiki pages are added,
+        renamed or deleted. Set to 0 to disable the cache.
+        (''since 1.3.4'')""")
+
+    _heading_re = re.compile(r'^\s*=', re.MULTILINE)
+    _macro_re = re.compile(r'\[\[([\w/+-]+)')
+
+    def __init__(self):
+        self._block_cache_lock = threading.Lock()
+        self._size_lock = threading.Lock()
+        # Estimated size of the rendered pages in the database
+        self._total_size = None
+
+    def render(self, context, page, text):
+        """Return the wiki `text` of `page` rendered as HTML in
+        `context`, from the cache if possible.
+        """
+        if self.render_cache_size <= 0:
+            return self.render_blocks(context, text)
+        key = self._get_key(context, page.name, page.version, text)
+        for html, calls in self.env.db_query("""
+                SELECT html, macros FROM wiki_render_cache WHERE hash=%s
+                """, (key,)):
+            token, calls = json.loads(calls)
+            placeholders = MacroPlaceholders(token, [tuple(call)
+                                                     for call in calls])
+            break
+        else:
+            placeholders = MacroPlaceholders()
+            html = self._render_blocks(context, text, placeholders)
+            self._store(key, page, html, placeholders)
+        formatter = Formatter(self.env, context)
+        formatter.reset(text)
+        return placeholders.expand(formatter, html)
+
+    def render_blocks(self, context, text):
+        """Return the wiki `text` rendered as HTML in `context`, reusing
+        the rendered blocks of text which are in the cache.
+
+        The result is the same as `format_to_html(env, context, text)`.
+        """
+        if not text:
+            return Markup()
+        placeholders = MacroPlaceholders()
+        html = self._render_blocks(context, text, placeholders)
+        formatter = Formatter(self.env, context)
+        formatter.reset(text)
+        return placeholders.expand(formatter, html)
+
+    def clear(self, name=None):
+        """Remove the rendered versions of the page `name`, or of all
+        the pages, from the cache.
+        """
+        with self.env.db_transaction as db:
+            if name is None:
+                db("DELETE FROM wiki_render_cache")
+                del self._block_cache
+            else:
+                db("DELETE FROM wiki_render_cache WHERE name=%s", (name,))
+        with self._size_lock:
+            self._total_size = None
+
+    # IWikiChangeListener methods
+
+    # The existence of the pages changes the rendering of the links
+    # to them, in any page.
+
+    def wiki_page_added(self, page):
+        self.clear()
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        pass
+
+    def wiki_page_deleted(self, page):
+        self.clear()
+
+    def wiki_page_version_deleted(self, page):
+        self.clear(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self.clear()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    @cached
+    def _block_cache(self):
+        """Map the keys of the blocks of wiki text to their rendered
+        `(html, token, calls, anchors)`, in least recently used order.
+        """
+        return OrderedDict()
+
+    def _render_blocks(self, context, text, placeholders):
+        """Render the wiki `text` block by block, and return the HTML
+        with the calls of the macros which can't be cached replaced by
+        `placeholders`.
+        """
+        if self.render_block_cache_size <= 0:
+            ctx = context.child()
+            ctx.set_hints(macro_placeholders=placeholders)
+            out = io.StringIO()
+            Formatter(self.env, ctx).format(
+                text, out, context.get_hint('preserve_newlines', False))
+            return out.getvalue()
+
+        text = re.sub(Formatter._normalize_re, ' ', text)
+        context_key = self._get_key(context, context.resource.realm,
+                                    context.resource.id)
+        text_key = None
+        cacheable_macros = {}
+        anchors = {}
+        cache = self._block_cache
+        out = []
+        for block in self._split_blocks(text):
+            values = [context_key, block]
+            # The anchors of the headings must be unique in the page
+            if self._heading_re.search(block):
+                values.append(sorted(anchors))
+            # The cacheable macros may depend on the whole text
+            if self._has_cacheable_macro(context, block, cacheable_macros):
+                if text_key is None:
+                    text_key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                values.append(text_key)
+            key = self._hash(values)
+            with self._block_cache_lock:
+                entry = cache.pop(key, None)
+                if entry is not None:
+                    cache[key] = entry
+            if entry is None:
+                entry = self._render_block(context, text, block, anchors)
+                with self._block_cache_lock:
+                    cache[key] = entry
+                    while len(cache) > self.render_block_cache_size:
+                        cache.popitem(last=False)
+            html, token, calls, block_anchors = entry
+            anchors.update(dict.fromkeys(block_anchors, True))
+            if calls:
+                # Renumber the placeholders of the block in the page
+                html = re.sub(r'<!--%s:(\d+)-->' % token,
+                              lambda m: placeholders.add(
+                                  *calls[int(m.group(1))]),
+                              html)
+            out.append(html)
+        return u''.join(out)
+
+    def _render_block(self, context, text, block, anchors):
+        placeholders = MacroPlaceholders()
+        ctx = context.child()
+        ctx.set_hints(macro_placeholders=placeholders)
+        formatter = _BlockFormatter(self.env, ctx, text)
+        formatter._anchors = dict(anchors)
+        out = io.StringIO()
+        formatter.format(block, out,
+                         context.get_hint('preserve_newlines', False))
+        block_anchors = [anchor for anchor in formatter._anchors
+                         if anchor not in anchors]
+        return (out.getvalue(), placeholders.token,
+                tuple(placeholders.calls), block_anchors)
+
+    def _split_blocks(self, text):
+        """Split the wiki text at the empty lines which end all the
+        open elements, i.e. outside of the code blocks and before a
+        line which isn't indented.
+        """
+        blocks = []
+        lines = []
+        depth = 0
+        for line in text.splitlines():
+            if depth:
+                if WikiParser.ENDBLOCK not in line and \
+                        WikiParser._startblock_re.match(line):
+                    depth += 1
+                elif line.strip() == WikiParser.ENDBLOCK:
+                    depth -= 1
+            elif line:
+                if lines and not lines[-1] and line[0] not in ' \t':
+                    blocks.append('\n'.join(lines))
+                    lines = []
+                if WikiParser.ENDBLOCK not in line and \
+                        not line.strip().startswith('>') and \
+                        WikiParser._startblock_re.match(line):
+                    depth = 1
+            lines.append(line)
+        if lines:
+            blocks.append('\n'.join(lines))
+        return blocks
+
+    def _has_cacheable_macro(self, context, block, cacheable_macros):
+        names = set(self._macro_re.findall(block))
+        if WikiParser.STARTBLOCK in block or '#!' in block:
+            for line in block.splitlines():
+                match = WikiParser._startblock_re.match(line) or \
+                        WikiParser._processor_re.match(line)
+                if match and match.group(2):
+                    names.add(match.group(2))
+        formatter = None
+        for name in names:
+            if name not in cacheable_macros:
+                if formatter is None:
+                    formatter = Formatter(self.env, context)
+                try:
+                    processor = WikiProcessor(formatter, name)
+                except TracError:
+                    cacheable = False
+                else:
+                    cacheable = bool(processor.macro_provider and
+                                     processor.is_cacheable())
+                cacheable_macros[name] = cacheable
+            if cacheable_macros[name]:
+                return True
+        return False
+
+    def _get_key(self, context, *values):
+        req = getattr(context, 'req', None)
+        hints = context._hints
+        if hints is None:
+            hints = context._parent_hints() or {}
+        hints = [(name, value) for name, value in hints.iteritems()
+                 if name != 'macro_memo']
+        return self._hash(values + (sorted(hints),
+                                    context.href.base, req and req.locale,
+                                    context.perm and context.perm.username))
+
+    def _hash(self, values):
+        hasher = hashlib.sha1()
+        for value in values:
+            hasher.update(to_unicode(value).encode('utf-8'))
+            hasher.update('\0')
+        return hasher.hexdigest()
+
+    def _store(self, key, page, html, placeholders):
+        macros = to_json([placeholders.token, placeholders.calls])
+        size = len(html) + len(macros)
+        if size > self.render_cache_size:
+            return
+        with self.env.db_transaction as db:
+            db("DELETE FROM wiki_render_cache WHERE hash=%s", (key,))
+            db("""INSERT INTO wiki_render_cache
+                  (hash, name, version, time, size, html, macros)
+                  VALUES (%s,%s,%s,%s,%s,%s,%s)
+                  """, (key, page.name, page.version,
+                        to_utimestamp(datetime.now(utc)), size, html,
+                        macros))
+            # The sizes are only summed again when the estimated total
+            # exceeds the maximum, and the cache is then reduced to 90%
+            # of the maximum.
+            with self._size_lock:
+                if self._total_size is None:
+                    self._total_size = 0
+                    for total, in db("""
+                            SELECT SUM(size) FROM wiki_render_cache"""):
+                        self._total_size = total or 0
+                else:
+                    self._total_size += size
+                if self._total_size <= self.render_cache_size:
+                    return
+            target = self.render_cache_size * 9 // 10
+            total = 0
+            evicted = []
+            for hash_, size in db("""
+                    SELECT hash, size FROM wiki_render_cache
+                    ORDER BY time DESC"""):
+                if evicted or total and total + size > target:
+                    evicted.append(hash_)
+                else:
+                    total += size
+            db.executemany("DELETE FROM wiki_render_cache WHERE hash=%s",
+                           [(hash_,) for hash_ in evicted])
+            with self._size_lock:
+                self._total_size = total
+
+
+class _BlockFormatter(Formatter):
+    """Formatter of a block of a wiki text, for which the `source`
+    seen by the macros is the whole text.
+    """
+
+    def __init__(self, env, context, source):
+        Formatter.__init__(self, env, context)
+        self._source = source
+
+    def reset(self, source, out=None):
+        block = Formatter.reset(self, source, out)
+        self.source = self._source
+        return block
@@ -21,11 +21,12 @@
 from HTMLParser import HTMLParseError
 import io
 import re
+import time
 
 from trac.core import *
 from trac.mimeview import *
 from trac.resource import get_relative_resource, get_resource_url
-from trac.util import arity, as_int
+from trac.util import arity, as_int, hex_entropy
 from trac.util.text import (
     exception_to_unicode, shorten_line, to_unicode, unicode_quote,
     unquote_label
@@ -38,7 +39,7 @@ from trac.util.translation import _, tag_
 from trac.wiki.api import WikiSystem, parse_args
 from trac.wiki.parser import WikiParser, parse_processor_args
 
-__all__ = ['Formatter', 'MacroError', 'ProcessorError',
+__all__ = ['Formatter', 'MacroError', 'MacroPlaceholders', 'ProcessorError',
            'concat_path_query_fragment', 'extract_link', 'format_to',
            'format_to_html', 'format_to_oneliner',
            'split_url_into_path_query_fragment', 'wiki_to_outline']
@@ -128,6 +129,40 @@ class ProcessorError(TracError):
     pass
 
 
+class MacroPlaceholders(object):
+    """Record the calls of the request-dependent macros and processors,
+    which are replaced by placeholders in the formatted wiki text.
+
+    The formatters use it when it is set as the `macro_placeholders`
+    hint of the rendering context. The calls are later expanded in the
+    actual rendering context by `expand`, so that the formatted wiki
+    text can be cached.
+
+    :since: 1.3.4
+    """
+
+    def __init__(self, token=None, calls=None):
+        self.token = token or hex_entropy(16)
+        self.calls = calls if calls is not None else []
+
+    def add(self, *call):
+        """Record a call and return its placeholder."""
+        self.calls.append(call)
+        return u'<!--%s:%d-->' % (self.token, len(self.calls) - 1)
+
+    def expand(self, formatter, html):
+        """Replace the placeholders in `html` by the output of the calls,
+        expanded by `formatter`.
+        """
+        if not self.calls:
+            return Markup(html)
+        def expand_call(match):
+            return _markup_to_unicode(
+                formatter.expand_call(*self.calls[int(match.group(1))]))
+        return Markup(re.sub(r'<!--%s:(\d+)-->' % self.token, expand_call,
+                             html))
+
+
 class WikiProcessor(object):
 
     _code_block_re = re.compile('^<div(?:\s+class="([^"]+)")?>(.*)</div>$')
@@ -385,10 +420,61 @@ class WikiProcessor(object):
             text = system_message(tag_("Error: Failed to load processor "
                                        "%(name)s", name=tag.code(self.name)),
                                   self.error)
+        elif self.macro_provider:
+            text = self._process_macro(text)
         else:
             text = self.processor(text)
         return text or ''
 
+    def _process_macro(self, text):
+        if not self.is_memoizable():
+            return self._expand_macro(text)
+        resource = self.formatter.resource
+        key = ('macro', self.name, text,
+               tuple(sorted(self.args.iteritems()))
+               if self.args is not None else None,
+               resource and (resource.realm, resource.id, resource.version))
+        return self.formatter.memoize(key, self._expand_macro, text)
+
+    def _expand_macro(self, text):
+        wiki = self.formatter.wiki
+        req = self.formatter.req
+        if wiki.is_macro_over_budget(req, self.name):
+            return system_message(
+                _("Macro %(name)s skipped", name=self.name),
+                _("The macro exceeded its time budget of %(budget)s "
+                  "seconds for the request.",
+                  budget=wiki.macro_time_budget))
+        start = time.time()
+        try:
+            return self.processor(text)
+        finally:
+            wiki.record_macro_call(req, self.name, time.time() - start)
+
+    def is_cacheable(self):
+        """Return `True` if the output of the processor only depends on
+        its arguments and content.
+
+        (''since 1.3.4'')
+        """
+        if self.error:
+            return False
+        if not self.macro_provider:
+            return True
+        is_cacheable = getattr(self.macro_provider, 'is_cacheable', None)
+        return bool(is_cacheable and is_cacheable(self.name))
+
+    def is_memoizable(self):
+        """Return `True` if the output of the identical calls of the
+        macro in a rendered wiki text can be computed only once.
+
+        (''since 1.3.4'')
+        """
+        if not self.macro_provider:
+            return False
+        is_memoizable = getattr(self.macro_provider, 'is_memoizable', None)
+        return not is_memoizable or bool(is_memoizable(self.name))
+
     def is_inline(self, text):
         if callable(self.inline_check):
             return self.inline_check(text)
@@ -438,6 +524,9 @@ class Formatter(object):
         self.env = env
         self.context = context.child()
         self.context.set_hints(disable_warnings=True)
+        if context.get_hint('macro_memo') is None:
+            # Shared with the nested formatters
+            self.context.set_hints(macro_memo={})
         self.req = context.req
         self.href = context.href
         self.resource = context.resource
@@ -812,6 +901,12 @@ class Formatter(object):
         in_paragraph = not (getattr(self, 'in_list_item', True) or
                             getattr(self, 'in_table', True) or
                             getattr(self, 'in_def_list', True))
+        placeholders = self.context.get_hint('macro_placeholders')
+        if placeholders and not macro.is_cacheable():
+            return placeholders.add('macro', macro.name, args, in_paragraph)
+        return self._expand_macro(macro, name, args, in_paragraph)
+
+    def _expand_macro(self, macro, name, args, in_paragraph):
         try:
             return macro.ensure_inline(macro.process(args), in_paragraph)
         except MacroError as e:
@@ -1216,6 +1311,10 @@ class Formatter(object):
             self.handle_code_block(WikiParser.ENDBLOCK)
 
     def _exec_processor(self, processor, text):
+        placeholders = self.context.get_hint('macro_placeholders')
+        if placeholders and not processor.is_cacheable():
+            return placeholders.add('processor', processor.name,
+                                    processor.args, text)
         try:
             return processor.process(text)
         except ProcessorError as e:
@@ -1280,6 +1379,38 @@ class Formatter(object):
 
     _normalize_re = re.compile(r'[\v\f]', re.UNICODE)
 
+    def expand_call(self, kind, name, args, extra):
+        """Expand a call recorded by `MacroPlaceholders`.
+
+        `extra` is whether the macro is in a paragraph for a `'macro'`
+        call, and the content of the processor for a `'processor'` call.
+
+        (''since 1.3.4'')
+        """
+        if kind == 'macro':
+            return self._expand_macro(WikiProcessor(self, name), name, args,
+                                      extra)
+        else:
+            return self._exec_processor(WikiProcessor(self, name, args),
+                                        extra)
+
+    def memoize(self, key, func, *args):
+        """Return the result of `func(*args)`, which is computed only
+        once for `key` while rendering the wiki text, including its
+        nested blocks.
+
+        The macros can use it for sharing the data they fetch between
+        their calls.
+
+        (''since 1.3.4'')
+        """
+        memo = self.context.get_hint('macro_memo')
+        if memo is None:
+            return func(*args)
+        if key not in memo:
+            memo[key] = func(*args)
+        return memo[key]
+
     def reset(self, source, out=None):
         if isinstance(source, basestring):
             source = re.sub(self._normalize_re, ' ', source)
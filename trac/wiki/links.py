@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import io
+
+from trac.admin import IAdminCommandProvider
+from trac.core import *
+from trac.mimeview.api import RenderingContext
+from trac.resource import Resource, get_resource_name, get_resource_url
+from trac.ticket.api import ITicketChangeListener
+from trac.util.datefmt import utc
+from trac.util.html import tag
+from trac.util.text import print_table, printout
+from trac.util.translation import _, cleandoc_
+from trac.web.href import Href
+from trac.wiki.api import IWikiChangeListener, WikiSystem
+from trac.wiki.formatter import Formatter, MacroPlaceholders
+from trac.wiki.macros import WikiMacroBase
+
+__all__ = ['WikiLinkGraph']
+
+
+class WikiLinkGraph(Component):
+    """Maintain the `wiki_link` table of the links from the wiki pages,
+    ticket descriptions and ticket comments to the wiki pages, tickets
+    and milestones.
+
+    The links are extracted with the wiki formatting rules, so the
+    table answers which resources link to a page, and which links
+    point to missing pages, without rendering the whole wiki.
+    """
+
+    implements(IAdminCommandProvider, ITicketChangeListener,
+               IWikiChangeListener)
+
+    #: The realms of the resources which are link targets
+    target_realms = ('milestone', 'ticket', 'wiki')
+
+    def get_backlinks(self, realm, id):
+        """Return the `(realm, id)` of the wiki pages and tickets which
+        link to the resource, sorted by realm and id.
+        """
+        return sorted(self.env.db_query("""
+            SELECT source_realm, source_id FROM wiki_link
+            WHERE target_realm=%s AND target_id=%s
+            """, (realm, unicode(id))), key=_sort_key)
+
+    def get_links(self, realm, id):
+        """Return the `(realm, id)` of the resources targeted by the
+        links of a wiki page or ticket, sorted by realm and id.
+        """
+        return sorted(self.env.db_query("""
+            SELECT target_realm, target_id FROM wiki_link
+            WHERE source_realm=%s AND source_id=%s
+            """, (realm, unicode(id))), key=_sort_key)
+
+    def get_missing_pages(self):
+        """Return the `(name, realm, id)` of the links to wiki pages
+        which don't exist, with the realm and id of the linking wiki
+        page or ticket.
+        """
+        return sorted(self.env.db_query("""
+            SELECT l.target_id, l.source_realm, l.source_id
+            FROM wiki_link l
+            LEFT OUTER JOIN wiki_head h ON h.name=l.target_id
+            WHERE l.target_realm='wiki' AND h.name IS NULL
+            """), key=lambda row: (row[0], _sort_key(row[1:])))
+
+    def extract_links(self, resource, text):
+        """Return the set of the `(realm, id)` of the resources targeted
+        by the links in the wiki `text` of `resource`.
+
+        The macros and the code blocks are not expanded.
+        """
+        links = set()
+        if text:
+            href = _LinkHref(links)
+            perm = _LinkPermission()
+            context = RenderingContext(resource, href=href, perm=perm)
+            # The link resolvers use the request, e.g. for the permissions
+            context.req = _LinkRequest(href, perm)
+            context.set_hints(macro_placeholders=MacroPlaceholders())
+            _LinkFormatter(self.env, context).format(text, io.StringIO())
+        return set((realm, id_) for realm, id_ in links
+                   if (realm, id_) != (resource.realm, unicode(resource.id)))
+
+    def update_links(self, realm, id, texts, replace=True):
+        """Store the links of the wiki `texts` of a wiki page or ticket.
+
+        The previous links of the resource are removed, unless `replace`
+        is `False`.
+        """
+        resource = Resource(realm, id)
+        links = set()
+        for text in texts:
+            links |= self.extract_links(resource, text)
+        id = unicode(id)
+        with self.env.db_transaction as db:
+            if replace:
+                db("""DELETE FROM wiki_link
+                      WHERE source_realm=%s AND source_id=%s
+                      """, (realm, id))
+            else:
+                links -= set(self.get_links(realm, id))
+            db.executemany("""
+                INSERT INTO wiki_link
+                 (source_realm, source_id, target_realm, target_id)
+                VALUES (%s,%s,%s,%s)
+                """, [(realm, id) + link for link in sorted(links)])
+
+    def remove_links(self, realm, id):
+        """Remove the links of a wiki page or ticket."""
+        self.env.db_transaction("""
+            DELETE FROM wiki_link WHERE source_realm=%s AND source_id=%s
+            """, (realm, unicode(id)))
+
+    def rebuild(self):
+        """Extract the links of all the wiki pages and tickets again, and
+        return the number of wiki pages and tickets.
+        """
+        count = 0
+        with self.env.db_transaction as db:
+            db("DELETE FROM wiki_link")
+            for name, text in db("""
+                    SELECT w.name, w.text FROM wiki w, wiki_head h
+                    WHERE w.name=h.name AND w.version=h.version"""):
+                self.update_links('wiki', name, [text], replace=False)
+                count += 1
+            for id_, in db("SELECT id FROM ticket ORDER BY id"):
+                self._update_ticket_links(id_)
+                count += 1
+        return count
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('wiki backlinks', '<page>',
+               'List the wiki pages and tickets linking to a wiki page',
+               self._complete_page, self._do_backlinks)
+        yield ('wiki missing', '',
+               'List the links to missing wiki pages',
+               None, self._do_missing)
+        yield ('wiki relink', '',
+               """Rebuild the table of the links between the resources
+
+               The links are otherwise maintained when the wiki pages
+               and tickets are modified.
+               """,
+               None, self._do_relink)
+
+    def _complete_page(self, args):
+        if len(args) == 1:
+            return list(WikiSystem(self.env).get_pages())
+
+    def _do_backlinks(self, name):
+        print_table(self.get_backlinks('wiki', name),
+                    [_('Realm'), _('Id')])
+
+    def _do_missing(self):
+        print_table(self.get_missing_pages(),
+                    [_('Page'), _('Realm'), _('Id')])
+
+    def _do_relink(self):
+        count = self.rebuild()
+        printout(_("Links of %(count)s resource(s) extracted.",
+                   count=count))
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.update_links('ticket', ticket.id, [ticket['description']])
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        if 'description' in old_values:
+            self._update_ticket_links(ticket.id)
+        elif comment:
+            self.update_links('ticket', ticket.id, [comment], replace=False)
+
+    def ticket_deleted(self, ticket):
+        self.remove_links('ticket', ticket.id)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._update_ticket_links(ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._update_ticket_links(ticket.id)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self.update_links('wiki', page.name, [page.text])
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self.update_links('wiki', page.name, [page.text])
+
+    def wiki_page_deleted(self, page):
+        self.remove_links('wiki', page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._update_page_links(page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        with self.env.db_transaction:
+            self.remove_links('wiki', old_name)
+            self._update_page_links(page.name)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Internal methods
+
+    def _update_page_links(self, name):
+        for text, in self.env.db_query("""
+                SELECT w.text FROM wiki w, wiki_head h
+                WHERE w.name=h.name AND w.version=h.version AND w.name=%s
+                """, (name,)):
+            self.update_links('wiki', name, [text])
+
+    def _update_ticket_links(self, id):
+        with self.env.db_query as db:
+            texts = [text for text, in db("""
+                SELECT description FROM ticket WHERE id=%s
+                UNION ALL
+                SELECT newvalue FROM ticket_change
+                WHERE ticket=%s AND field='comment'
+                """, (id, id))]
+        self.update_links('ticket', id, texts)
+
+
+class BackLinksMacro(WikiMacroBase):
+    _domain = 'messages'
+    _description = cleandoc_(
+    """List the wiki pages and tickets which link to a wiki page.
+
+    The name of the wiki page can be given as argument. Without
+    argument, the links to the current wiki page or ticket are listed,
+    e.g. `[[BackLinks]]` or `[[BackLinks(WikiStart)]]`.
+    (''since 1.3.4'')
+    """)
+
+    _actions = {'ticket': 'TICKET_VIEW', 'wiki': 'WIKI_VIEW'}
+
+    def expand_macro(self, formatter, name, content):
+        name = content.strip() if content else None
+        if name:
+            realm, id = 'wiki', name.strip('/')
+        else:
+            realm, id = formatter.resource.realm, formatter.resource.id
+        items = []
+        for source_realm, source_id in \
+                WikiLinkGraph(self.env).get_backlinks(realm, id):
+            resource = Resource(source_realm, source_id)
+            action = self._actions.get(source_realm)
+            if action and action in formatter.perm(resource):
+                items.append(tag.li(tag.a(
+                    get_resource_name(self.env, resource),
+                    href=get_resource_url(self.env, resource,
+                                          formatter.href))))
+        return tag.ul(items, class_='backlinks')
+
+
+def _sort_key(row):
+    realm, id_ = row
+    return realm, int(id_) if realm == 'ticket' and id_.isdigit() else id_
+
+
+class _LinkFormatter(Formatter):
+    """Formatter which skips the processors rendering code blocks and
+    the wiki macros.
+    """
+
+    def _macro_formatter(self, match, fullmatch, macro, only_inline=False):
+        return ''
+
+    def _exec_processor(self, processor, text):
+        if processor.macro_provider or \
+                processor.processor == processor._mimeview_processor:
+            return ''
+        return Formatter._exec_processor(self, processor, text)
+
+
+class _LinkHref(Href):
+    """Href which records the resources of the URLs it builds."""
+
+    def __init__(self, links):
+        Href.__init__(self, '')
+        self.links = links
+
+    def __call__(self, *args, **kw):
+        if len(args) > 1 and args[0] in WikiLinkGraph.target_realms and \
+                args[1] is not None:
+            self.links.add((args[0], unicode(args[1])))
+        return Href.__call__(self, *args, **kw)
+
+
+class _LinkPermission(object):
+    """Permission cache granting all the permissions, so that the
+    links are rendered regardless of the permissions of the users.
+    """
+
+    username = 'anonymous'
+
+    def __call__(self, realm_or_resource, id=False, version=False):
+        return self
+
+    def has_permission(self, action, realm_or_resource=None, id=False,
+                       version=False):
+        return True
+    __contains__ = has_permission
+
+    def require(self, action, realm_or_resource=None, id=False,
+                version=False, message=None):
+        pass
+    assert_permission = require
+
+
+class _LinkRequest(object):
+    """Request passed to the link resolvers while extracting the links,
+    which builds the URLs with the `_LinkHref`.
+    """
+
+    authname = 'anonymous'
+    locale = None
+    lc_time = 'iso8601'
+    tz = utc
+
+    def __init__(self, href, perm):
+        self.href = self.abs_href = href
+        self.perm = perm
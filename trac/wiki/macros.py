@@ -153,11 +153,11 @@ class TitleIndexMacro(WikiMacroBase):
         else:
             omitprefix = lambda page: page
 
-        pages = sorted(page for page in wiki.get_pages(prefix)
-                       if (depth < 0 or depth >= page.count('/') - start)
-                       and 'WIKI_VIEW' in formatter.perm('wiki', page)
-                       and any(fnmatchcase(page, inc) for inc in includes)
-                       and not any(fnmatchcase(page, exc) for exc in excludes))
+        pages = [page for page in wiki.get_pages(prefix)
+                 if (depth < 0 or depth >= page.count('/') - start)
+                 and 'WIKI_VIEW' in formatter.perm('wiki', page)
+                 and any(fnmatchcase(page, inc) for inc in includes)
+                 and not any(fnmatchcase(page, exc) for exc in excludes)]
 
         if format == 'compact':
             return tag(
@@ -343,14 +343,13 @@ class RecentChangesMacro(WikiMacroBase):
         limit = _arg_as_int(args[1].strip(), min=1) if len(args) > 1 else None
         group = kw.get('group', 'date')
 
-        sql = """SELECT name, max(version) AS max_version,
-                        max(time) AS max_time FROM wiki"""
+        sql = "SELECT name, version, time FROM wiki_head"
         args = []
         if prefix:
             with self.env.db_query as db:
                 sql += " WHERE name %s" % db.prefix_match()
                 args.append(db.prefix_match_value(prefix))
-        sql += " GROUP BY name ORDER BY max_time DESC"
+        sql += " ORDER BY time DESC"
         if limit:
             sql += " LIMIT %s"
             args.append(limit)
@@ -457,6 +456,13 @@ class PageOutlineMacro(WikiMacroBase):
             outline = tag.div(outline, class_='wiki-toc-un')
         return outline
 
+    def is_cacheable(self, name):
+        return True
+
+    def is_memoizable(self, name):
+        # The outline depends on the formatted block of wiki text
+        return False
+
 
 class ImageMacro(WikiMacroBase):
     _domain = 'messages'
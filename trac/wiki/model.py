@@ -16,6 +16,11 @@
 # Author: Jonas Borgström <jonas@edgewall.com>
 #         Christopher Lenz <cmlenz@gmx.de>
 
+import base64
+import json
+import zlib
+from difflib import SequenceMatcher
+
 from trac.core import *
 from trac.resource import Resource
 from trac.util.datefmt import datetime_now, from_utimestamp, to_utimestamp, utc
@@ -88,6 +93,10 @@ class WikiPage(object):
             self.version = int(version)
             self.author = author
             self.time = from_utimestamp(time)
+            if text is None:
+                # The version may be stored as a delta (never the latest)
+                with self.env.db_query as db:
+                    text = _get_text(db, name, self.version)
             self.text = text
             self.comment = comment
             self.readonly = int(readonly) if readonly else 0
@@ -117,13 +126,26 @@ class WikiPage(object):
             if version is None:
                 # Delete a wiki page completely
                 db("DELETE FROM wiki WHERE name=%s", (self.name,))
+                db("DELETE FROM wiki_delta WHERE name=%s", (self.name,))
                 self.env.log.info("Deleted page %s", self.name)
             else:
-                # Delete only a specific page version
+                # Delete only a specific page version, the previous
+                # version can no longer be a delta to it
+                for prev_version, in db("""
+                        SELECT version FROM wiki_delta
+                        WHERE name=%s AND version=(
+                            SELECT max(version) FROM wiki
+                            WHERE name=%s AND version<%s)
+                        """, (self.name, self.name, version)):
+                    _store_full(db, self.name, prev_version,
+                                _get_text(db, self.name, prev_version))
                 db("DELETE FROM wiki WHERE name=%s and version=%s",
                    (self.name, version))
+                db("DELETE FROM wiki_delta WHERE name=%s and version=%s",
+                   (self.name, version))
                 self.env.log.info("Deleted version %d of page %s", version,
                                   self.name)
+            self.update_head(self.env, self.name)
 
             if version is None or version == self.version:
                 self._fetch(self.name, None)
@@ -163,6 +185,14 @@ class WikiPage(object):
                       """, (self.name, self.version + 1, to_utimestamp(t),
                             author, self.text, comment, self.readonly))
                 self.version += 1
+                self.update_head(self.env, self.name)
+                prev_version = self.version - 1
+                if _is_delta(self.env, prev_version):
+                    for prev_text, in db("""
+                            SELECT text FROM wiki WHERE name=%s AND version=%s
+                            """, (self.name, prev_version)):
+                        _store_delta(db, self.name, prev_version,
+                                     _encode_delta(self.text, prev_text))
             else:
                 db("UPDATE wiki SET readonly=%s WHERE name=%s",
                    (self.readonly, self.name))
@@ -205,6 +235,10 @@ class WikiPage(object):
                                   name=new_name))
 
             db("UPDATE wiki SET name=%s WHERE name=%s", (new_name, old_name))
+            db("UPDATE wiki_head SET name=%s WHERE name=%s",
+               (new_name, old_name))
+            db("UPDATE wiki_delta SET name=%s WHERE name=%s",
+               (new_name, old_name))
             # Invalidate page name cache
             del WikiSystem(self.env).pages
             # Reparent attachments
@@ -238,14 +272,168 @@ class WikiPage(object):
             if hasattr(listener, 'wiki_page_comment_modified'):
                 listener.wiki_page_comment_modified(self, old_comment)
 
-    def get_history(self):
-        """Retrieve the edit history of a wiki page.
+    @classmethod
+    def update_head(cls, env, name):
+        """Update the latest version of the page `name` in the
+        `wiki_head` table, after the versions of the page have been
+        modified in the `wiki` table.
 
+        :since: 1.3.4
+        """
+        with env.db_transaction as db:
+            db("DELETE FROM wiki_head WHERE name=%s", (name,))
+            db("""INSERT INTO wiki_head (name, version, time, author)
+                  SELECT name, version, time, author FROM wiki
+                  WHERE name=%s ORDER BY version DESC LIMIT 1
+                  """, (name,))
+
+    @classmethod
+    def replace_text(cls, env, name, text):
+        """Replace the text of the latest version of the page `name`,
+        without creating a new version.
+
+        :since: 1.3.4
+        """
+        with env.db_transaction as db:
+            versions = [version for version, in db("""
+                SELECT version FROM wiki WHERE name=%s
+                ORDER BY version DESC LIMIT 2""", (name,))]
+            if not versions:
+                return
+            prev_text = None
+            if len(versions) > 1 and db("""
+                    SELECT version FROM wiki_delta WHERE name=%s AND version=%s
+                    """, (name, versions[1])):
+                prev_text = _get_text(db, name, versions[1])
+            db("UPDATE wiki SET text=%s WHERE name=%s AND version=%s",
+               (text, name, versions[0]))
+            if prev_text is not None:
+                _store_delta(db, name, versions[1],
+                             _encode_delta(text, prev_text))
+
+    @classmethod
+    def compact(cls, env, name, interval=None):
+        """Store the versions of the page `name` in full or as deltas,
+        according to the snapshot `interval`, by default
+        `[wiki] history_snapshot_interval`.
+
+        :return: the number of versions converted.
+        :since: 1.3.4
+        """
+        if interval is None:
+            interval = WikiSystem(env).history_snapshot_interval
+        count = 0
+        with env.db_transaction as db:
+            next_text = None
+            for idx, (version, text, data) in enumerate(db("""
+                    SELECT w.version, w.text, d.data FROM wiki w
+                    LEFT OUTER JOIN wiki_delta d
+                     ON (d.name=w.name AND d.version=w.version)
+                    WHERE w.name=%s ORDER BY w.version DESC
+                    """, (name,))):
+                if data is not None:
+                    text = _decode_delta(next_text, data)
+                is_delta = idx > 0 and interval > 1 and version % interval
+                if is_delta and data is None:
+                    _store_delta(db, name, version,
+                                 _encode_delta(next_text, text))
+                    count += 1
+                elif not is_delta and data is not None:
+                    _store_full(db, name, version, text)
+                    count += 1
+                next_text = text
+        return count
+
+    def get_history(self, limit=None, offset=0):
+        """Retrieve the edit history of a wiki page, from the latest
+        version.
+
+        :param limit: the maximum number of versions to retrieve, or
+                      `None` for all the versions (''since 1.3.4'')
+        :param offset: the number of versions to skip (''since 1.3.4'')
         :return: a tuple containing the `version`, `datetime`, `author`
                  and `comment`.
         """
-        for version, ts, author, comment in self.env.db_query("""
-                SELECT version, time, author, comment FROM wiki
-                WHERE name=%s AND version<=%s ORDER BY version DESC
-                """, (self.name, self.version)):
+        sql = """SELECT version, time, author, comment FROM wiki
+                 WHERE name=%s AND version<=%s ORDER BY version DESC"""
+        if limit is not None:
+            sql += " LIMIT %d OFFSET %d" % (limit, offset)
+            offset = 0
+        rows = self.env.db_query(sql, (self.name, self.version))
+        for version, ts, author, comment in rows[offset:]:
             yield version, from_utimestamp(ts), author, comment
+
+    def count_history(self):
+        """Return the number of versions in the edit history of a wiki
+        page, i.e. the number of versions retrieved by `get_history`.
+
+        :since: 1.3.4
+        """
+        return self.env.db_query("""
+            SELECT COUNT(*) FROM wiki WHERE name=%s AND version<=%s
+            """, (self.name, self.version))[0][0]
+
+
+def _is_delta(env, version):
+    """Whether `version`, which isn't the latest version, is to be
+    stored as a delta.
+    """
+    interval = WikiSystem(env).history_snapshot_interval
+    return version > 0 and interval > 1 and version % interval != 0
+
+
+def _encode_delta(base, text):
+    """Encode `text` as the compressed delta to `base`, line by line."""
+    base_lines = (base or '').splitlines(True)
+    lines = (text or '').splitlines(True)
+    ops = []
+    matcher = SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j1 < j2:
+            ops.append(''.join(lines[j1:j2]))
+    return base64.b64encode(zlib.compress(json.dumps(ops)))
+
+
+def _decode_delta(base, data):
+    """Return the text encoded by `_encode_delta` as a delta to `base`."""
+    base_lines = (base or '').splitlines(True)
+    ops = json.loads(zlib.decompress(base64.b64decode(data)))
+    return u''.join(u''.join(base_lines[op[0]:op[1]])
+                    if isinstance(op, list) else op for op in ops)
+
+
+def _get_text(db, name, version):
+    """Return the text of a version of a page, applying the deltas
+    from the next version stored in full.
+    """
+    for snapshot, in db("""
+            SELECT min(version) FROM wiki
+            WHERE name=%s AND version>=%s AND text IS NOT NULL
+            """, (name, version)):
+        break
+    text = None
+    for version, full_text, data in db("""
+            SELECT w.version, w.text, d.data FROM wiki w
+            LEFT OUTER JOIN wiki_delta d
+             ON (d.name=w.name AND d.version=w.version)
+            WHERE w.name=%s AND w.version>=%s AND w.version<=%s
+            ORDER BY w.version DESC
+            """, (name, version, snapshot)):
+        text = full_text if data is None else _decode_delta(text, data)
+    return text
+
+
+def _store_delta(db, name, version, data):
+    db("DELETE FROM wiki_delta WHERE name=%s AND version=%s", (name, version))
+    db("INSERT INTO wiki_delta (name, version, data) VALUES (%s,%s,%s)",
+       (name, version, data))
+    db("UPDATE wiki SET text=NULL WHERE name=%s AND version=%s",
+       (name, version))
+
+
+def _store_full(db, name, version, text):
+    db("DELETE FROM wiki_delta WHERE name=%s AND version=%s", (name, version))
+    db("UPDATE wiki SET text=%s WHERE name=%s AND version=%s",
+       (text, name, version))
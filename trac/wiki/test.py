@@ -89,10 +89,12 @@ class WikiTestCase(unittest.TestCase):
         # instead of env.href
         self.env.href = self.req.href
         self.env.abs_href = self.req.abs_href
-        self.env.db_transaction(
-            "INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
-            ('WikiStart', 1, to_utimestamp(datetime_now(utc)), 'joe',
-             '--', 'Entry page', 0))
+        now = to_utimestamp(datetime_now(utc))
+        with self.env.db_transaction as db:
+            db("INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
+               ('WikiStart', 1, now, 'joe', '--', 'Entry page', 0))
+            db("INSERT INTO wiki_head VALUES(%s,%s,%s,%s)",
+               ('WikiStart', 1, now, 'joe'))
         if self._setup:
             self._setup(self)
 
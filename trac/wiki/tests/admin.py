@@ -16,10 +16,13 @@ import sys
 import tempfile
 import unittest
 
-from trac.test import EnvironmentStub
+from trac.admin.api import AdminCommandError
+from trac.test import EnvironmentStub, MockRequest
 from trac.util import create_file
+from trac.web.api import RequestDone
+from trac.wiki.api import WikiSystem
 from trac.wiki.model import WikiPage
-from trac.wiki.admin import WikiAdmin
+from trac.wiki.admin import MacroStatsAdminPanel, WikiAdmin
 
 
 class WikiAdminTestCase(unittest.TestCase):
@@ -46,15 +49,21 @@ class WikiAdminTestCase(unittest.TestCase):
     def tearDown(self):
         self.env.reset_db_and_disk()
 
-    def _import_page(self, *args, **kwargs):
+    def _silent(self, func, *args, **kwargs):
         with open(os.devnull, 'wb') as devnull:
             stdout = sys.stdout
             try:
                 sys.stdout = devnull
-                self.admin.import_page(*args, **kwargs)
+                return func(*args, **kwargs)
             finally:
                 sys.stdout = stdout
 
+    def _import_page(self, *args, **kwargs):
+        return self._silent(self.admin.import_page, *args, **kwargs)
+
+    def _count_pages(self):
+        return self.env.db_query("SELECT COUNT(*) FROM wiki_head")[0][0]
+
     def test_import_page_new(self):
         self._import_page(self.filename, 'NewPage')
         page = WikiPage(self.env, 'NewPage')
@@ -97,9 +106,127 @@ class WikiAdminTestCase(unittest.TestCase):
         self.assertEqual(0, page.readonly)
         self.assertEqual(page_text, page.text)
 
+    def test_import_page_replace_compacted(self):
+        self.assertEqual(4, WikiPage.compact(self.env, 'ReadOnlyPage', 10))
+        self._import_page(self.filename, 'ReadOnlyPage', replace=True)
+        page = WikiPage(self.env, 'ReadOnlyPage')
+        self.assertEqual(5, page.version)
+        self.assertEqual(self.page_text, page.text)
+        for version in xrange(1, 5):
+            page = WikiPage(self.env, 'ReadOnlyPage', version)
+            self.assertEqual('[wiki:ReadOnlyPage@%d]' % version, page.text)
+
+    def test_import_pages_batches(self):
+        self.admin.BATCH_SIZE = 2
+        pages = [('Page%d' % idx, 'Text %d' % idx) for idx in xrange(5)]
+        pages.append(('WritablePage', 'Modified'))
+        pages.append(('Page1', 'Text 1'))
+        self.assertEqual(['Page0', 'Page1', 'Page2', 'Page3', 'Page4',
+                          'WritablePage'],
+                         self._silent(self.admin.import_pages, pages))
+        self.assertEqual(7, self._count_pages())
+        self.assertTrue(WikiSystem(self.env).has_page('Page4'))
+        page = WikiPage(self.env, 'WritablePage')
+        self.assertEqual(4, page.version)
+        self.assertEqual('Modified', page.text)
+
+    def test_import_pages_twice_in_batch(self):
+        pages = [('NewPage', 'Version 1'), ('NewPage', 'Version 2')]
+        self._silent(self.admin.import_pages, pages)
+        self.assertEqual(2, WikiPage(self.env, 'NewPage').version)
+
+        pages = [('NewPage', 'Replaced 1'), ('NewPage', 'Replaced 2'),
+                 ('OtherPage', 'Version 1'), ('OtherPage', 'Replaced')]
+        self._silent(self.admin.import_pages, pages, replace=True)
+        page = WikiPage(self.env, 'NewPage')
+        self.assertEqual(2, page.version)
+        self.assertEqual('Replaced 2', page.text)
+        page = WikiPage(self.env, 'OtherPage')
+        self.assertEqual(1, page.version)
+        self.assertEqual('Replaced', page.text)
+
+    def test_import_pages_invalid_name(self):
+        self.assertRaises(AdminCommandError, self.admin.import_pages,
+                          [('NewPage', 'Text'), ('../Invalid', 'Text')])
+        self.assertFalse(WikiSystem(self.env).has_page('NewPage'))
+
+    def _test_dump_load_archive(self, name):
+        archive = os.path.join(self.tmpdir, name)
+        self._silent(self.admin._do_dump, archive, 'ReadOnly*')
+        self.assertRaises(AdminCommandError, self._silent,
+                          self.admin._do_dump, archive)
+        WikiPage(self.env, 'ReadOnlyPage').delete()
+
+        self._silent(self.admin._do_load, archive)
+        page = WikiPage(self.env, 'ReadOnlyPage')
+        self.assertEqual(1, page.version)
+        self.assertEqual('[wiki:ReadOnlyPage@5]', page.text)
+        self.assertEqual(2, self._count_pages())
+
+    def test_dump_load_tar(self):
+        self._test_dump_load_archive('pages.tar')
+
+    def test_dump_load_tar_gz(self):
+        self._test_dump_load_archive('pages.tar.gz')
+
+    def test_dump_load_tar_bz2(self):
+        self._test_dump_load_archive('pages.tar.bz2')
+
+    def test_dump_load_zip(self):
+        self._test_dump_load_archive('pages.zip')
+
+    def test_load_directory_parallel(self):
+        self.env.config.set('wiki', 'import_readers', 2)
+        self.admin.BATCH_SIZE = 3
+        for idx in xrange(10):
+            create_file(os.path.join(self.tmpdir, 'Page%d' % idx),
+                        'Text %d' % idx)
+        self._silent(self.admin._do_load, self.tmpdir)
+        self.assertEqual(13, self._count_pages())
+        self.assertEqual('Text 7', WikiPage(self.env, 'Page7').text)
+
+
+class MacroStatsAdminPanelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.panel = MacroStatsAdminPanel(self.env)
+        self.wiki = WikiSystem(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_render_stats(self):
+        self.wiki.record_macro_call(None, 'Fast', 0.5)
+        self.wiki.record_macro_call(None, 'Slow', 1.0)
+        self.wiki.record_macro_call(None, 'Slow', 2.0)
+        req = MockRequest(self.env, authname='admin')
+
+        template, data = self.panel.render_admin_panel(req, 'general',
+                                                       'macros', None)
+
+        self.assertEqual('admin_macro_stats.html', template)
+        self.assertEqual([{'name': 'Slow', 'calls': 2, 'time': 3.0,
+                           'average': 1.5, 'max_time': 2.0},
+                          {'name': 'Fast', 'calls': 1, 'time': 0.5,
+                           'average': 0.5, 'max_time': 0.5}],
+                         data['stats'])
+
+    def test_reset_stats(self):
+        self.wiki.record_macro_call(None, 'Fast', 0.5)
+        req = MockRequest(self.env, authname='admin', method='POST',
+                          args={'reset': 'Reset'})
+
+        self.assertRaises(RequestDone, self.panel.render_admin_panel, req,
+                          'general', 'macros', None)
+        self.assertEqual([], self.wiki.get_macro_stats())
+
 
 def test_suite():
-    return unittest.makeSuite(WikiAdminTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiAdminTestCase))
+    suite.addTest(unittest.makeSuite(MacroStatsAdminPanelTestCase))
+    return suite
 
 
 if __name__ == '__main__':
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import os.path
+import pkg_resources
+import unittest
+
+from trac.core import ComponentMeta
+from trac.perm import PermissionSystem
+from trac.resource import Resource
+from trac.test import EnvironmentStub, MockRequest
+from trac.util import read_file
+from trac.util.text import to_unicode
+from trac.web.chrome import web_context
+from trac.wiki.admin import WikiAdmin
+from trac.wiki.cache import WikiRenderingCache
+from trac.wiki.formatter import format_to_html
+from trac.wiki.macros import WikiMacroBase
+from trac.wiki.model import WikiPage
+
+
+class WikiRenderingCacheTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class CounterMacro(WikiMacroBase):
+            count = 0
+
+            def expand_macro(self, formatter, name, content):
+                CounterMacro.count += 1
+                return '%s:%d' % (formatter.context.perm.username,
+                                  CounterMacro.count)
+
+        class ConstantMacro(WikiMacroBase):
+            count = 0
+
+            def is_cacheable(self, name):
+                return True
+
+            def expand_macro(self, formatter, name, content):
+                ConstantMacro.count += 1
+                return 'constant'
+
+        cls.macros = [CounterMacro, ConstantMacro]
+
+    @classmethod
+    def tearDownClass(cls):
+        for class_ in cls.macros:
+            ComponentMeta.deregister(class_)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'] + self.macros)
+        self.env.config.set('wiki', 'render_cache_size', 1048576)
+        self.env.config.set('wiki', 'render_block_cache_size', 2000)
+        self.cache = WikiRenderingCache(self.env)
+        PermissionSystem(self.env).grant_permission('anonymous', 'WIKI_VIEW')
+        for class_ in self.macros:
+            class_.count = 0
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def _render(self, page, authname='anonymous'):
+        req = MockRequest(self.env, authname=authname)
+        context = web_context(req, page.resource)
+        return unicode(self.cache.render(context, page, page.text))
+
+    def _count_rows(self):
+        return self.env.db_query("""
+            SELECT COUNT(*) FROM wiki_render_cache""")[0][0]
+
+    def test_render_cached(self):
+        page = self._insert_page('CachedPage', "'''Bold''' [[Constant]]")
+        html = self._render(page)
+        self.assertIn('<strong>Bold</strong>', html)
+        self.assertIn('constant', html)
+        self.assertEqual(1, self._count_rows())
+
+        self.assertEqual(html, self._render(page))
+        self.assertEqual(1, self.macros[1].count)
+        self.assertEqual(1, self._count_rows())
+
+    def test_macro_not_cacheable(self):
+        page = self._insert_page('DynamicPage', "Count [[Counter]]\n"
+                                                "{{{#!Counter\n}}}\n")
+        html = self._render(page)
+        self.assertIn('Count anonymous:1', html)
+        self.assertIn('anonymous:2', html)
+        self.assertNotIn('<!--', html)
+
+        html = self._render(page)
+        self.assertIn('Count anonymous:3', html)
+        self.assertIn('anonymous:4', html)
+        self.assertEqual(1, self._count_rows())
+
+    def test_macro_in_nested_block(self):
+        page = self._insert_page('NestedPage', "{{{#!div\n"
+                                               "[[Counter]]\n"
+                                               "}}}\n")
+        self.assertIn('anonymous:1', self._render(page))
+        self.assertIn('anonymous:2', self._render(page))
+
+    def test_keyed_by_user(self):
+        page = self._insert_page('UserPage', "[[Counter]]")
+        self.assertIn('anonymous:1', self._render(page))
+        self.assertIn('joe:2', self._render(page, 'joe'))
+        self.assertEqual(2, self._count_rows())
+
+    def test_keyed_by_version(self):
+        page = self._insert_page('VersionPage', 'Version 1')
+        self._render(page)
+        page.text = 'Version 2'
+        page.save('joe', 'Modified')
+        self.assertIn('Version 2', self._render(page))
+        self.assertIn('Version 1', self._render(WikiPage(self.env,
+                                                         'VersionPage', 1)))
+
+    def test_clear_on_page_added(self):
+        page = self._insert_page('LinkingPage', 'MissingPage')
+        self.assertIn('class="missing wiki"', self._render(page))
+
+        self._insert_page('MissingPage', 'Text')
+        self.assertEqual(0, self._count_rows())
+        self.assertNotIn('class="missing wiki"', self._render(page))
+
+    def test_clear_on_version_deleted(self):
+        page = self._insert_page('DeletedPage', 'Version 1')
+        page.text = 'Version 2'
+        page.save('joe', 'Modified')
+        self._render(page)
+        self._render(WikiPage(self.env, 'DeletedPage', 1))
+        self.assertEqual(2, self._count_rows())
+
+        WikiPage(self.env, 'DeletedPage', 2).delete(2)
+        self.assertEqual(0, self._count_rows())
+
+    def test_eviction(self):
+        self.env.config.set('wiki', 'render_cache_size', 400)
+        pages = [self._insert_page('Page%d' % idx, 'Text ' * 50)
+                 for idx in xrange(3)]
+        for page in pages:
+            self._render(page)
+            self.assertGreater(400, self.env.db_query("""
+                SELECT SUM(size) FROM wiki_render_cache""")[0][0])
+        self.assertEqual(['Page2'], [name for name, in self.env.db_query("""
+            SELECT name FROM wiki_render_cache""")])
+
+    def test_eviction_keeps_newest_page(self):
+        self.env.config.set('wiki', 'render_cache_size', 1000)
+        pages = [self._insert_page('Page%d' % idx, 'Text ' * 40)
+                 for idx in xrange(6)]
+        for page in pages:
+            self._render(page)
+        names = [name for name, in self.env.db_query("""
+            SELECT name FROM wiki_render_cache ORDER BY time, name""")]
+        self.assertIn('Page5', names)
+        self.assertNotIn('Page0', names)
+        self.assertEqual(self.cache._total_size, self.env.db_query("""
+            SELECT SUM(size) FROM wiki_render_cache""")[0][0])
+
+    def test_cache_cleared_on_import(self):
+        page = self._insert_page('LinkingPage', "NewPage")
+        self.assertIn('class="missing wiki"', self._render(page))
+
+        WikiAdmin(self.env).import_pages([('NewPage', "Text")])
+        html = self._render(page)
+        self.assertNotIn('class="missing wiki"', html)
+        self.assertIn('href="/trac.cgi/wiki/NewPage"', html)
+
+    def test_cache_disabled_by_default(self):
+        self.env.config.remove('wiki', 'render_cache_size')
+        page = self._insert_page('UncachedPage', "[[Constant]]")
+        self._render(page)
+        self.assertEqual(0, self._count_rows())
+
+    def test_cache_disabled(self):
+        self.env.config.set('wiki', 'render_cache_size', 0)
+        self.env.config.set('wiki', 'render_block_cache_size', 0)
+        page = self._insert_page('UncachedPage', "[[Constant]]")
+        self.assertIn('constant', self._render(page))
+        self.assertIn('constant', self._render(page))
+        self.assertEqual(2, self.macros[1].count)
+        self.assertEqual(0, self._count_rows())
+
+
+class WikiBlockRenderingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('wiki', 'render_block_cache_size', 2000)
+        self.cache = WikiRenderingCache(self.env)
+        self.context = web_context(MockRequest(self.env),
+                                   Resource('wiki', 'WikiStart'))
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _render_blocks(self, text):
+        return unicode(self.cache.render_blocks(self.context, text))
+
+    def test_same_as_format_to_html(self):
+        pages_dir = pkg_resources.resource_filename('trac.wiki',
+                                                    'default-pages')
+        for name in ('WikiFormatting', 'WikiProcessors', 'WikiHtml',
+                     'TracLinks', 'WikiMacros', 'TracGuide'):
+            text = to_unicode(read_file(os.path.join(pages_dir, name)))
+            self.assertEqual(unicode(format_to_html(self.env, self.context,
+                                                    text)),
+                             self._render_blocks(text))
+
+    def test_block_cache_disabled_by_default(self):
+        self.env.config.remove('wiki', 'render_block_cache_size')
+        self._render_blocks("Paragraph 1\n\nParagraph 2\n")
+        self.assertEqual(0, len(self.cache._block_cache))
+
+    def test_block_cache_cleared_on_page_added(self):
+        self._render_blocks("Paragraph 1\n\nNewPage\n")
+        self.assertEqual(2, len(self.cache._block_cache))
+        page = WikiPage(self.env, 'NewPage')
+        page.text = 'Text'
+        page.save('joe', 'Comment')
+        self.assertEqual(0, len(self.cache._block_cache))
+        self.assertNotIn('class="missing wiki"',
+                         self._render_blocks("Paragraph 1\n\nNewPage\n"))
+
+    def test_split_blocks(self):
+        text = ("= Heading =\n"
+                "Paragraph\n"
+                "\n"
+                " * item\n"
+                "\n"
+                "   * continued\n"
+                "\n"
+                "{{{\n"
+                "Code\n"
+                "\n"
+                "}}}\n"
+                "\n"
+                "||cell||")
+        self.assertEqual(["= Heading =\nParagraph\n\n"
+                          " * item\n\n   * continued\n",
+                          "{{{\nCode\n\n}}}\n",
+                          "||cell||"],
+                         self.cache._split_blocks(text))
+
+    def test_only_modified_blocks_rendered(self):
+        text = "Paragraph 1\n\nParagraph 2\n\nParagraph 3\n"
+        self._render_blocks(text)
+        self.assertEqual(3, len(self.cache._block_cache))
+        html = self._render_blocks(text.replace('2', 'two'))
+        self.assertIn('Paragraph two', html)
+        self.assertEqual(4, len(self.cache._block_cache))
+
+    def test_unique_anchors(self):
+        text = "= Title =\n\nParagraph\n\n= Title =\n"
+        self._render_blocks(text)
+        html = self._render_blocks(text.replace('Paragraph', 'Modified'))
+        self.assertIn('id="Title"', html)
+        self.assertIn('id="Title1"', html)
+
+    def test_cacheable_macro_sees_whole_text(self):
+        text = "[[PageOutline]]\n\n= Heading 1 =\n"
+        self.assertIn('Heading 1', self._render_blocks(text))
+        html = self._render_blocks(text.replace('1', '2'))
+        self.assertNotIn('Heading 1', html)
+        self.assertIn('href="#Heading2"', html)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiRenderingCacheTestCase))
+    suite.addTest(unittest.makeSuite(WikiBlockRenderingTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
@@ -12,13 +12,16 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 import os
+import time
 import unittest
 
-from trac.core import Component, TracError, implements
+from trac.core import Component, ComponentMeta, TracError, implements
+from trac.test import EnvironmentStub, MockRequest
 from trac.util.html import genshi, html
 from trac.util.translation import tag_
-from trac.wiki.api import IWikiSyntaxProvider
-from trac.wiki.formatter import MacroError, ProcessorError
+from trac.web.chrome import web_context
+from trac.wiki.api import IWikiSyntaxProvider, WikiSystem
+from trac.wiki.formatter import MacroError, ProcessorError, format_to_html
 from trac.wiki.macros import WikiMacroBase
 from trac.wiki.test import wikisyntax_test_suite
 
@@ -156,6 +159,114 @@ class SampleResolver(Component):
                       href=formatter.href(module, target))
 
 
+class MacroStatsTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class SleepMacro(WikiMacroBase):
+            def expand_macro(self, formatter, name, content):
+                time.sleep(0.01)
+                return 'slept'
+
+        cls.macro = SleepMacro
+
+    @classmethod
+    def tearDownClass(cls):
+        ComponentMeta.deregister(cls.macro)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*', self.macro])
+        self.wiki = WikiSystem(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _format(self, req, text):
+        return unicode(format_to_html(self.env, web_context(req), text))
+
+    def test_stats(self):
+        req = MockRequest(self.env)
+        self._format(req, "[[Sleep(1)]] [[Sleep(2)]]\n{{{#!Sleep\n}}}\n")
+        self._format(MockRequest(self.env), "[[Sleep]]")
+
+        stats = self.wiki.get_macro_stats(req)
+        self.assertEqual(['Sleep'], [row[0] for row in stats])
+        self.assertEqual(3, stats[0][1])
+        self.assertGreaterEqual(stats[0][2], 0.03)
+        self.assertEqual(4, self.wiki.get_macro_stats()[0][1])
+
+        self.wiki.reset_macro_stats()
+        self.assertEqual([], self.wiki.get_macro_stats())
+
+    def test_time_budget(self):
+        self.env.config.set('wiki', 'macro_time_budget', 0.015)
+        html = self._format(MockRequest(self.env), "[[Sleep(1)]] [[Sleep(2)]]\n"
+                                                   "{{{#!Sleep\n}}}\n")
+        self.assertEqual(2, html.count('slept'))
+        self.assertIn('Macro Sleep skipped', html)
+        self.assertIn('slept', self._format(MockRequest(self.env),
+                                            "[[Sleep]]"))
+
+    def test_no_time_budget(self):
+        html = self._format(MockRequest(self.env), "[[Sleep(1)]] [[Sleep(2)]]\n"
+                                                   "{{{#!Sleep\n}}}\n")
+        self.assertEqual(3, html.count('slept'))
+
+
+class MacroMemoTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        class CountMacro(WikiMacroBase):
+            count = 0
+
+            def expand_macro(self, formatter, name, content, args=None):
+                CountMacro.count += 1
+                return '%s:%d' % (name, CountMacro.count)
+
+        class UncountMacro(CountMacro):
+            def is_memoizable(self, name):
+                return False
+
+        cls.macros = [CountMacro, UncountMacro]
+
+    @classmethod
+    def tearDownClass(cls):
+        for class_ in cls.macros:
+            ComponentMeta.deregister(class_)
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'] + self.macros)
+        self.context = web_context(MockRequest(self.env))
+        self.macros[0].count = 0
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _format(self, text):
+        return unicode(format_to_html(self.env, self.context, text))
+
+    def test_identical_calls(self):
+        html = self._format("[[Count(1)]] [[Count(1)]] [[Count(2)]]\n"
+                            "{{{#!Count\n1\n}}}\n"
+                            "{{{#!Count arg=1\n1\n}}}\n"
+                            "{{{#!Count arg=1\n1\n}}}\n")
+        self.assertEqual(2, html.count('Count:1'))
+        self.assertEqual(2, html.count('Count:4'))
+        self.assertNotIn('Count:5', html)
+        self.assertIn('Count:5', self._format("[[Count(1)]]"))
+
+    def test_nested_calls(self):
+        html = self._format("[[Count(1)]]\n"
+                            "{{{#!div\n[[Count(1)]]\n}}}\n")
+        self.assertEqual(2, html.count('Count:1'))
+
+    def test_not_memoizable(self):
+        html = self._format("[[Uncount(1)]] [[Uncount(1)]]")
+        self.assertIn('Uncount:1', html)
+        self.assertIn('Uncount:2', html)
+
+
 def test_suite(data=None, setup=None, file=__file__, teardown=None,
                context=None):
     suite = unittest.TestSuite()
@@ -168,6 +279,8 @@ def test_suite(data=None, setup=None, file=__file__, teardown=None,
             filepath = os.path.join(os.path.dirname(file), filename)
             suite.addTest(wikisyntax_test_suite(data, setup, filepath,
                                                 teardown, context))
+        suite.addTest(unittest.makeSuite(MacroStatsTestCase))
+        suite.addTest(unittest.makeSuite(MacroMemoTestCase))
     return suite
 
 
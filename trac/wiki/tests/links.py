@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2018 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import unittest
+
+from trac.resource import Resource
+from trac.test import EnvironmentStub, MockRequest
+from trac.ticket.test import insert_ticket
+from trac.web.chrome import web_context
+from trac.wiki.admin import WikiAdmin
+from trac.wiki.formatter import format_to_html
+from trac.wiki.links import WikiLinkGraph
+from trac.wiki.model import WikiPage
+
+
+class WikiLinkGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=['trac.*'])
+        self.graph = WikiLinkGraph(self.env)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name, text):
+        page = WikiPage(self.env, name)
+        page.text = text
+        page.save('joe', 'Comment')
+        return page
+
+    def test_extract_links(self):
+        insert_ticket(self.env, summary='Ticket')
+        self.assertEqual({('wiki', 'CamelCase'), ('wiki', 'Explicit'),
+                          ('wiki', 'Page/Child'), ('wiki', 'NestedPage'),
+                          ('ticket', '1'), ('milestone', 'milestone1')},
+                         self.graph.extract_links(
+                             Resource('wiki', 'Page'),
+                             "CamelCase [wiki:Explicit label] #1 #2\n"
+                             "[[milestone:milestone1]] [wiki:./Child]\n"
+                             "{{{#!div\nNestedPage\n}}}\n"
+                             "{{{#!python\nIgnored = 'WikiStart'\n}}}\n"
+                             "[[TitleIndex]] [wiki:Page]\n"))
+
+    def test_extract_links_using_request(self):
+        """The link resolvers using the request don't fail."""
+        self.env.db_transaction("""
+            INSERT INTO report (title, query, description)
+            VALUES ('Report', 'SELECT 1', '')""")
+        self.assertEqual({('wiki', 'CamelCase')},
+                         self.graph.extract_links(
+                             Resource('wiki', 'Page'),
+                             "{1} report:1 timeline:2018-01-02T12:34Z "
+                             "CamelCase"))
+
+    def test_wiki_listener(self):
+        page = self._insert_page('LinkingPage', 'TargetPage OtherPage')
+        self.assertEqual([('wiki', 'OtherPage'), ('wiki', 'TargetPage')],
+                         self.graph.get_links('wiki', 'LinkingPage'))
+        self.assertEqual([('wiki', 'LinkingPage')],
+                         self.graph.get_backlinks('wiki', 'TargetPage'))
+
+        page.text = 'TargetPage'
+        page.save('joe', 'Modified')
+        self.assertEqual([], self.graph.get_backlinks('wiki', 'OtherPage'))
+
+        page.rename('RenamedPage')
+        self.assertEqual([('wiki', 'RenamedPage')],
+                         self.graph.get_backlinks('wiki', 'TargetPage'))
+
+        page.delete()
+        self.assertEqual([], self.graph.get_backlinks('wiki', 'TargetPage'))
+
+    def test_ticket_listener(self):
+        ticket = insert_ticket(self.env, description='DescribedPage')
+        ticket.save_changes('joe', 'CommentedPage')
+        self.assertEqual([('wiki', 'CommentedPage'),
+                          ('wiki', 'DescribedPage')],
+                         self.graph.get_links('ticket', ticket.id))
+
+        ticket['description'] = 'ModifiedPage'
+        ticket.save_changes('joe')
+        self.assertEqual([('wiki', 'CommentedPage'),
+                          ('wiki', 'ModifiedPage')],
+                         self.graph.get_links('ticket', ticket.id))
+
+        ticket.delete()
+        self.assertEqual([], self.graph.get_links('ticket', ticket.id))
+
+    def test_backlinks_sorted(self):
+        for idx in xrange(11):
+            insert_ticket(self.env, description='TargetPage')
+        self._insert_page('LinkingPage', 'TargetPage')
+        self.assertEqual([('ticket', unicode(idx)) for idx in xrange(1, 12)] +
+                         [('wiki', 'LinkingPage')],
+                         self.graph.get_backlinks('wiki', 'TargetPage'))
+
+    def test_missing_pages(self):
+        self._insert_page('ExistingPage', 'Text')
+        self._insert_page('LinkingPage', 'ExistingPage MissingPage')
+        insert_ticket(self.env, description='MissingPage')
+        self.assertEqual([('MissingPage', 'ticket', '1'),
+                          ('MissingPage', 'wiki', 'LinkingPage')],
+                         self.graph.get_missing_pages())
+
+        self._insert_page('MissingPage', 'Text')
+        self.assertEqual([], self.graph.get_missing_pages())
+
+    def test_rebuild(self):
+        self._insert_page('LinkingPage', 'TargetPage')
+        insert_ticket(self.env, description='TargetPage')
+        self.env.db_transaction("DELETE FROM wiki_link")
+
+        self.assertEqual(2, self.graph.rebuild())
+        self.assertEqual([('ticket', '1'), ('wiki', 'LinkingPage')],
+                         self.graph.get_backlinks('wiki', 'TargetPage'))
+
+    def test_import_pages(self):
+        self._insert_page('LinkingPage', 'OldTarget')
+        WikiAdmin(self.env).import_pages([('LinkingPage', 'NewTarget'),
+                                          ('OtherPage', 'NewTarget')])
+        self.assertEqual([], self.graph.get_backlinks('wiki', 'OldTarget'))
+        self.assertEqual([('wiki', 'LinkingPage'), ('wiki', 'OtherPage')],
+                         self.graph.get_backlinks('wiki', 'NewTarget'))
+
+        WikiAdmin(self.env).import_pages([('OtherPage', 'OldTarget')],
+                                         replace=True)
+        self.assertEqual([('wiki', 'OtherPage')],
+                         self.graph.get_backlinks('wiki', 'OldTarget'))
+        self.assertEqual([('wiki', 'LinkingPage')],
+                         self.graph.get_backlinks('wiki', 'NewTarget'))
+
+    def test_backlinks_macro(self):
+        self._insert_page('LinkingPage', 'TargetPage')
+        insert_ticket(self.env, description='TargetPage')
+        context = web_context(MockRequest(self.env),
+                              Resource('wiki', 'TargetPage'))
+        html = unicode(format_to_html(self.env, context, '[[BackLinks]]'))
+        self.assertIn('href="/trac.cgi/wiki/LinkingPage"', html)
+        self.assertIn('href="/trac.cgi/ticket/1"', html)
+        self.assertEqual(html, unicode(format_to_html(
+            self.env, context, '[[BackLinks(TargetPage)]]')))
+
+
+def test_suite():
+    return unittest.makeSuite(WikiLinkGraphTestCase)
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='test_suite')
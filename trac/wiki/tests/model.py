@@ -237,9 +237,11 @@ class WikiPageTestCase(unittest.TestCase):
 
     def test_rename_page(self):
         data = (1, 42, 'joe', 'Bla bla', 'Testing', 0)
-        self.env.db_transaction(
-            "INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
-            ('TestPage',) + data)
+        with self.env.db_transaction as db:
+            db("INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
+               ('TestPage',) + data)
+            db("INSERT INTO wiki_head VALUES(%s,%s,%s,%s)",
+               ('TestPage',) + data[:3])
         attachment = Attachment(self.env, 'wiki', 'TestPage')
         attachment.insert('foo.txt', io.BytesIO(), 0, 1)
 
@@ -269,6 +271,47 @@ class WikiPageTestCase(unittest.TestCase):
         listener = TestWikiChangeListener(self.env)
         self.assertEqual((page, 'TestPage'), listener.renamed[0])
 
+    def test_wiki_head(self):
+        t1 = datetime(2001, 1, 1, 1, 1, 1, 0, utc)
+        t2 = datetime(2002, 1, 1, 1, 1, 1, 0, utc)
+        def get_head():
+            return self.env.db_query("""
+                SELECT name, version, time, author FROM wiki_head""")
+
+        page = WikiPage(self.env, 'TestPage')
+        page.text = 'Bla bla'
+        page.save('joe', 'Testing', t1)
+        self.assertEqual([('TestPage', 1, to_utimestamp(t1), 'joe')],
+                         get_head())
+        page.text = 'Bla'
+        page.save('kate', 'Changing', t2)
+        self.assertEqual([('TestPage', 2, to_utimestamp(t2), 'kate')],
+                         get_head())
+
+        page.rename('PageRenamed')
+        self.assertEqual([('PageRenamed', 2, to_utimestamp(t2), 'kate')],
+                         get_head())
+        page.delete(2)
+        self.assertEqual([('PageRenamed', 1, to_utimestamp(t1), 'joe')],
+                         get_head())
+        page.delete()
+        self.assertEqual([], get_head())
+
+    def test_get_history_paginated(self):
+        page = WikiPage(self.env, 'TestPage')
+        for idx in xrange(5):
+            page.text = 'Version %d' % (idx + 1)
+            page.save('joe', 'Comment %d' % (idx + 1))
+        self.assertEqual(5, page.count_history())
+        self.assertEqual([5, 4], [h[0] for h in page.get_history(2)])
+        self.assertEqual([3, 2], [h[0] for h in page.get_history(2, 2)])
+        self.assertEqual([1], [h[0] for h in page.get_history(2, 4)])
+        self.assertEqual([2, 1], [h[0] for h in page.get_history(offset=3)])
+
+        page = WikiPage(self.env, 'TestPage', 3)
+        self.assertEqual(3, page.count_history())
+        self.assertEqual([3, 2], [h[0] for h in page.get_history(2)])
+
     def test_edit_comment_of_page_version(self):
         self.env.db_transaction.executemany(
             "INSERT INTO wiki VALUES(%s,%s,%s,%s,%s,%s,%s)",
@@ -344,8 +387,98 @@ class WikiPageTestCase(unittest.TestCase):
         self.assertEqual(1, page.version)
 
 
+class WikiPageHistoryStorageTestCase(unittest.TestCase):
+
+    texts = ['Line 1\nLine 2\nLine 3\n',
+             'Line 1\nLine 2 modified\nLine 3\n',
+             u'Line 0\nLine 1\nLine 2 modified\nLine 3\n\u00e9\n',
+             'Line 0\nLine 3\n',
+             'Line 3',
+             'Line 1\nLine 2\nLine 3\n']
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.config.set('wiki', 'history_snapshot_interval', 3)
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def _insert_page(self, name='TestPage'):
+        page = WikiPage(self.env, name)
+        for text in self.texts:
+            page.text = text
+            page.save('joe', 'Comment')
+        return page
+
+    def _get_deltas(self):
+        return [version for version, in self.env.db_query("""
+            SELECT version FROM wiki_delta ORDER BY version""")]
+
+    def assertVersionsText(self, texts, name='TestPage'):
+        for version, text in enumerate(texts, 1):
+            if text is not None:
+                self.assertEqual(text, WikiPage(self.env, name, version).text)
+
+    def test_save(self):
+        self._insert_page()
+        self.assertEqual([1, 2, 4, 5], self._get_deltas())
+        self.assertEqual([(None,), (None,), (self.texts[2],)],
+                         self.env.db_query("""
+                            SELECT text FROM wiki WHERE version<=3
+                            ORDER BY version"""))
+        self.assertVersionsText(self.texts)
+        self.assertEqual(self.texts[-1], WikiPage(self.env, 'TestPage').text)
+
+    def test_delete_version(self):
+        page = self._insert_page()
+        page.delete(3)
+        self.assertEqual([1, 4, 5], self._get_deltas())
+        self.assertVersionsText(self.texts[:2] + [None] + self.texts[3:])
+
+        page.delete(6)
+        self.assertEqual([1, 4], self._get_deltas())
+        self.assertEqual(5, page.version)
+        self.assertEqual(self.texts[4], page.text)
+        self.assertVersionsText(self.texts[:2] + [None] + self.texts[3:5])
+
+    def test_delete_page(self):
+        page = self._insert_page()
+        page.delete()
+        self.assertEqual([], self._get_deltas())
+
+    def test_rename(self):
+        page = self._insert_page()
+        page.rename('PageRenamed')
+        self.assertVersionsText(self.texts, 'PageRenamed')
+
+    def test_replace_text(self):
+        self._insert_page()
+        WikiPage.replace_text(self.env, 'TestPage', 'Replaced')
+        self.assertVersionsText(self.texts[:-1] + ['Replaced'])
+
+    def test_compact(self):
+        self.env.config.set('wiki', 'history_snapshot_interval', 0)
+        self._insert_page()
+        self.assertEqual([], self._get_deltas())
+
+        self.assertEqual(4, WikiPage.compact(self.env, 'TestPage', 3))
+        self.assertEqual([1, 2, 4, 5], self._get_deltas())
+        self.assertVersionsText(self.texts)
+
+        self.assertEqual(3, WikiPage.compact(self.env, 'TestPage', 2))
+        self.assertEqual([1, 3, 5], self._get_deltas())
+        self.assertVersionsText(self.texts)
+
+        self.assertEqual(3, WikiPage.compact(self.env, 'TestPage'))
+        self.assertEqual([], self._get_deltas())
+        self.assertVersionsText(self.texts)
+
+
 def test_suite():
-    return unittest.makeSuite(WikiPageTestCase)
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WikiPageTestCase))
+    suite.addTest(unittest.makeSuite(WikiPageHistoryStorageTestCase))
+    return suite
 
 if __name__ == '__main__':
     unittest.main(defaultTest='test_suite')
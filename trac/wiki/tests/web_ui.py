@@ -147,6 +147,57 @@ class WikiModuleTestCase(unittest.TestCase):
         self.assertNotIn('version', resp[1])
         self.assertEqual('NewPage', resp[1]['page'].name)
 
+    def test_history_paginated(self):
+        self.env.config.set('wiki', 'history_items_per_page', 2)
+        page = WikiPage(self.env, 'TestPage')
+        for idx in xrange(5):
+            page.text = 'Version %d' % (idx + 1)
+            page.save('joe', 'Comment')
+
+        def render_history(history_page):
+            req = MockRequest(self.env, path_info='/wiki/TestPage',
+                              args={'action': 'history', 'page': 'TestPage',
+                                    'history_page': history_page})
+            resp = WikiModule(self.env).process_request(req)
+            self.assertEqual('history_view.html', resp[0])
+            return req, resp[1]
+
+        req, data = render_history('2')
+        self.assertEqual([3, 2], [h['version'] for h in data['history']])
+        self.assertEqual(5, data['paginator'].num_items)
+        self.assertEqual(3, data['paginator'].num_pages)
+        self.assertEqual('/trac.cgi/wiki/TestPage?action=history&'
+                         'history_page=3',
+                         req.chrome['links']['next'][0]['href'])
+        self.assertEqual('/trac.cgi/wiki/TestPage?action=history&'
+                         'history_page=1',
+                         req.chrome['links']['prev'][0]['href'])
+
+        req, data = render_history('4')
+        self.assertEqual([5, 4], [h['version'] for h in data['history']])
+        self.assertEqual(1, len(req.chrome['warnings']))
+
+    def test_timeline_last_modified(self):
+        module = WikiModule(self.env)
+        self.assertEqual((None, (0, 0, 0)),
+                         module.get_timeline_last_modified(['wiki']))
+        page = WikiPage(self.env, 'TestPage')
+        for idx in xrange(2):
+            page.text = 'Version %d' % (idx + 1)
+            page.save('joe', 'Comment')
+        last_modified, state = module.get_timeline_last_modified(['wiki'])
+        self.assertEqual(page.time, last_modified)
+
+        # Deleting the latest version or the page changes the state
+        WikiPage(self.env, 'TestPage', 2).delete(version=2)
+        self.assertNotEqual(state,
+                            module.get_timeline_last_modified(['wiki'])[1])
+        state = module.get_timeline_last_modified(['wiki'])[1]
+        WikiPage(self.env, 'TestPage').delete()
+        self.assertNotEqual(state,
+                            module.get_timeline_last_modified(['wiki'])[1])
+        self.assertIsNone(module.get_timeline_last_modified(['blog']))
+
 
 def test_suite():
     suite = unittest.TestSuite()
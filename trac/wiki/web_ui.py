@@ -25,11 +25,14 @@ from trac.core import *
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.perm import IPermissionPolicy, IPermissionRequestor
 from trac.resource import *
-from trac.search import ISearchSource, search_to_sql, shorten_result
-from trac.timeline.api import ITimelineEventProvider
+from trac.search import ISearchSource, SearchSystem, search_to_sql, \
+                         shorten_result
+from trac.timeline.api import ITimelineEventProvider, TimelineEventCache, \
+                              merge_timeline_events
 from trac.util import as_int, get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
 from trac.util.html import tag
+from trac.util.presentation import Paginator
 from trac.util.text import shorten_line
 from trac.util.translation import _, tag_
 from trac.versioncontrol.diff import get_diff_options, diff_blocks
@@ -37,8 +40,11 @@ from trac.web.api import HTTPBadRequest, IRequestHandler
 from trac.web.chrome import (Chrome, INavigationContributor, ITemplateProvider,
                              accesskey, add_ctxtnav, add_link,
                              add_notice, add_script, add_stylesheet,
-                             add_warning, prevnext_nav, web_context)
-from trac.wiki.api import IWikiPageManipulator, WikiSystem, validate_page_name
+                             add_warning, prepare_paginator, prevnext_nav,
+                             web_context)
+from trac.wiki.api import IWikiChangeListener, IWikiPageManipulator, \
+                          WikiSystem, validate_page_name
+from trac.wiki.cache import WikiRenderingCache
 from trac.wiki.formatter import format_to, OneLinerFormatter
 from trac.wiki.model import WikiPage
 
@@ -47,7 +53,7 @@ class WikiModule(Component):
 
     implements(IContentConverter, INavigationContributor,
                IPermissionRequestor, IRequestHandler, ITimelineEventProvider,
-               ISearchSource, ITemplateProvider)
+               ISearchSource, ITemplateProvider, IWikiChangeListener)
 
     page_manipulators = ExtensionPoint(IWikiPageManipulator)
 
@@ -61,6 +67,12 @@ class WikiModule(Component):
         """Default height of the textarea on the wiki edit page.
         (//Since 1.1.5//)""")
 
+    history_items_per_page = IntOption('wiki', 'history_items_per_page',
+                                       100,
+        """Number of versions shown on each page of the history of a
+        wiki page. Set to 0 to show all the versions on a single page.
+        (''since 1.3.4'')""")
+
     START_PAGE = property(lambda self: WikiSystem.START_PAGE)
     TITLE_INDEX_PAGE = property(lambda self: WikiSystem.TITLE_INDEX_PAGE)
     PAGE_TEMPLATES_PREFIX = 'PageTemplates/'
@@ -581,6 +593,9 @@ class WikiModule(Component):
                          'longcol': 'Version', 'shortcol': 'v'})
         elif sidebyside and action != 'collision':
             data['action'] = 'preview'
+        if not data['diff']:
+            data['page_html'] = WikiRenderingCache(self.env) \
+                                .render_blocks(context, page.text)
 
         self._wiki_ctxtnav(req, page)
         Chrome(self.env).add_wiki_toolbars(req)
@@ -606,16 +621,35 @@ class WikiModule(Component):
 
         data = self._page_data(req, page, 'history')
 
+        num_items = page.count_history()
+        max_per_page = self.history_items_per_page
+        if max_per_page <= 0:
+            max_per_page = max(num_items, 1)
+        history_page = req.args.getint('history_page', 1, min=1)
+        if (history_page - 1) * max_per_page >= num_items:
+            if history_page > 1:
+                add_warning(req, _("Page %(page)s is out of range.",
+                                   page=history_page))
+            history_page = 1
         history = []
-        for version, date, author, comment in page.get_history():
+        for version, date, author, comment in \
+                page.get_history(max_per_page,
+                                 (history_page - 1) * max_per_page):
             history.append({
                 'version': version,
                 'date': date,
                 'author': author,
                 'comment': comment or ''
             })
+        paginator = Paginator(history, history_page - 1, max_per_page,
+                              num_items)
+        prepare_paginator(
+            req, paginator,
+            lambda num: req.href.wiki(page.name, action='history',
+                                      history_page=num))
         data.update({
             'history': history,
+            'paginator': paginator,
             'resource': page.resource,
             'can_edit_comment': 'WIKI_ADMIN' in req.perm(page.resource)
         })
@@ -720,10 +754,16 @@ class WikiModule(Component):
         for manipulator in self.page_manipulators:
             manipulator.prepare_wiki_page(req, page, fields)
         text = fields.get('text', '')
+        if page.exists:
+            page_html = WikiRenderingCache(self.env).render(context, page,
+                                                            text)
+        else:
+            page_html = None
 
         data.update({
             'context': context,
             'text': text,
+            'page_html': page_html,
             'latest_version': latest_page.version,
             'attachments': AttachmentModule(self.env).attachment_data(context),
             'start_page': self.START_PAGE,
@@ -747,6 +787,26 @@ class WikiModule(Component):
             add_ctxtnav(req, _("History"), req.href.wiki(page.name,
                                                          action='history'))
 
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        pass
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        pass
+
+    def wiki_page_deleted(self, page):
+        TimelineEventCache(self.env).reset()
+
+    def wiki_page_version_deleted(self, page):
+        TimelineEventCache(self.env).reset()
+
+    def wiki_page_renamed(self, page, old_name):
+        TimelineEventCache(self.env).reset()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        TimelineEventCache(self.env).reset()
+
     # ITimelineEventProvider methods
 
     def get_timeline_filters(self, req):
@@ -754,21 +814,58 @@ class WikiModule(Component):
             yield ('wiki', _('Wiki changes'))
 
     def get_timeline_events(self, req, start, stop, filters):
+        events = self.get_cacheable_timeline_events(start, stop, filters)
+        return self.filter_timeline_events(req, events, filters)
+
+    def is_timeline_sorted(self):
+        return True
+
+    def get_cacheable_timeline_events(self, start, stop, filters):
         if 'wiki' in filters:
             wiki_realm = Resource(self.realm)
-            for ts, name, comment, author, version in self.env.db_query("""
-                    SELECT time, name, comment, author, version FROM wiki
-                    WHERE time>=%s AND time<=%s
-                    """, (to_utimestamp(start), to_utimestamp(stop))):
-                wiki_page = wiki_realm(id=name, version=version)
-                if 'WIKI_VIEW' not in req.perm(wiki_page):
-                    continue
-                yield ('wiki', from_utimestamp(ts), author,
-                       (wiki_page, comment))
+
+            def produce_wiki_events():
+                for ts, name, comment, author, version in \
+                        self.env.db_query("""
+                        SELECT time, name, comment, author, version FROM wiki
+                        WHERE time>=%s AND time<=%s ORDER BY time DESC
+                        """, (to_utimestamp(start), to_utimestamp(stop))):
+                    wiki_page = wiki_realm(id=name, version=version)
+                    yield ('wiki', from_utimestamp(ts), author,
+                           (wiki_page, comment))
 
             # Attachments
-            for event in AttachmentModule(self.env).get_timeline_events(
-                    req, wiki_realm, start, stop):
+            attachment_events = AttachmentModule(self.env) \
+                                .get_cacheable_timeline_events(wiki_realm,
+                                                               start, stop)
+
+            for event in merge_timeline_events([produce_wiki_events(),
+                                                attachment_events]):
+                yield event
+
+    def get_timeline_last_modified(self, filters):
+        if 'wiki' in filters:
+            last_modified, attachments = AttachmentModule(self.env) \
+                .get_timeline_last_modified(Resource(self.realm))
+            times = [last_modified]
+            # Deleted pages and versions change the number of pages and
+            # the sum of their latest versions, read from the small
+            # wiki_head table rather than from all the versions.
+            for ts, pages, versions in self.env.db_query("""
+                    SELECT MAX(time), COUNT(*), SUM(version)
+                    FROM wiki_head"""):
+                if ts:
+                    times.append(from_utimestamp(ts))
+            return max(filter(None, times) or [None]), \
+                   (pages, versions or 0, attachments)
+
+    def filter_timeline_events(self, req, events, filters):
+        attachment = AttachmentModule(self.env)
+        for event in events:
+            if event[0] == 'attachment':
+                for event in attachment.filter_timeline_events(req, [event]):
+                    yield event
+            elif 'WIKI_VIEW' in req.perm(event[3][0]):
                 yield event
 
     def render_timeline_event(self, context, field, event):
@@ -801,27 +898,74 @@ class WikiModule(Component):
         if not 'wiki' in filters:
             return
         with self.env.db_query as db:
-            sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
-                                                 'w1.text'], terms)
             wiki_realm = Resource(self.realm)
-            for name, ts, author, text in db("""
-                    SELECT w1.name, w1.time, w1.author, w1.text
-                    FROM wiki w1,(SELECT name, max(version) AS ver
-                                  FROM wiki GROUP BY name) w2
-                    WHERE w1.version = w2.ver AND w1.name = w2.name
-                    AND """ + sql_query, args):
-                page = wiki_realm(id=name)
-                if 'WIKI_VIEW' in req.perm(page):
-                    yield (get_resource_url(self.env, page, req.href),
-                           '%s: %s' % (name, shorten_line(text)),
-                           from_utimestamp(ts), author,
-                           shorten_result(text, terms))
+            index_sql = SearchSystem(self.env).get_index_sql(db, self.realm,
+                                                             terms)
+            if index_sql:
+                sql, args = index_sql
+                rows = db("""
+                        SELECT target, time, author, text, score FROM (%s) s
+                        """ % sql, args)
+            else:
+                sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
+                                                     'w1.text'], terms)
+                rows = db("""
+                        SELECT w1.name, w1.time, w1.author, w1.text, NULL
+                        FROM wiki w1, wiki_head w2
+                        WHERE w1.version = w2.version AND w1.name = w2.name
+                        AND """ + sql_query, args)
+            req.perm.filter('WIKI_VIEW', [wiki_realm(id=row[0])
+                                          for row in rows])
+            for name, ts, author, text, score in rows:
+                result = self._get_search_result(req, terms, name,
+                                                 from_utimestamp(ts), author,
+                                                 text, score)
+                if result:
+                    yield result
 
         # Attachments
         for result in AttachmentModule(self.env).get_search_results(
                 req, wiki_realm, terms):
             yield result
 
+    def get_search_results_page(self, req, terms, filters, limit, cursor):
+        if not 'wiki' in filters:
+            return [], None
+        wiki_realm = Resource(self.realm)
+        with self.env.db_query as db:
+            page = SearchSystem(self.env).query_index(
+                db, [(self.realm, None), ('attachment', self.realm)], terms,
+                limit, cursor)
+        if page is None:
+            return None
+        rows, cursor = page
+        req.perm.filter('WIKI_VIEW', [wiki_realm(id=row[1]) for row in rows
+                                      if row[0] == self.realm])
+        results = []
+        for realm, target, parent_realm, parent_target, time, author, \
+                title, text, score in rows:
+            if realm == self.realm:
+                result = self._get_search_result(req, terms, target,
+                                                 from_utimestamp(time),
+                                                 author, text, score)
+            else:
+                attachment = wiki_realm(id=parent_target).child(realm, target)
+                result = AttachmentModule(self.env).get_search_result(
+                    req, attachment, from_utimestamp(time), author, text,
+                    terms, score)
+            if result:
+                results.append(result)
+        return results, cursor
+
+    def _get_search_result(self, req, terms, name, time, author, text,
+                           score):
+        page = Resource(self.realm, name)
+        if 'WIKI_VIEW' in req.perm(page):
+            result = (get_resource_url(self.env, page, req.href),
+                      '%s: %s' % (name, shorten_line(text)),
+                      time, author, shorten_result(text, terms))
+            return result if score is None else result + (score,)
+
 
 class DefaultWikiPolicy(Component):
     """Default permission policy for the wiki system.
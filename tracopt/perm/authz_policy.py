@@ -21,8 +21,10 @@ from itertools import groupby
 from trac.config import ConfigurationError, ParsingError, PathOption, \
                         UnicodeConfigParser
 from trac.core import Component, implements
-from trac.perm import IPermissionPolicy, PermissionSystem
+from trac.perm import IBatchPermissionPolicy, IPermissionPolicy, \
+                      PermissionSystem
 from trac.util import to_list
+from trac.util.datefmt import time_now
 from trac.util.text import exception_to_unicode
 
 
@@ -126,45 +128,80 @@ class AuthzPolicy(Component):
       }}}
 
     """
-    implements(IPermissionPolicy)
+    implements(IBatchPermissionPolicy, IPermissionPolicy)
 
     authz_file = PathOption('authz_policy', 'authz_file', '',
                             "Location of authz policy configuration file. "
                             "Non-absolute paths are relative to the "
                             "Environment `conf` directory.")
 
+    # Minimum number of seconds between checks of the authz file mtime.
+    MTIME_CHECK_INTERVAL = 1
+    # Maximum number of memoised (username, resource key) decisions.
+    DECISION_CACHE_SIZE = 10000
+
     def __init__(self):
         self.authz = None
         self.authz_mtime = None
         self.groups_by_user = {}
+        self._mtime_checked = 0
+        # The compiled rules, replaced as a whole when the authz file
+        # is parsed: (groups_by_user, exact, prefixes, wildcards,
+        # decisions)
+        self._rules = ({}, {}, [], [], {})
 
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
+        self._check_authz_file()
+        return self._decide(action, username, resource)
+
+    # IBatchPermissionPolicy methods
+
+    def check_permissions(self, action, username, resources, perm):
+        self._check_authz_file()
+        return [self._decide(action, username, resource)
+                for resource in resources]
+
+    # Internal methods
+
+    def _check_authz_file(self):
+        now = time_now()
         if not self.authz_mtime or \
-                os.path.getmtime(self.authz_file) != self.authz_mtime:
-            self.parse_authz()
+                now - self._mtime_checked >= self.MTIME_CHECK_INTERVAL:
+            if not self.authz_mtime:
+                self.parse_authz()
+            elif os.path.getmtime(self.authz_file) != self.authz_mtime:
+                self.parse_authz()
+                # Drop the decisions cached from the previous rules.
+                PermissionSystem(self.env).reset_decision_cache()
+            self._mtime_checked = now
+
+    def _decide(self, action, username, resource):
         resource_key = self.normalise_resource(resource)
         self.log.debug('Checking %s on %s', action, resource_key)
-        permissions = self.authz_permissions(resource_key, username)
-        if permissions is None:
+        key = (username, resource_key)
+        compiled_rules = self._rules
+        decisions = compiled_rules[4]
+        try:
+            rules = decisions[key]
+        except KeyError:
+            rules = self._match_rules(resource_key, username, compiled_rules)
+            if len(decisions) >= self.DECISION_CACHE_SIZE:
+                decisions.clear()
+            decisions[key] = rules
+        if rules is None:
             return None                 # no match, can't decide
-        elif permissions == []:
+        elif not rules:
             return False                # all actions are denied
 
-        # FIXME: expand all permissions once for all
-        ps = PermissionSystem(self.env)
-        for deny, perms in groupby(permissions,
-                                   key=lambda p: p.startswith('!')):
-            if deny and action in ps.expand_actions(p[1:] for p in perms):
-                return False            # action is explicitly denied
-            elif action in ps.expand_actions(perms):
-                return True             # action is explicitly granted
+        for deny, actions in rules:
+            if action in actions:
+                # action is explicitly denied or granted
+                return not deny
 
         return None                     # no match for action, can't decide
 
-    # Internal methods
-
     def parse_authz(self):
         self.log.debug("Parsing authz security policy %s",
                        self.authz_file)
@@ -174,49 +211,69 @@ class AuthzPolicy(Component):
                            "option in trac.ini is empty or not defined.")
             raise ConfigurationError()
         try:
-            self.authz_mtime = os.path.getmtime(self.authz_file)
+            authz_mtime = os.path.getmtime(self.authz_file)
         except OSError as e:
             self.log.error("Error parsing authz permission policy file: %s",
                            exception_to_unicode(e))
             raise ConfigurationError()
 
-        self.authz = UnicodeConfigParser(ignorecase_option=False)
+        # The rules are built aside and replaced at once, as they are
+        # used concurrently by the other requests.
+        authz = UnicodeConfigParser(ignorecase_option=False)
         try:
-            self.authz.read(self.authz_file)
+            authz.read(self.authz_file)
         except ParsingError as e:
             self.log.error("Error parsing authz permission policy file: %s",
                            exception_to_unicode(e))
             raise ConfigurationError()
         groups = {}
-        if self.authz.has_section('groups'):
-            for group, users in self.authz.items('groups'):
+        if authz.has_section('groups'):
+            for group, users in authz.items('groups'):
                 groups[group] = to_list(users)
 
-        self.groups_by_user = {}
+        groups_by_user = {}
 
         def add_items(group, items):
             for item in items:
                 if item.startswith('@'):
                     add_items(group, groups[item[1:]])
                 else:
-                    self.groups_by_user.setdefault(item, set()).add(group)
+                    groups_by_user.setdefault(item, set()).add(group)
 
         for group, users in groups.iteritems():
             add_items('@' + group, users)
 
-        all_actions = set(PermissionSystem(self.env).get_actions())
+        ps = PermissionSystem(self.env)
+        all_actions = set(ps.get_actions())
         authz_basename = os.path.basename(self.authz_file)
-        for section in self.authz.sections():
+        rules = (groups_by_user, {}, [], [], {})
+        for idx, section in enumerate(authz.sections()):
             if section == 'groups':
                 continue
-            for _, actions in self.authz.items(section):
-                for action in to_list(actions):
+            entries = []
+            for who, actions in authz.items(section):
+                actions = to_list(actions)
+                for action in actions:
                     if action.startswith('!'):
                         action = action[1:]
                     if action not in all_actions:
                         self.log.warning("The action %s in the [%s] section "
                                          "of %s is not a valid action.",
                                          action, section, authz_basename)
+                entry_rules = []
+                for deny, perms in groupby(actions,
+                                           key=lambda p: p.startswith('!')):
+                    if deny:
+                        perms = (p[1:] for p in perms)
+                    entry_rules.append((deny,
+                                        frozenset(ps.expand_actions(perms))))
+                entries.append((who, actions, entry_rules))
+            self._compile_section(idx, section, entries, rules)
+
+        self.authz = authz
+        self.groups_by_user = groups_by_user
+        self._rules = rules
+        self.authz_mtime = authz_mtime
 
     def normalise_resource(self, resource):
         def to_descriptor(resource):
@@ -247,25 +304,56 @@ class AuthzPolicy(Component):
     def authz_permissions(self, resource_key, username):
         # TODO: Handle permission negation in sections. eg. "if in this
         # ticket, remove TICKET_MODIFY"
+        entry = self._match_entry(resource_key, username)
+        return entry[1] if entry is not None else None
+
+    def _compile_section(self, idx, section, entries, rules):
+        """Put the section in the bucket of `rules` matching its
+        resource glob: exact resource keys, prefixes (globs with a single
+        trailing `*`) and other wildcard patterns.
+        """
+        groups_by_user, exact, prefixes, wildcards, decisions = rules
+        resource_glob = section
+        if '@' not in resource_glob:
+            resource_glob += '@*'
+        compiled = (idx, resource_glob, entries)
+        head = resource_glob[:-1]
+        if not any(c in resource_glob for c in '*?['):
+            exact.setdefault(resource_glob, []).append(compiled)
+        elif resource_glob.endswith('*') and \
+                not any(c in head for c in '*?['):
+            prefixes.append((head, compiled))
+        else:
+            wildcards.append(compiled)
+
+    def _match_entry(self, resource_key, username, rules=None):
+        """Return the first `(who, permissions, rules)` entry applying to
+        `username` in the sections matching `resource_key`, in the order
+        of the authz file, or `None`.
+        """
+        groups_by_user, exact, prefixes, wildcards, decisions = \
+            rules or self._rules
+        candidates = list(exact.get(resource_key, ()))
+        candidates.extend(compiled for prefix, compiled in prefixes
+                                   if resource_key.startswith(prefix))
+        candidates.extend(compiled for compiled in wildcards
+                                   if fnmatchcase(resource_key, compiled[1]))
+        if not candidates:
+            return None
         if username and username != 'anonymous':
-            valid_users = ['*', 'authenticated', 'anonymous', username]
+            valid_users = {'*', 'authenticated', 'anonymous', username}
         else:
-            valid_users = ['*', 'anonymous']
-        for resource_section in [a for a in self.authz.sections()
-                                   if a != 'groups']:
-            resource_glob = resource_section
-            if '@' not in resource_glob:
-                resource_glob += '@*'
-
-            if fnmatchcase(resource_key, resource_glob):
-                for who, permissions in self.authz.items(resource_section):
-                    permissions = to_list(permissions)
-                    if who in valid_users or \
-                            who in self.groups_by_user.get(username, []):
-                        self.log.debug("%s matched section %s for user %s",
-                                       resource_key, resource_glob, username)
-                        if isinstance(permissions, basestring):
-                            return [permissions]
-                        else:
-                            return permissions
+            valid_users = {'*', 'anonymous'}
+        valid_users.update(groups_by_user.get(username, ()))
+        for idx, resource_glob, entries in sorted(candidates,
+                                                  key=lambda c: c[0]):
+            for entry in entries:
+                if entry[0] in valid_users:
+                    self.log.debug("%s matched section %s for user %s",
+                                   resource_key, resource_glob, username)
+                    return entry
         return None
+
+    def _match_rules(self, resource_key, username, rules=None):
+        entry = self._match_entry(resource_key, username, rules)
+        return entry[2] if entry is not None else None
@@ -219,6 +219,46 @@ class AuthzPolicyTestCase(unittest.TestCase):
         self.assertIn('MILESTONE_VIEW', self.get_perm('authenticated',
                                                       resource))
 
+    def test_sections_checked_in_order(self):
+        """Sections are matched in order of appearance, whether their
+        pattern is an exact key, a prefix or a wildcard.
+        """
+        create_file(self.authz_file, textwrap.dedent("""\
+            [wiki:Secret?*]
+            * = !TEST_VIEW
+            [wiki:SecretPage]
+            * = TEST_ADMIN
+            [wiki:Public*]
+            * = TEST_ADMIN
+            [wiki:PublicPage@*]
+            * = !TEST_ADMIN
+            [*]
+            * = TEST_VIEW, !TEST_DELETE
+            """))
+        def check(action, id):
+            return self.check_permission(action, 'anonymous',
+                                         Resource('wiki', id))
+        self.assertFalse(check('TEST_VIEW', 'SecretPage'))
+        self.assertIsNone(check('TEST_MODIFY', 'SecretPage'))
+        self.assertTrue(check('TEST_VIEW', 'PublicPage'))
+        self.assertTrue(check('TEST_DELETE', 'PublicPage'))
+        self.assertTrue(check('TEST_VIEW', 'Other'))
+        self.assertFalse(check('TEST_DELETE', 'Other'))
+        self.assertIsNone(check('TEST_MODIFY', 'Other'))
+
+    def test_check_permissions(self):
+        authz_policy = AuthzPolicy(self.env)
+        resources = [Resource('ticket', 42), Resource('ticket', 43),
+                     Resource('wiki', 'WikiStart'), None]
+        for user in (u'änon', u'éat', 'anonymous'):
+            self.assertEqual([self.check_permission('TICKET_VIEW', user, r)
+                              for r in resources],
+                             authz_policy.check_permissions(
+                                 'TICKET_VIEW', user, resources, None))
+        self.assertEqual([Resource('ticket', 43)],
+                         self.get_perm(u'änon').filter('TICKET_VIEW',
+                                                       resources[:3]))
+
     def test_undefined_action_is_logged(self):
         """Undefined action is logged at warning level."""
         create_file(self.authz_file, textwrap.dedent("""\
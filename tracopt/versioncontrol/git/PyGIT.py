@@ -15,16 +15,20 @@
 import codecs
 import contextlib
 import io
+import mmap
 import os
 import re
+import struct
 import weakref
+from array import array
+from binascii import hexlify, unhexlify
 from collections import deque
 from functools import partial
 from subprocess import PIPE
 from threading import Lock
 
 from trac.core import TracBaseError
-from trac.util import terminate
+from trac.util import AtomicFile, terminate
 from trac.util.compat import Popen, close_fds
 from trac.util.datefmt import time_now
 from trac.util.text import to_unicode
@@ -207,7 +211,7 @@ class StorageFactory(object):
     __dict_lock = Lock()
 
     def __init__(self, repo, log, weak=True, git_bin='git',
-                 git_fs_encoding=None):
+                 git_fs_encoding=None, rev_cache_path=None):
         self.logger = log
 
         with self.__dict_lock:
@@ -222,7 +226,8 @@ class StorageFactory(object):
                 i = self.__dict[repo]
             except KeyError:
                 rev_cache = self.__dict_rev_cache.get(repo)
-                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache)
+                i = Storage(repo, log, git_bin, git_fs_encoding, rev_cache,
+                            rev_cache_path)
                 self.__dict[repo] = i
 
             # create additional reference depending on 'weak' argument
@@ -341,7 +346,7 @@ class Storage(object):
                            % (git_bin, repr(e)))
 
     def __init__(self, git_dir, log, git_bin='git', git_fs_encoding=None,
-                 rev_cache=None):
+                 rev_cache=None, rev_cache_path=None):
         """Initialize PyGit.Storage instance
 
         `git_dir`: path to .git folder;
@@ -356,6 +361,14 @@ class Storage(object):
                 if `None`, no implicit decoding/encoding to/from
                 unicode objects is performed, and bytestrings are
                 returned instead
+
+        `rev_cache_path`: path to the file in which the list of the
+                commits is stored, so that only the new commits are
+                read by `git rev-list` when the revision cache is
+                rebuilt; the revision cache itself is still built in
+                memory by each process from that list;
+                if `None`, all the commits are read each time the
+                revision cache is rebuilt
         """
 
         self.logger = log
@@ -363,6 +376,7 @@ class Storage(object):
         self.commit_encoding = None
 
         # caches
+        self.rev_cache_path = rev_cache_path
         self.__rev_cache = rev_cache or self.RevCache.empty()
         self.__rev_cache_refresh = True
         self.__rev_cache_lock = Lock()
@@ -484,9 +498,8 @@ class Storage(object):
         refs = {refname: _rev_reuse(rev) for refname, rev in refs.iteritems()}
         head_revs = {rev for refname, rev in refs.iteritems()
                          if refname.startswith('refs/heads/')}
-        rev_list = [map(_rev_reuse, line.split())
-                    for line in self.repo.rev_list('--parents', '--topo-order',
-                                                   '--all').splitlines()]
+        rev_list = [map(_rev_reuse, revs)
+                    for revs in self._get_rev_list(refs)]
         revs_seen = None
 
         if rev_list:
@@ -560,6 +573,64 @@ class Storage(object):
                           1000 * (time_now() - ts0))
         return rev_cache
 
+    def _get_rev_list(self, refs):
+        """Return the `[rev, parent, ...]` lists of all the commits, in
+        topological order from the youngest one.
+
+        If `rev_cache_path` is set, the lists are read from that file
+        when it has been written for the same `refs`. Otherwise only
+        the commits which are not in the file are read by
+        `git rev-list`, and the file is updated.
+        """
+        if not self.rev_cache_path:
+            return self._rev_list('--all')
+
+        rev_list = None
+        try:
+            cached = _read_rev_list_file(self.rev_cache_path)
+        except (EnvironmentError, ValueError) as e:
+            self.logger.warning("Ignoring the revision list file '%s' of "
+                                "'%s': %s", self.rev_cache_path,
+                                self.repo_path, e)
+            cached = None
+        if cached:
+            cached_refs, cached_rev_list = cached
+            if cached_refs == refs:
+                self.logger.debug("read %d commits of '%s' from '%s'",
+                                  len(cached_rev_list), self.repo_path,
+                                  self.rev_cache_path)
+                return cached_rev_list
+            # The commits are immutable: the commits which aren't
+            # reachable from the previous refs are younger than all of
+            # the cached ones.
+            cached_revs = set(revs[0] for revs in cached_rev_list)
+            tips = sorted(set(rev for refname, rev in cached_refs.iteritems()
+                              if refname != 'HEAD' and rev in cached_revs))
+            rev_list = self._rev_list('--all', '--not', *tips) + \
+                       cached_rev_list
+            # Fall back to a full rebuild when commits are no longer
+            # reachable, e.g. after the removal of a branch.
+            count = self.repo.rev_list('--count', '--all').strip()
+            if count != str(len(rev_list)):
+                self.logger.debug("rebuilding the revision list of '%s' "
+                                  "(%d commits cached, %s reachable)",
+                                  self.repo_path, len(rev_list), count)
+                rev_list = None
+        if rev_list is None:
+            rev_list = self._rev_list('--all')
+        try:
+            _write_rev_list_file(self.rev_cache_path, refs, rev_list)
+        except (EnvironmentError, ValueError) as e:
+            self.logger.warning("Can't write the revision list file '%s' "
+                                "of '%s': %s", self.rev_cache_path,
+                                self.repo_path, e)
+        return rev_list
+
+    def _rev_list(self, *args):
+        return [line.split()
+                for line in self.repo.rev_list('--parents', '--topo-order',
+                                               *args).splitlines()]
+
     def _get_refs(self):
         refs = {}
         tags = {}
@@ -1069,3 +1140,73 @@ class Storage(object):
                                   name, git_dir)
                 return False
         return True
+
+
+# The revision list file holds a header, the binary sha1 of the commits,
+# the offsets of the parents of each commit in the array of the indexes
+# of the parents, that array, and finally the refs, one "refname value"
+# per line. The integers are unsigned 32 bits, in native byte order.
+_REV_LIST_MAGIC = 'TracRevList1'
+_REV_LIST_HEADER = struct.Struct('=12sIII')
+
+
+def _read_rev_list_file(path):
+    """Return the `(refs, rev_list)` stored in the revision list file,
+    or `None` if the file doesn't exist.
+    """
+    try:
+        f = open(path, 'rb')
+    except EnvironmentError:
+        if not os.path.exists(path):
+            return None
+        raise
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _REV_LIST_HEADER.size:
+            raise ValueError("truncated file")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, num_revs, num_parents, refs_size = \
+            _REV_LIST_HEADER.unpack_from(data)
+        if magic != _REV_LIST_MAGIC:
+            raise ValueError("invalid file format")
+        offsets = array('I')
+        parents = array('I')
+        start = _REV_LIST_HEADER.size
+        end = start + 20 * num_revs
+        revs = [hexlify(data[idx:idx + 20]) for idx in xrange(start, end, 20)]
+        start, end = end, end + offsets.itemsize * (num_revs + 1)
+        offsets.fromstring(data[start:end])
+        start, end = end, end + parents.itemsize * num_parents
+        parents.fromstring(data[start:end])
+        if end + refs_size != size:
+            raise ValueError("truncated file")
+        refs = dict(line.split(' ', 1)
+                    for line in data[end:size].splitlines())
+    finally:
+        data.close()
+    rev_list = [[rev] + [revs[idx] for idx in parents[begin:end]]
+                for rev, begin, end in zip(revs, offsets, offsets[1:])]
+    return refs, rev_list
+
+
+def _write_rev_list_file(path, refs, rev_list):
+    """Write the `refs` and the `rev_list` to the revision list file."""
+    indexes = {revs[0]: idx for idx, revs in enumerate(rev_list)}
+    offsets = array('I', [0])
+    parents = array('I')
+    for revs in rev_list:
+        for rev in revs[1:]:
+            if rev not in indexes:  # e.g. in a shallow repository
+                raise ValueError("parent %s of %s is missing" % (rev, revs[0]))
+            parents.append(indexes[rev])
+        offsets.append(len(parents))
+    refs = ''.join('%s %s\n' % item for item in sorted(refs.iteritems()))
+    with AtomicFile(path, 'wb') as f:
+        f.write(_REV_LIST_HEADER.pack(_REV_LIST_MAGIC, len(rev_list),
+                                      len(parents), len(refs)))
+        for revs in rev_list:
+            f.write(unhexlify(revs[0]))
+        f.write(offsets.tostring())
+        f.write(parents.tostring())
+        f.write(refs)
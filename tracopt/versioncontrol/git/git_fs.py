@@ -13,6 +13,7 @@
 # history and logs, available at http://trac.edgewall.org/log/.
 
 from datetime import datetime
+import hashlib
 import itertools
 import os
 
@@ -306,6 +307,18 @@ class GitConnector(Component):
     cached_repository = BoolOption('git', 'cached_repository', 'false',
         """Wrap `GitRepository` in `CachedRepository`.""")
 
+    rev_cache_dir = PathOption('git', 'rev_cache_dir', '',
+        """Directory in which the list of the commits of each repository
+        is stored, so that the processes don't run `git rev-list` for all
+        the commits, and only the new commits are read when the refs
+        change. Each process still builds its in-memory revision cache
+        from that list, so the memory used by the workers is not
+        reduced. The directory must be writable by the web server.
+        Relative paths are resolved relative to the `conf` directory of
+        the environment. If empty, the commits are read from Git by each
+        process.
+        (''since 1.3.4'')""")
+
     shortrev_len = IntOption('git', 'shortrev_len', 7,
         """The length at which a sha1 is abbreviated (must be >= 4
         and <= 40).
@@ -393,6 +406,7 @@ class GitConnector(Component):
 
         repos = GitRepository(self.env, dir, params, self.log,
                               persistent_cache=self.persistent_cache,
+                              rev_cache_dir=self.rev_cache_dir,
                               git_bin=self.git_bin,
                               git_fs_encoding=self.git_fs_encoding,
                               shortrev_len=self.shortrev_len,
@@ -502,6 +516,7 @@ class GitRepository(Repository):
 
     def __init__(self, env, path, params, log,
                  persistent_cache=False,
+                 rev_cache_dir=None,
                  git_bin='git',
                  git_fs_encoding='utf-8',
                  shortrev_len=7,
@@ -520,10 +535,17 @@ class GitRepository(Repository):
         self.use_committer_time = use_committer_time
         self.use_committer_id = use_committer_id
 
+        if rev_cache_dir:
+            key = hashlib.sha1(to_unicode(path).encode('utf-8')).hexdigest()
+            rev_cache_path = os.path.join(rev_cache_dir, key + '.revlist')
+        else:
+            rev_cache_path = None
+
         try:
             factory = PyGIT.StorageFactory(path, log, not persistent_cache,
                                            git_bin=git_bin,
-                                           git_fs_encoding=git_fs_encoding)
+                                           git_fs_encoding=git_fs_encoding,
+                                           rev_cache_path=rev_cache_path)
             self._git = factory.getInstance()
         except PyGIT.GitError as e:
             log.error(exception_to_unicode(e))
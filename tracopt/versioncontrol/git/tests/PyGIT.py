@@ -272,6 +272,64 @@ class NormalTestCase(unittest.TestCase, GitCommandMixin):
                          sorted(b[0] for b in storage.get_branches()))
         self.assertFalse(storage.sync())
 
+    def _storage_with_rev_list_file(self):
+        path = os.path.join(self.repos_path, '.git')
+        return Storage(path, self.env.log, self.git_bin, 'utf-8',
+                       rev_cache_path=os.path.join(self.repos_path,
+                                                   'revlist'))
+
+    def _assert_same_rev_cache(self, storage):
+        expected = self._storage().rev_cache
+        rev_cache = storage.rev_cache
+        self.assertEqual(expected.youngest_rev, rev_cache.youngest_rev)
+        self.assertEqual(expected.oldest_rev, rev_cache.oldest_rev)
+        self.assertEqual(expected.rev_dict, rev_cache.rev_dict)
+        self.assertEqual(expected.refs_dict, rev_cache.refs_dict)
+
+    def test_rev_list_file(self):
+        self._git('checkout', '-b', 'b1', 'master')
+        self._git_commit('-m', 'commit on b1', '--allow-empty',
+                         date=datetime(2014, 1, 29, 13, 13, 25))
+        self._git('checkout', 'master')
+        self._git('merge', '--no-ff', '-m', 'merge b1', 'b1')
+        storage = self._storage_with_rev_list_file()
+        self._assert_same_rev_cache(storage)
+        self.assertTrue(os.path.isfile(storage.rev_cache_path))
+
+        # The commits are read from the file
+        storage = self._storage_with_rev_list_file()
+        storage.repo = None
+        storage._get_refs = lambda: self._storage()._get_refs()
+        self.assertEqual(3, len(storage.get_commits()))
+
+    def test_rev_list_file_updated(self):
+        storage = self._storage_with_rev_list_file()
+        storage.sync()
+        self._git('checkout', '-b', 'b1', 'master')
+        for idx in xrange(2):
+            self._git_commit('-m', 'commit %d on b1' % idx, '--allow-empty',
+                             date=datetime(2014, 1, 29, 13, 13, 25 + idx))
+        self._git('tag', 't1')
+        self.assertTrue(storage.sync())
+        self._assert_same_rev_cache(storage)
+        self.assertEqual(3, len(storage._get_rev_list(
+            self._storage()._get_refs())))
+
+        # The cached commits are dropped when they aren't reachable
+        self._git('checkout', 'master')
+        self._git('branch', '-D', 'b1')
+        self._git('tag', '-d', 't1')
+        storage = self._storage_with_rev_list_file()
+        self._assert_same_rev_cache(storage)
+        self.assertEqual(1, len(storage.get_commits()))
+
+    def test_rev_list_file_invalid(self):
+        storage = self._storage_with_rev_list_file()
+        create_file(storage.rev_cache_path, 'invalid')
+        self._assert_same_rev_cache(storage)
+        storage = self._storage_with_rev_list_file()
+        self._assert_same_rev_cache(storage)
+
     def test_turn_off_persistent_cache(self):
         # persistent_cache is enabled
         parent_rev = self._factory(False).getInstance().youngest_rev()
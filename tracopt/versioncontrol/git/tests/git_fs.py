@@ -203,6 +203,22 @@ class PersistentCacheTestCase(BaseTestCase):
         self.assertNotEqual(youngest, self._repository.youngest_rev)
         self.assertEqual(youngest_2, self._repository.youngest_rev)
 
+    def test_rev_cache_dir(self):
+        self.env.config.set('git', 'rev_cache_dir', self.tmpdir)
+        self._git_init()
+        self._add_repository()
+        youngest = self._repository.youngest_rev
+        self.assertEqual(1, len([name for name in os.listdir(self.tmpdir)
+                                 if name.endswith('.revlist')]))
+        self._repomgr.reload_repositories()  # clear repository cache
+
+        self._commit(datetime(2014, 1, 29, 16, 44, 54, 0, utc))
+        self._repository.sync()
+        self.assertNotEqual(youngest, self._repository.youngest_rev)
+        self.assertEqual(youngest,
+                         self._repository.previous_rev(
+                             self._repository.youngest_rev))
+
     def _commit(self, date):
         gitignore = os.path.join(self.repos_path, '.gitignore')
         create_file(gitignore, date.isoformat())